@@ -0,0 +1,197 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Microbenchmarks of the codec hot path: frame header, rpc packets and Meta,
+# at several payload sizes. For each benchmark reports ns/op, ops/sec and the
+# bytes allocated per op (peak traced by tracemalloc during a single op).
+# The results can be saved as json, and compared with a baseline saved on the
+# same machine: the exit code is 1 if a benchmark is slower (or allocates more)
+# than the baseline by more than the threshold.
+#
+#   python benchmarks/bench_codec.py --save baseline.json
+#   python benchmarks/bench_codec.py --baseline baseline.json [--threshold 0.2] [--filter packet]
+
+import argparse
+import json
+import platform
+import sys
+import tracemalloc
+from time import perf_counter_ns
+
+from dnaco.rpc.frame import FrameReader, build_frame_header, parse_frame_header
+from dnaco.rpc.meta import Meta
+from dnaco.rpc.packet import RpcPacketBuilder, RpcRequest, RpcResponse, parse_rpc_packet
+from dnaco.util import humans
+
+PAYLOAD_SIZES = (0, 100, 4 << 10, 64 << 10, 1 << 20)
+# allocations below this delta are not reported as regressions
+ALLOC_REGRESSION_MIN_BYTES = 64
+
+
+def frame_benchmarks():
+    header = build_frame_header(1, False, 1 << 20)
+    yield 'frame/build_header', lambda: build_frame_header(1, False, 1 << 20)
+    yield 'frame/parse_header', lambda: parse_frame_header(header)
+
+
+def packet_benchmarks(size):
+    builder = RpcPacketBuilder(1)
+    body = b'x' * size
+    req = builder.new_request(1, RpcRequest.OP_TYPE_READ, b'/bench/packet', body)
+    resp = builder.new_response(1, 1, RpcResponse.OP_STATUS_SUCCEEDED, 1234, 56789, body)
+    yield 'packet/new_request/%d' % size, lambda: builder.new_request(1, RpcRequest.OP_TYPE_READ, b'/bench/packet', body)
+    yield 'packet/new_response/%d' % size, lambda: builder.new_response(1, 1, RpcResponse.OP_STATUS_SUCCEEDED, 1234, 56789, body)
+    yield 'packet/parse_request/%d' % size, lambda: parse_rpc_packet(FrameReader(req))
+    yield 'packet/parse_response/%d' % size, lambda: parse_rpc_packet(FrameReader(resp))
+
+
+def _build_meta(value):
+    meta = Meta()
+    meta.add_null('null')
+    meta.add_bool('bool', True)
+    meta.add_int('int', 1 << 40)
+    meta.add_float('float', 3.14)
+    meta.add_string('string', 'dnaco')
+    meta.add_bytes('bytes', value)
+    meta.add_array('array', [1, 2, 3])
+    meta.add_object('object', {'k': 'v'})
+    return meta.get_data()
+
+
+def meta_benchmarks(size):
+    value = b'x' * size
+    data = _build_meta(value)
+    view = memoryview(data)
+    yield 'meta/add/%d' % size, lambda: _build_meta(value)
+    yield 'meta/parse/%d' % size, lambda: Meta.parse(data)
+    yield 'meta/parse_view/%d' % size, lambda: Meta.parse(view)
+
+
+def all_benchmarks():
+    yield from frame_benchmarks()
+    for size in PAYLOAD_SIZES:
+        yield from packet_benchmarks(size)
+    for size in PAYLOAD_SIZES:
+        yield from meta_benchmarks(size)
+
+
+def measure_time(func, min_time_ns):
+    # warmup, then run batches of growing size until min_time_ns elapsed
+    for _ in range(16):
+        func()
+    count = 0
+    batch = 16
+    start = perf_counter_ns()
+    while True:
+        for _ in range(batch):
+            func()
+        count += batch
+        elapsed = perf_counter_ns() - start
+        if elapsed >= min_time_ns:
+            return elapsed / count
+        batch = min(batch * 2, 1 << 16)
+
+
+def _reset_peak():
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        # python < 3.9: restarting the tracing resets the peak
+        tracemalloc.stop()
+        tracemalloc.start()
+
+
+def measure_alloc(func, runs=16):
+    # peak bytes traced while executing a single op, averaged over runs
+    total = 0
+    tracemalloc.start()
+    try:
+        for _ in range(runs):
+            _reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - current
+    finally:
+        tracemalloc.stop()
+    return total // runs
+
+
+def run_benchmarks(min_time_ns, name_filter=None):
+    results = {}
+    for name, func in all_benchmarks():
+        if name_filter and name_filter not in name:
+            continue
+        ns_op = measure_time(func, min_time_ns)
+        alloc_bytes = measure_alloc(func)
+        results[name] = {'ns_op': ns_op, 'ops_sec': 1e9 / ns_op, 'alloc_bytes_op': alloc_bytes}
+        print(' - %-32s %12s/op %14.0f ops/sec %12s/op' % (name, humans.human_time_diff_ns(int(ns_op)),
+                                                         1e9 / ns_op, humans.human_size(alloc_bytes)))
+    return results
+
+
+def compare_results(baseline, results, threshold):
+    # returns the list of regressions (name, metric, baseline value, current value)
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if current['ns_op'] > base['ns_op'] * (1 + threshold):
+            regressions.append((name, 'ns_op', base['ns_op'], current['ns_op']))
+        alloc_delta = current['alloc_bytes_op'] - base['alloc_bytes_op']
+        if alloc_delta > ALLOC_REGRESSION_MIN_BYTES and current['alloc_bytes_op'] > base['alloc_bytes_op'] * (1 + threshold):
+            regressions.append((name, 'alloc_bytes_op', base['alloc_bytes_op'], current['alloc_bytes_op']))
+    return regressions
+
+
+def _human_delta(base_value, value):
+    if base_value == 0:
+        # e.g. no allocations in the baseline
+        return 'new'
+    return '%+.1f%%' % (100.0 * (value - base_value) / base_value)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--min-time', type=float, default=0.2, help='min time in sec for each benchmark')
+    parser.add_argument('--filter', help='run only the benchmarks with this substring in the name')
+    parser.add_argument('--save', help='save the results to this json file')
+    parser.add_argument('--baseline', help='compare the results with this json file')
+    parser.add_argument('--threshold', type=float, default=0.2, help='max slowdown allowed (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    results = run_benchmarks(int(args.min_time * humans.UNIT_SEC), args.filter)
+
+    if args.save:
+        with open(args.save, 'w') as fd:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'results': results},
+                      fd, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as fd:
+            baseline = json.load(fd)['results']
+        regressions = compare_results(baseline, results, args.threshold)
+        for name, metric, base_value, value in regressions:
+            print('REGRESSION %s %s: %.0f -> %.0f (%s)' % (name, metric, base_value, value,
+                                                          _human_delta(base_value, value)))
+        if regressions:
+            sys.exit(1)
+        print('no regressions above %.0f%%' % (args.threshold * 100))
+
+
+if __name__ == '__main__':
+    main()
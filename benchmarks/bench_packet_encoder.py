@@ -0,0 +1,100 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compare the concatenation-based packet encoding (rpc head + sub-head + body,
+# then the frame header) with the single-buffer encoder of RpcPacketBuilder,
+# for the request and the response of a 100B and a 10MB body.
+#
+#   python benchmarks/bench_packet_encoder.py [--min-time SEC]
+
+import argparse
+from time import perf_counter_ns
+
+from dnaco.rpc.frame import build_frame_header
+from dnaco.rpc.packet import RpcPacketBuilder, RpcRequest, RpcResponse
+from dnaco.util import humans
+
+
+# the concatenation-based encoding, replaced by the single-buffer encoder
+def _int_length(value):
+    return ((value.bit_length() + 7) // 8) if value > 0 else 1
+
+
+def concat_rpc_head(pkg_type, trace_id, pkg_id):
+    trace_id_len = _int_length(trace_id)
+    pkg_id_len = _int_length(pkg_id)
+    rpc_head = (pkg_type << 6) | ((trace_id_len - 1) << 3) | (pkg_id_len - 1)
+    return bytes([rpc_head]) + trace_id.to_bytes(trace_id_len, byteorder='little') + pkg_id.to_bytes(pkg_id_len, byteorder='little')
+
+
+def concat_request_frame(trace_id, pkg_id, op_type, request_id, body):
+    req_head = (op_type << 14) | ((len(request_id) - 1) << 6)
+    req = req_head.to_bytes(2, byteorder='big') + request_id + body
+    req = concat_rpc_head(0, trace_id, pkg_id) + req
+    return build_frame_header(1, False, len(req)) + req
+
+
+def concat_response_frame(trace_id, pkg_id, op_status, queue_time, exec_time, body):
+    queue_time_len = _int_length(queue_time)
+    exec_time_len = _int_length(exec_time)
+    resp_head = (op_status << 6) | ((queue_time_len - 1) << 3) | (exec_time_len - 1)
+    resp = bytes([resp_head]) + queue_time.to_bytes(queue_time_len, byteorder='little') + \
+        exec_time.to_bytes(exec_time_len, byteorder='little') + body
+    resp = concat_rpc_head(1, trace_id, pkg_id) + resp
+    return build_frame_header(1, False, len(resp)) + resp
+
+
+def bench(name, func, min_time_ns):
+    # run func() until min_time_ns elapsed, returns ns/op
+    count = 0
+    batch = 1
+    start = perf_counter_ns()
+    while True:
+        for _ in range(batch):
+            func()
+        count += batch
+        elapsed = perf_counter_ns() - start
+        if elapsed >= min_time_ns:
+            break
+        batch = min(batch * 2, 1 << 16)
+    ns_op = elapsed / count
+    print(' - %-40s %12s/op %14.0f ops/sec' % (name, humans.human_time_diff_ns(int(ns_op)), 1e9 / ns_op))
+    return ns_op
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--min-time', type=float, default=1.0)
+    args = parser.parse_args()
+    min_time_ns = int(args.min_time * humans.UNIT_SEC)
+
+    builder = RpcPacketBuilder(1)
+    for size in (100, 10 << 20):
+        body = b'x' * size
+        print('body %s' % humans.human_size(size))
+        concat = bench('concat request frame', lambda: concat_request_frame(1, 2, RpcRequest.OP_TYPE_READ, b'/bench', body), min_time_ns)
+        single = bench('single-buffer request frame', lambda: builder.new_request_frame(1, RpcRequest.OP_TYPE_READ, b'/bench', body), min_time_ns)
+        vectored = bench('vectored request frame', lambda: builder.new_request_frame(1, RpcRequest.OP_TYPE_READ, b'/bench', body, vectored=True), min_time_ns)
+        print('   speedup single-buffer %.2fx, vectored %.2fx' % (concat / single, concat / vectored))
+
+        concat = bench('concat response frame', lambda: concat_response_frame(1, 2, RpcResponse.OP_STATUS_SUCCEEDED, 1234, 56789, body), min_time_ns)
+        single = bench('single-buffer response frame', lambda: builder.new_response_frame(1, 2, RpcResponse.OP_STATUS_SUCCEEDED, 1234, 56789, body), min_time_ns)
+        vectored = bench('vectored response frame', lambda: builder.new_response_frame(1, 2, RpcResponse.OP_STATUS_SUCCEEDED, 1234, 56789, body, vectored=True), min_time_ns)
+        print('   speedup single-buffer %.2fx, vectored %.2fx' % (concat / single, concat / vectored))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Cost of the per-route telemetry recorded by the server for each request
+# (queue/exec time and request/response size histograms, slowest calls TopK):
+# the recording alone, Histogram.add() compared with the linear bucket scan,
+# and packet_handle() of an inline handler with and without the recording.
+# Also the cost of the span tracing check, disabled and for a request not sampled.
+#
+#   python benchmarks/bench_route_telemetry.py [--min-time SEC] [--routes N]
+
+import argparse
+import asyncio
+from time import perf_counter_ns, time_ns
+
+from dnaco.rpc import server
+from dnaco.rpc import tracing
+from dnaco.rpc.packet import RpcPacketBuilder, RpcRequest
+from dnaco.telemetry.histogram import Histogram
+from dnaco.util import humans
+
+
+@server.rpc_handler('/bench/telemetry')
+def _bench_handler(packet):
+    return b'resp'
+
+
+def legacy_histogram_add(histo, value):
+    index = 0
+    bounds = histo.bounds
+    while (index < len(bounds)) and (value > bounds[index]):
+        index += 1
+    histo.events[index] += 1
+    histo.vmax = max(histo.vmax, value)
+
+
+def bench(name, func, min_time_ns):
+    # run func() until min_time_ns elapsed, returns ns/op
+    count = 0
+    batch = 1
+    start = perf_counter_ns()
+    while True:
+        for _ in range(batch):
+            func()
+        count += batch
+        elapsed = perf_counter_ns() - start
+        if elapsed >= min_time_ns:
+            break
+        batch = min(batch * 2, 1 << 16)
+    ns_op = elapsed / count
+    print(' - %-40s %12s/op %14.0f ops/sec' % (name, humans.human_time_diff_ns(int(ns_op)), 1e9 / ns_op))
+    return ns_op
+
+
+async def bench_async(name, func, min_time_ns):
+    # await func() until min_time_ns elapsed, returns ns/op
+    count = 0
+    start = perf_counter_ns()
+    while True:
+        for _ in range(256):
+            await func()
+        count += 256
+        elapsed = perf_counter_ns() - start
+        if elapsed >= min_time_ns:
+            break
+    ns_op = elapsed / count
+    print(' - %-40s %12s/op %14.0f ops/sec' % (name, humans.human_time_diff_ns(int(ns_op)), 1e9 / ns_op))
+    return ns_op
+
+
+async def bench_packet_handle(min_time_ns):
+    req = RpcPacketBuilder(1).new_request(1, RpcRequest.OP_TYPE_READ, b'/bench/telemetry', b'x' * 100)
+    func = lambda: server.packet_handle(1, False, time_ns(), req)
+    record_route_stats = server._record_route_stats
+    server._record_route_stats = lambda route, packet, queue_ns, exec_ns, resp_body: None
+    try:
+        without = await bench_async('packet_handle() without telemetry', func, min_time_ns)
+    finally:
+        server._record_route_stats = record_route_stats
+    with_telemetry = await bench_async('packet_handle() with telemetry', func, min_time_ns)
+    print('   telemetry overhead %s/request (%.1f%%)' % (
+        humans.human_time_diff_ns(int(with_telemetry - without)), 100.0 * (with_telemetry - without) / without))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--min-time', type=float, default=1.0)
+    parser.add_argument('--routes', type=int, default=8, help='number of distinct routes recorded')
+    args = parser.parse_args()
+    min_time_ns = int(args.min_time * humans.UNIT_SEC)
+
+    histo = Histogram(Histogram.DEFAULT_NS_DURATION_BOUNDS)
+    bench('histogram add (linear scan)', lambda: legacy_histogram_add(histo, 3_000_000), min_time_ns)
+    bench('histogram add (bisect)', lambda: histo.add(3_000_000), min_time_ns)
+
+    routes = [server.RpcRoute('/bench/route-%d' % i, _bench_handler) for i in range(args.routes)]
+    packet = RpcPacketBuilder(1).new_request(1, RpcRequest.OP_TYPE_READ, b'/bench/route-0', b'x' * 100)
+    packet = server.parse_rpc_packet(server.FrameReader(packet))
+    state = {'index': 0}
+
+    # exec times spread over a few buckets, so only some of them are a new max of the TopK
+    exec_times = [(i * 7919) % 5_000_000 for i in range(1024)]
+    resp_body = b'x' * 100
+
+    def _record():
+        index = state['index'] = state['index'] + 1
+        route = routes[index % len(routes)]
+        server._record_route_stats(route, packet, 25_000, exec_times[index & 1023], resp_body)
+
+    bench('record route stats (%d routes)' % args.routes, _record, min_time_ns)
+
+    old_tracer = tracing.set_rpc_tracer(None)
+    try:
+        bench('span begin (tracing disabled)', lambda: tracing.rpc_server_span_begin(3, 'route', 0), min_time_ns)
+        tracer = tracing.RpcTracer(0.0)
+        tracing.set_rpc_tracer(tracer)
+        bench('span begin (not sampled)', lambda: tracing.rpc_server_span_begin(3, 'route', 0), min_time_ns)
+        span = tracing.RpcServerSpan(tracer, 3, 'route', 0)
+        bench('record sampled request spans', lambda: span.record_exec(25_000, 3_000_000), min_time_ns)
+    finally:
+        tracing.set_rpc_tracer(old_tracer)
+    asyncio.run(bench_packet_handle(min_time_ns))
+
+
+if __name__ == '__main__':
+    main()
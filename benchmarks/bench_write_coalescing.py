@@ -0,0 +1,139 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compare the coalescing FrameWriter used by frame_handle with a writer
+# sending every response frame with its own writelines(), on the same
+# pipelined frame_handle (up to --inflight handlers per connection).
+# The workload is small-response echo: the client pipelines N frames and the
+# server replies to each one. The server-side listening socket is a
+# CountingSocket, so every send()/sendmsg() syscall issued by the accepted
+# connections is counted.
+#
+#   python benchmarks/bench_write_coalescing.py [--frames N] [--size BYTES] [--inflight N]
+
+import argparse
+import asyncio
+import socket
+from time import perf_counter_ns
+
+from dnaco.rpc.frame import build_frame_header
+from dnaco.rpc import server
+from dnaco.rpc.server import FrameWriter, frame_handle
+from dnaco.util import humans
+
+
+class CountingSocket(socket.socket):
+    send_calls = 0
+
+    def send(self, *args, **kwargs):
+        CountingSocket.send_calls += 1
+        return super().send(*args, **kwargs)
+
+    def sendmsg(self, *args, **kwargs):
+        CountingSocket.send_calls += 1
+        return super().sendmsg(*args, **kwargs)
+
+    def accept(self):
+        fd, addr = self._accept()
+        sock = CountingSocket(self.family, self.type, self.proto, fileno=fd)
+        if socket.getdefaulttimeout() is None and self.gettimeout():
+            sock.setblocking(True)
+        return sock, addr
+
+
+class DirectFrameWriter(FrameWriter):
+    # one transport write per response frame, without waiting the end of the loop iteration
+    def write(self, rev, write_to_wal, data):
+        self.transport.writelines([build_frame_header(rev, write_to_wal, len(data)), data])
+
+
+async def echo_handler(rev, write_to_wal, req_recv_ns, data):
+    return rev, write_to_wal, data
+
+
+async def run_workload(conn_handler, frames, size, inflight):
+    listen_sock = CountingSocket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listen_sock.bind(('127.0.0.1', 0))
+    server = await asyncio.start_server(conn_handler, sock=listen_sock)
+    port = listen_sock.getsockname()[1]
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    frame = build_frame_header(1, False, size) + (b'x' * size)
+
+    async def _send_loop():
+        # keep at most `inflight` requests on the wire
+        for i in range(frames):
+            await window.acquire()
+            writer.write(frame)
+            if (i % inflight) == 0:
+                await writer.drain()
+        await writer.drain()
+
+    async def _recv_loop():
+        for _ in range(frames):
+            header = await reader.readexactly(4)
+            await reader.readexactly(int.from_bytes(header, byteorder='big') & 0x7ffffff)
+            window.release()
+
+    window = asyncio.Semaphore(inflight)
+    CountingSocket.send_calls = 0
+    start_ns = perf_counter_ns()
+    await asyncio.gather(_send_loop(), _recv_loop())
+    elapsed_ns = perf_counter_ns() - start_ns
+    send_calls = CountingSocket.send_calls
+
+    writer.close()
+    await writer.wait_closed()
+    # let the server connection handler see the EOF and close
+    await asyncio.sleep(0.1)
+    server.close()
+    await server.wait_closed()
+    return elapsed_ns, send_calls
+
+
+def report(name, frames, elapsed_ns, send_calls):
+    print('%-12s %10s frames/sec %8.3f send/frame %10s send calls %s' % (
+        name,
+        humans.human_count(int(frames * humans.UNIT_SEC / elapsed_ns)),
+        send_calls / frames,
+        humans.human_count(send_calls),
+        humans.human_time_diff_ns(elapsed_ns)
+    ))
+
+
+async def main(frames, size, inflight):
+    print('frames=%d response-size=%s inflight=%d' % (frames, humans.human_size(size), inflight))
+    # frame_handle() creates the server FrameWriter of each connection
+    server.FrameWriter = DirectFrameWriter
+    try:
+        elapsed_ns, send_calls = await run_workload(
+            lambda r, w: frame_handle(r, w, echo_handler, inflight), frames, size, inflight)
+    finally:
+        server.FrameWriter = FrameWriter
+    report('direct', frames, elapsed_ns, send_calls)
+
+    elapsed_ns, send_calls = await run_workload(
+        lambda r, w: frame_handle(r, w, echo_handler, inflight), frames, size, inflight)
+    report('coalescing', frames, elapsed_ns, send_calls)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=100000)
+    parser.add_argument('--size', type=int, default=100)
+    parser.add_argument('--inflight', type=int, default=64)
+    args = parser.parse_args()
+    asyncio.run(main(args.frames, args.size, args.inflight))
@@ -16,29 +16,17 @@
 
 import asyncio
 
-from dnaco.rpc.frame import FrameReader, build_frame_header
-from dnaco.rpc.packet import RpcPacketBuilder, RpcRequest, parse_rpc_packet
-from dnaco.rpc.server import read_frame, rpc_handle, rpc_handler
+from dnaco.rpc.client import RpcClient
+from dnaco.rpc.server import rpc_handle, rpc_handler
 
 
 async def client_loop(port):
-    reader, writer = await asyncio.open_connection('127.0.0.1', port)
-    try:
-        pkg_builder = RpcPacketBuilder(1)
-        req = pkg_builder.new_request(1, RpcRequest.OP_TYPE_READ, b'/test', b'req-body')
-        print('write', req)
-        writer.write(build_frame_header(1, False, len(req)))
-        writer.write(req)
-        await writer.drain()
-
-        _, rev, write_to_wal, data = await read_frame(reader)
-        resp_reader = FrameReader(data)
-        resp_packet = parse_rpc_packet(resp_reader)
-        print('CLIENT: received packet', rev, write_to_wal, resp_packet)
-
-    finally:
-        writer.close()
-        await writer.wait_closed()
+    async with RpcClient(rev=1, pool_size=2, timeout=5) as client:
+        responses = await asyncio.gather(*[
+            client.call('127.0.0.1', port, '/test', b'req-body-%d' % i) for i in range(8)
+        ])
+        for resp_packet in responses:
+            print('CLIENT: received packet', resp_packet)
 
 
 @rpc_handler('/test')
@@ -0,0 +1,104 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from time import time_ns
+
+from dnaco.telemetry.collector import TelemetryCollector
+from dnaco.telemetry.counter_map import CounterMap
+from dnaco.telemetry.gauge_map import GaugeMap
+from dnaco.util import humans
+
+rpc_admission_shed = TelemetryCollector.register(
+    name='dnaco_rpc_admission_shed',
+    label='RPC Requests Shed',
+    help_descr='Requests rejected by the admission controller, by route',
+    unit=humans.HUMAN_COUNT,
+    collector=CounterMap()
+)
+
+rpc_admission_limit = TelemetryCollector.register(
+    name='dnaco_rpc_admission_limit',
+    label='RPC Admission Concurrency Limit',
+    help_descr='Current in-flight requests limit, by route',
+    unit=humans.HUMAN_COUNT,
+    collector=GaugeMap()
+)
+
+
+class _RouteAdmission:
+    def __init__(self, limit):
+        self.inflight = 0
+        self.limit = limit
+        self.first_above_ns = 0
+        self.last_backoff_ns = None
+
+
+class RpcAdmissionController:
+    # Per-route admission control, driven by the queue time measured in packet_handle().
+    # - CoDel: the queue delay is allowed to be above target_queue_ns for at most
+    #   interval_ns. If it stays above target for longer, the queue is considered
+    #   standing and the requests with queue delay above target are rejected.
+    # - Adaptive concurrency (AIMD): each route has an in-flight limit, increased
+    #   by ~1 every `limit` completions with queue delay below target, and
+    #   decreased by backoff_ratio on a completion above target, at most once
+    #   every interval_ns (a burst of slow completions is a single congestion event).
+    #   requests over the limit are rejected.
+    def __init__(self, target_queue_ns=5 * humans.UNIT_MS, interval_ns=100 * humans.UNIT_MS,
+                 initial_limit=32, min_limit=1, max_limit=1024, backoff_ratio=0.9):
+        self.target_queue_ns = target_queue_ns
+        self.interval_ns = interval_ns
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.routes = {}
+
+    def _route(self, name):
+        route = self.routes.get(name)
+        if route is None:
+            route = _RouteAdmission(self.initial_limit)
+            self.routes[name] = route
+            rpc_admission_limit.set(name, int(route.limit))
+        return route
+
+    def admit(self, name, queue_ns, now_ns):
+        route = self._route(name)
+        if route.inflight >= int(route.limit):
+            rpc_admission_shed.inc(name)
+            return False
+
+        if queue_ns < self.target_queue_ns:
+            route.first_above_ns = 0
+        elif route.first_above_ns == 0:
+            route.first_above_ns = now_ns
+        elif (now_ns - route.first_above_ns) >= self.interval_ns:
+            rpc_admission_shed.inc(name)
+            return False
+
+        route.inflight += 1
+        return True
+
+    def release(self, name, queue_ns, now_ns=None):
+        route = self.routes[name]
+        route.inflight -= 1
+        if queue_ns > self.target_queue_ns:
+            now_ns = now_ns or time_ns()
+            if route.last_backoff_ns is None or (now_ns - route.last_backoff_ns) >= self.interval_ns:
+                route.last_backoff_ns = now_ns
+                route.limit = max(self.min_limit, route.limit * self.backoff_ratio)
+        else:
+            route.limit = min(self.max_limit, route.limit + (1.0 / route.limit))
+        rpc_admission_limit.set(name, int(route.limit))
@@ -0,0 +1,85 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+from dnaco.telemetry.collector import TelemetryCollector
+from dnaco.telemetry.histogram import Histogram
+from dnaco.util import humans
+
+rpc_batch_size = TelemetryCollector.register(
+    name='dnaco_rpc_batch_size',
+    label='RPC Micro-Batch Size',
+    help_descr='Number of requests executed by a single batch handler call',
+    unit=humans.HUMAN_COUNT,
+    collector=Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024])
+)
+
+
+class RpcRequestBatcher:
+    # Group the concurrent requests to a route: the requests received within
+    # max_batch_delay_ns from the first one (or until max_batch_size requests
+    # are pending) are executed with a single exec_func(packets) call.
+    # exec_func returns (start_ns, end_ns, bodies) with one body per packet,
+    # and each request gets its own body with an equal share of the exec time.
+    def __init__(self, name, exec_func, max_batch_size, max_batch_delay_ns):
+        self.name = name
+        self.exec_func = exec_func
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay_ns = max_batch_delay_ns
+        self.pending = []
+        self._flush_handle = None
+        self._tasks = set()
+
+    async def submit(self, packet):
+        # returns (start_ns, end_ns, body) for this packet
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((packet, future))
+        if len(self.pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_batch_delay_ns / 1e9, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch = self.pending
+        self.pending = []
+        if batch:
+            task = asyncio.ensure_future(self._exec_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _exec_batch(self, batch):
+        rpc_batch_size.add(len(batch))
+        try:
+            start_ns, end_ns, bodies = await self.exec_func([packet for packet, _ in batch])
+            if len(bodies) != len(batch):
+                raise ValueError('batch handler %s returned %d bodies for %d requests' % (self.name, len(bodies), len(batch)))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        exec_share_ns = (end_ns - start_ns) // len(batch)
+        for (_, future), body in zip(batch, bodies):
+            if not future.done():
+                future.set_result((start_ns, start_ns + exec_share_ns, body))
@@ -0,0 +1,87 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+
+from dnaco.telemetry.collector import TelemetryCollector
+from dnaco.telemetry.counter_map import CounterMap
+from dnaco.util import humans
+from dnaco.util.lru_cache import SizedLruCache
+
+rpc_cache_hits = TelemetryCollector.register(
+    name='dnaco_rpc_cache_hits',
+    label='RPC Response Cache Hits',
+    help_descr='Responses served from the cache, by route',
+    unit=humans.HUMAN_COUNT,
+    collector=CounterMap()
+)
+
+rpc_cache_misses = TelemetryCollector.register(
+    name='dnaco_rpc_cache_misses',
+    label='RPC Response Cache Misses',
+    help_descr='Requests not found in the cache, by route',
+    unit=humans.HUMAN_COUNT,
+    collector=CounterMap()
+)
+
+rpc_cache_evictions = TelemetryCollector.register(
+    name='dnaco_rpc_cache_evictions',
+    label='RPC Response Cache Evictions',
+    help_descr='Responses evicted from the cache to make room for new ones, by route',
+    unit=humans.HUMAN_COUNT,
+    collector=CounterMap()
+)
+
+
+def rpc_request_key(name, body):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(name.encode('utf-8'))
+    h.update(body)
+    return h.digest()
+
+
+class RpcResponseCache:
+    # Response cache of a single route, used for OP_TYPE_READ requests.
+    # the key is the hash of route + request body, the cache is bounded by
+    # the size of the response bodies, and the entries expire after ttl_ns.
+    def __init__(self, name, max_size, ttl_ns=None):
+        self.name = name
+        self.responses = SizedLruCache(max_size, ttl_ns)
+        # incremented on invalidation, to discard the responses computed before it
+        self.generation = 0
+
+    def get(self, key):
+        body = self.responses.get(key)
+        if body is None:
+            rpc_cache_misses.inc(self.name)
+        else:
+            rpc_cache_hits.inc(self.name)
+        return body
+
+    def put(self, key, body, generation):
+        if generation != self.generation:
+            return
+        evicted = self.responses.put(key, body)
+        if evicted:
+            rpc_cache_evictions.inc(self.name, evicted)
+
+    def invalidate(self, body=None):
+        # invalidate the response for the request body, or the whole route
+        self.generation += 1
+        if body is None:
+            self.responses.clear()
+        else:
+            self.responses.remove(rpc_request_key(self.name, body))
@@ -0,0 +1,335 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import random
+from time import time_ns
+
+from dnaco.util.humans import UNIT_SEC
+
+from .compression import CODECS_ACCEPT_ALL, FRAME_REV_COMPRESSED, decode_frame_data, encode_frame_data
+from .frame import FrameReader, build_frame_header, parse_frame_header
+from .packet import RpcControl, RpcEvent, RpcPacketBuilder, RpcRequest, RpcResponse, parse_rpc_batch, parse_rpc_packet
+from .shm import FRAME_REV_SHM, SHM_THRESHOLD, ShmChannel
+from .stream import RpcStream, RpcStreamError, handle_stream_event
+from .tracing import rpc_client_span_begin
+
+
+class RpcClientStream(RpcStream):
+    # write() the input chunks and write_eof() once done, iterate the output chunks,
+    # and wait for the final response with response().
+    def __init__(self, future):
+        super(RpcClientStream, self).__init__()
+        self.future = future
+
+    async def response(self, timeout=None):
+        return await asyncio.wait_for(asyncio.shield(self.future), timeout)
+
+    async def write_abort(self):
+        self.send_event(RpcEvent.EVENT_STREAM_ABORT, 0)
+        self.abort(RpcStreamError('stream aborted'))
+        await self.drain()
+
+
+class RpcConnection:
+    def __init__(self, reader, writer, rev, codec=None, shm=None):
+        # with a codec the frames are sent with FRAME_REV_COMPRESSED, and compressed
+        # when above the threshold. CODEC_NONE sends uncompressed frames, but still
+        # asks the server to compress the replies.
+        # with a shm channel (unix sockets only) the large frames go through shared memory.
+        self.reader = reader
+        self.writer = writer
+        self.codec = codec
+        self.shm = shm
+        self.pkg_builder = RpcPacketBuilder(rev)
+        self.pending = {}
+        self.streams = {}
+        self._write_lock = asyncio.Lock()
+        self._recv_task = asyncio.ensure_future(self._recv_loop())
+
+    @staticmethod
+    async def open(host, port, rev, codec=None):
+        reader, writer = await asyncio.open_connection(host, port)
+        return RpcConnection(reader, writer, rev, codec)
+
+    @staticmethod
+    async def open_unix(path, rev, codec=None, shm_ring_size=0):
+        reader, writer = await asyncio.open_unix_connection(path)
+        shm = None
+        if shm_ring_size > 0:
+            # creating and mapping the segment blocks, keep it out of the event loop
+            shm = await asyncio.get_running_loop().run_in_executor(None, ShmChannel.create, shm_ring_size)
+            attach = shm.attach_descriptor()
+            writer.write(build_frame_header(rev | FRAME_REV_SHM, False, len(attach)))
+            writer.write(attach)
+        return RpcConnection(reader, writer, rev, codec, shm)
+
+    def is_closed(self):
+        return self._recv_task.done() or self.writer.is_closing()
+
+    def inflight(self):
+        return len(self.pending)
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+        await asyncio.gather(self._recv_task, return_exceptions=True)
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+
+    async def call(self, trace_id, op_type, request_id, body, send_result_to=0, result_id=None, timeout=None,
+                   propagate_deadline=False):
+        # with propagate_deadline the timeout is sent as the request deadline, and the
+        # request is cancelled when the call is abandoned (requires a server handling CONTROL packets)
+        req = self.pkg_builder.new_request(trace_id, op_type, request_id, body, send_result_to, result_id)
+        pkg_id = self.pkg_builder.packet_id
+        if propagate_deadline and timeout is not None:
+            # the server skips (or cancels) the request once the caller has given up
+            req = self.pkg_builder.new_control(trace_id, pkg_id, RpcControl.CONTROL_DEADLINE, int(timeout * UNIT_SEC), req)
+
+        rev = self.pkg_builder.rev
+        if self.codec is not None:
+            rev |= FRAME_REV_COMPRESSED
+            req = await encode_frame_data(req, self.codec, CODECS_ACCEPT_ALL)
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[pkg_id] = future
+        try:
+            async with self._write_lock:
+                self._write_frame(rev, req)
+                await self.writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            if propagate_deadline:
+                self.cancel(trace_id, pkg_id)
+            raise
+        finally:
+            self.pending.pop(pkg_id, None)
+
+    def cancel(self, trace_id, pkg_id):
+        # best effort, the response may be already on its way
+        if pkg_id in self.pending and not self.writer.is_closing():
+            cancel = self.pkg_builder.new_control(trace_id, pkg_id, RpcControl.CONTROL_CANCEL, 0)
+            self._write_frame(self.pkg_builder.rev, cancel, use_shm=False)
+
+    async def open_stream(self, trace_id, op_type, request_id, body):
+        req = self.pkg_builder.new_request(trace_id, op_type, request_id, body)
+        pkg_id = self.pkg_builder.packet_id
+        rev = self.pkg_builder.rev
+
+        future = asyncio.get_running_loop().create_future()
+        stream = RpcClientStream(future)
+        stream.send_event = lambda event_type, value, data=b'': self._write_event(pkg_id, trace_id, event_type, value, data)
+        stream.drain = self._drain
+        self.pending[pkg_id] = future
+        self.streams[pkg_id] = stream
+
+        # the stream events are sent uncompressed, the frames are already chunked
+        self._write_frame(rev, req)
+        await self._drain()
+        return stream
+
+    def _write_event(self, pkg_id, trace_id, event_type, value, data):
+        event = self.pkg_builder.new_event(trace_id, pkg_id, event_type, value, data)
+        # plain frame, the server dispatches the events without waiting for an in-flight slot
+        self._write_frame(self.pkg_builder.rev, event, use_shm=False)
+
+    def _write_frame(self, rev, data, use_shm=True):
+        if self.writer.is_closing():
+            raise ConnectionResetError('connection closed')
+        if use_shm and self.shm is not None and len(data) >= SHM_THRESHOLD:
+            # the ring is consumed in frame order, write it just before the descriptor
+            descriptor = self.shm.tx.write_frame(data)
+            if descriptor is not None:
+                rev |= FRAME_REV_SHM
+                data = descriptor
+        self.writer.writelines((build_frame_header(rev, False, len(data)), data))
+
+    async def _drain(self):
+        async with self._write_lock:
+            await self.writer.drain()
+
+    def _complete(self, rev, write_to_wal, packet):
+        packet.rev = rev
+        packet.write_to_wal = write_to_wal
+        stream = self.streams.pop(packet.pkg_id, None)
+        if stream is not None:
+            # the response follows the last output chunk, and completes the stream
+            stream.feed_eof()
+            stream.abort(RpcStreamError('stream completed'))
+        future = self.pending.pop(packet.pkg_id, None)
+        if future is not None and not future.done():
+            future.set_result(packet)
+
+    async def call_batch(self, trace_id, op_type, requests, stream_responses=False, timeout=None):
+        # requests: list of (request_id, body), sent in a single frame.
+        # returns the responses in the same order of the requests.
+        loop = asyncio.get_running_loop()
+        packets = []
+        futures = []
+        for request_id, body in requests:
+            packets.append(self.pkg_builder.new_request(trace_id, op_type, request_id, body))
+            future = loop.create_future()
+            self.pending[self.pkg_builder.packet_id] = future
+            futures.append((self.pkg_builder.packet_id, future))
+
+        batch = self.pkg_builder.new_batch(trace_id, packets, stream_responses)
+        try:
+            async with self._write_lock:
+                self._write_frame(self.pkg_builder.rev, batch)
+                await self.writer.drain()
+            return await asyncio.wait_for(asyncio.gather(*[future for _, future in futures]), timeout)
+        finally:
+            for pkg_id, _ in futures:
+                self.pending.pop(pkg_id, None)
+
+    async def _recv_loop(self):
+        error = None
+        try:
+            while True:
+                header = await self.reader.readexactly(4)
+                rev, write_to_wal, length = parse_frame_header(header)
+                data = await self.reader.readexactly(length)
+                if rev & FRAME_REV_SHM:
+                    rev &= ~FRAME_REV_SHM
+                    data = self.shm.rx.read_frame(data)
+                if rev & FRAME_REV_COMPRESSED:
+                    rev &= ~FRAME_REV_COMPRESSED
+                    _, _, data = await decode_frame_data(data)
+
+                packet = parse_rpc_packet(FrameReader(data))
+                if isinstance(packet, RpcEvent):
+                    stream = self.streams.get(packet.pkg_id)
+                    if stream is not None:
+                        handle_stream_event(stream, packet)
+                    continue
+                if isinstance(packet, RpcControl) and packet.control_type == RpcControl.CONTROL_BATCH:
+                    for data in parse_rpc_batch(packet.body):
+                        self._complete(rev, write_to_wal, parse_rpc_packet(FrameReader(data)))
+                    continue
+                if not isinstance(packet, RpcResponse):
+                    # TODO: handle server control packets
+                    continue
+                self._complete(rev, write_to_wal, packet)
+        except asyncio.IncompleteReadError:
+            error = ConnectionResetError('connection closed by the server')
+        except Exception as e:
+            error = e
+        finally:
+            self.writer.close()
+            for stream in self.streams.values():
+                stream.abort(error or ConnectionResetError('connection closed'))
+            self.streams.clear()
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(error or ConnectionResetError('connection closed'))
+            self.pending.clear()
+
+
+class RpcClient:
+    def __init__(self, rev=1, pool_size=4, timeout=None, codec=None, shm_ring_size=0, propagate_deadline=False):
+        # endpoints with port None are unix socket paths,
+        # with shm_ring_size > 0 each unix connection has a shared memory channel.
+        # with propagate_deadline the call timeout is sent as the request deadline.
+        self.rev = rev
+        self.propagate_deadline = propagate_deadline
+        self.codec = codec
+        self.shm_ring_size = shm_ring_size
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.trace_builder = RpcPacketBuilder(rev)
+        # trace ids are unique within the client, the random base avoids clashes between clients
+        # (63bit, the ids are encoded in at most 8 bytes and keep incrementing from the base)
+        self.trace_builder.trace_id = random.getrandbits(63)
+        self.pools = {}
+        self._pool_locks = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        pools = self.pools
+        self.pools = {}
+        for pool in pools.values():
+            for conn in pool:
+                await conn.close()
+
+    async def _get_connection(self, host, port):
+        endpoint = (host, port)
+        lock = self._pool_locks.get(endpoint)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._pool_locks[endpoint] = lock
+
+        async with lock:
+            pool = [conn for conn in self.pools.get(endpoint, []) if not conn.is_closed()]
+            self.pools[endpoint] = pool
+
+            # reuse an idle connection, or open a new one while the pool is not full
+            conn = min(pool, key=RpcConnection.inflight) if pool else None
+            if conn is None or (conn.inflight() > 0 and len(pool) < self.pool_size):
+                if port is None:
+                    conn = await RpcConnection.open_unix(host, self.rev, self.codec, self.shm_ring_size)
+                else:
+                    conn = await RpcConnection.open(host, port, self.rev, self.codec)
+                pool.append(conn)
+            return conn
+
+    async def call(self, host, port, request_id, body, op_type=RpcRequest.OP_TYPE_READ,
+                   send_result_to=0, result_id=None, trace_id=None, timeout=None):
+        if isinstance(request_id, str):
+            request_id = request_id.encode('utf-8')
+        if trace_id is None:
+            trace_id = self.trace_builder.next_trace_id()
+        # (tracer, parent span id) if the trace is sampled
+        sampled = rpc_client_span_begin(trace_id)
+        start_ns = time_ns() if sampled is not None else 0
+        try:
+            conn = await self._get_connection(host, port)
+            return await conn.call(trace_id, op_type, request_id, body, send_result_to, result_id,
+                                   timeout if timeout is not None else self.timeout, self.propagate_deadline)
+        finally:
+            if sampled is not None:
+                tracer, parent_id = sampled
+                endpoint = host if port is None else '%s:%d' % (host, port)
+                tracer.add_span(trace_id, parent_id, 'rpc.client', start_ns, time_ns(),
+                                endpoint + request_id.decode('utf-8', 'replace'))
+
+    async def open_stream(self, host, port, request_id, body=b'', op_type=RpcRequest.OP_TYPE_WRITE, trace_id=None):
+        if isinstance(request_id, str):
+            request_id = request_id.encode('utf-8')
+        if trace_id is None:
+            trace_id = self.trace_builder.next_trace_id()
+        conn = await self._get_connection(host, port)
+        return await conn.open_stream(trace_id, op_type, request_id, body)
+
+    async def call_batch(self, host, port, requests, op_type=RpcRequest.OP_TYPE_READ, stream_responses=False,
+                         trace_id=None, timeout=None):
+        # requests: list of (request_id, body), sent to the server in a single frame
+        requests = [(request_id.encode('utf-8') if isinstance(request_id, str) else request_id, body)
+                    for request_id, body in requests]
+        if trace_id is None:
+            trace_id = self.trace_builder.next_trace_id()
+        conn = await self._get_connection(host, port)
+        return await conn.call_batch(trace_id, op_type, requests, stream_responses,
+                                     timeout if timeout is not None else self.timeout)
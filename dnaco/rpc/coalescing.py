@@ -0,0 +1,82 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from time import time_ns
+
+from dnaco.rpc.packet import RpcResponse
+from dnaco.telemetry.collector import TelemetryCollector
+from dnaco.telemetry.counter_map import CounterMap
+from dnaco.util import humans
+
+rpc_coalesced_requests = TelemetryCollector.register(
+    name='dnaco_rpc_coalesced_requests',
+    label='RPC Coalesced Requests',
+    help_descr='Requests that waited for the result of an identical in-flight request, by route',
+    unit=humans.HUMAN_COUNT,
+    collector=CounterMap()
+)
+
+
+def _consume_exception(future):
+    # the leader failure may have no followers waiting on it
+    if not future.cancelled():
+        future.exception()
+
+
+class RpcRequestCoalescer:
+    # Single-flight execution for a route: while a request with a given key
+    # (hash of route + body) is executing, the identical requests wait for
+    # its result instead of executing the handler again.
+    def __init__(self, name):
+        self.name = name
+        self.inflight = {}
+
+    async def execute(self, key, exec_func, req_recv_ns):
+        # exec_func() -> (op_status, queue_ns, exec_ns, body)
+        future = self.inflight.get(key)
+        if future is not None:
+            rpc_coalesced_requests.inc(self.name)
+            try:
+                op_status, _, exec_ns, body = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # the leader was cancelled (e.g. by its caller), not this request
+                return await self.execute(key, exec_func, req_recv_ns)
+            if op_status != RpcResponse.OP_STATUS_SUCCEEDED:
+                # cancelled, deadline exceeded or overloaded are specific to the leader
+                # request: execute again, the first follower becomes the new leader
+                return await self.execute(key, exec_func, req_recv_ns)
+            # the follower shares the exec time, everything else was waiting
+            queue_ns = max(0, (time_ns() - req_recv_ns) - exec_ns)
+            return op_status, queue_ns, exec_ns, body
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        self.inflight[key] = future
+        try:
+            result = await exec_func()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+            raise
+        finally:
+            del self.inflight[key]
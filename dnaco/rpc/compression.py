@@ -0,0 +1,181 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import lzma
+import zlib
+
+from dnaco.telemetry.collector import TelemetryCollector
+from dnaco.telemetry.time_range_counter import TimeRangeCounter
+from dnaco.util import humans
+
+from .frame import FRAME_MAX_DATA_LENGTH
+
+# Frames with the FRAME_REV_COMPRESSED bit set in the rev, have the frame data
+# prefixed by a codec byte: the codec used to compress this frame data, and the
+# codecs accepted by the sender for the replies. a frame below the threshold
+# (or not compressible) is sent with CODEC_NONE.
+#   +-------------+-------+ +-------------------------+
+#   | accept mask | codec | | ...(compressed) data... |
+#   +-------------+-------+ +-------------------------+
+#   0             4       8
+# the server replies with compressed frames only to the frames with the bit set.
+FRAME_REV_COMPRESSED = 0x8
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+
+COMPRESSION_THRESHOLD = 1 << 10
+# frames larger than this are compressed/decompressed off the event loop
+COMPRESSION_OFFLOAD_THRESHOLD = 128 << 10
+
+rpc_rx_compressed_bytes = TelemetryCollector.register(
+    name='dnaco_rpc_rx_compressed_bytes',
+    label='Compressed Bytes Read',
+    help_descr='Compressed frame data read, divided by minute',
+    unit=humans.HUMAN_SIZE,
+    collector=TimeRangeCounter(60 * humans.UNIT_MIN, 1 * humans.UNIT_MIN)
+)
+
+rpc_rx_raw_bytes = TelemetryCollector.register(
+    name='dnaco_rpc_rx_raw_bytes',
+    label='Uncompressed Bytes Read',
+    help_descr='Frame data read once uncompressed, divided by minute',
+    unit=humans.HUMAN_SIZE,
+    collector=TimeRangeCounter(60 * humans.UNIT_MIN, 1 * humans.UNIT_MIN)
+)
+
+rpc_tx_compressed_bytes = TelemetryCollector.register(
+    name='dnaco_rpc_tx_compressed_bytes',
+    label='Compressed Bytes Written',
+    help_descr='Compressed frame data written, divided by minute',
+    unit=humans.HUMAN_SIZE,
+    collector=TimeRangeCounter(60 * humans.UNIT_MIN, 1 * humans.UNIT_MIN)
+)
+
+rpc_tx_raw_bytes = TelemetryCollector.register(
+    name='dnaco_rpc_tx_raw_bytes',
+    label='Uncompressed Bytes Written',
+    help_descr='Frame data written before compression, divided by minute',
+    unit=humans.HUMAN_SIZE,
+    collector=TimeRangeCounter(60 * humans.UNIT_MIN, 1 * humans.UNIT_MIN)
+)
+
+
+def _zlib_decompress(data, max_length):
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(data, max_length)
+    if decompressor.unconsumed_tail and decompressor.decompress(decompressor.unconsumed_tail, 1):
+        raise ValueError('decompressed frame data larger than %d' % max_length)
+    if not decompressor.eof:
+        raise ValueError('truncated compressed frame data')
+    return data
+
+
+def _lzma_decompress(data, max_length):
+    decompressor = lzma.LZMADecompressor()
+    data = decompressor.decompress(data, max_length)
+    if not decompressor.eof and not decompressor.needs_input and decompressor.decompress(b'', 1):
+        raise ValueError('decompressed frame data larger than %d' % max_length)
+    if not decompressor.eof:
+        raise ValueError('truncated compressed frame data')
+    return data
+
+
+# the decompression is bounded by max_length, a small frame can't expand without limits
+_CODECS = {
+    CODEC_ZLIB: (lambda data: zlib.compress(data, 1), _zlib_decompress),
+    CODEC_LZMA: (lambda data: lzma.compress(data, preset=1), _lzma_decompress),
+}
+
+CODECS_ACCEPT_ALL = (1 << CODEC_ZLIB) | (1 << CODEC_LZMA)
+
+
+def _compress(codec, data):
+    compressed = _CODECS[codec][0](data)
+    if len(compressed) >= len(data):
+        # not compressible, send it raw
+        return CODEC_NONE, None
+    return codec, compressed
+
+
+async def encode_frame_data(data, codec, accept_mask=CODECS_ACCEPT_ALL, threshold=COMPRESSION_THRESHOLD):
+    # returns the frame data prefixed by the codec byte
+    compressed = None
+    if codec != CODEC_NONE and len(data) >= threshold:
+        if len(data) >= COMPRESSION_OFFLOAD_THRESHOLD:
+            codec, compressed = await asyncio.get_running_loop().run_in_executor(None, _compress, codec, data)
+        else:
+            codec, compressed = _compress(codec, data)
+    else:
+        codec = CODEC_NONE
+
+    rpc_tx_raw_bytes.add(len(data))
+    if compressed is None:
+        rpc_tx_compressed_bytes.add(len(data))
+        return bytes([(accept_mask << 4) | CODEC_NONE]) + data
+
+    rpc_tx_compressed_bytes.add(len(compressed))
+    return bytes([(accept_mask << 4) | codec]) + compressed
+
+
+async def decode_frame_data(data, max_length=FRAME_MAX_DATA_LENGTH):
+    # returns (accept_mask, codec, frame data)
+    # raises ValueError if the frame data is larger than max_length once decompressed
+    head = data[0]
+    accept_mask = (head >> 4) & 0xf
+    codec = head & 0xf
+    data = memoryview(data)[1:]
+    rpc_rx_compressed_bytes.add(len(data))
+    if codec != CODEC_NONE:
+        decompress = _CODECS[codec][1]
+        if len(data) >= COMPRESSION_OFFLOAD_THRESHOLD:
+            data = await asyncio.get_running_loop().run_in_executor(None, decompress, data, max_length)
+        else:
+            data = decompress(data, max_length)
+    rpc_rx_raw_bytes.add(len(data))
+    return accept_mask, codec, data
+
+
+def select_codec(accept_mask, preferred_codec):
+    if preferred_codec != CODEC_NONE and (accept_mask & (1 << preferred_codec)):
+        return preferred_codec
+    for codec in sorted(_CODECS):
+        if accept_mask & (1 << codec):
+            return codec
+    return CODEC_NONE
+
+
+def compression_frame_handler(handler, threshold=COMPRESSION_THRESHOLD):
+    # wrap a frame handler(rev, write_to_wal, req_recv_ns, data): the compressed frames
+    # are decompressed before calling the handler, and the replies are compressed
+    # with one of the codecs accepted by the sender.
+    async def _handler(rev, write_to_wal, req_recv_ns, data):
+        if not (rev & FRAME_REV_COMPRESSED):
+            return await handler(rev, write_to_wal, req_recv_ns, data)
+
+        accept_mask, codec, data = await decode_frame_data(data)
+        result = await handler(rev & ~FRAME_REV_COMPRESSED, write_to_wal, req_recv_ns, data)
+        if result is None:
+            return None
+
+        resp_rev, resp_write_to_wal, resp_data = result
+        resp_codec = select_codec(accept_mask, codec)
+        resp_data = await encode_frame_data(resp_data, resp_codec, CODECS_ACCEPT_ALL, threshold)
+        return resp_rev | FRAME_REV_COMPRESSED, resp_write_to_wal, resp_data
+
+    return _handler
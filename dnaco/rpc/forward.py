@@ -0,0 +1,101 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from time import time_ns
+
+from dnaco.util.humans import UNIT_SEC
+
+from .client import RpcClient
+from .packet import RPC_MAX_RESULT_ID_LENGTH, RpcRequest
+
+# FORWARD_RESULT_TO requests have the forward targets in the result_id,
+# as a comma separated list of 'host:port/request-id'. The result of the
+# handler is sent to the first target, with the remaining targets as its
+# result_id, so a multi-stage pipeline is a chain of forwards.
+# e.g. b'10.0.0.2:57025/stage2,10.0.0.3:57025/stage3'
+# Each stage replies to its caller as soon as its own handler completes, and
+# sends the result to the next stage in background: the stages do not wait
+# for each other. The first stage generates a unique forward result id, returned
+# to the caller, and appended to the targets as '#<id>' for the next stages:
+# e.g. b'10.0.0.3:57025/stage3#0123456789abcdef'
+# The last stage stores the result (STORE_RESULT_WITH_ID) with that id,
+# that can be fetched from the last target with RPC_RESULT_FETCH_ID.
+FORWARD_RESULT_ID_SEPARATOR = b'#'
+FORWARD_RESULT_ID_LENGTH = 16
+# the targets share the result_id with the forward result id
+RPC_MAX_FORWARD_TARGETS_LENGTH = RPC_MAX_RESULT_ID_LENGTH - len(FORWARD_RESULT_ID_SEPARATOR) - FORWARD_RESULT_ID_LENGTH
+
+
+def build_forward_targets(targets):
+    # targets: list of (host, port, request_id)
+    buf = []
+    for host, port, request_id in targets:
+        if ':' in host:
+            host = '[' + host + ']'
+        buf.append('%s:%d%s' % (host, port, request_id))
+    result_id = ','.join(buf).encode('utf-8')
+    if len(result_id) > RPC_MAX_FORWARD_TARGETS_LENGTH:
+        raise ValueError('forward targets must be at most %d bytes, got %d' % (RPC_MAX_FORWARD_TARGETS_LENGTH, len(result_id)))
+    return result_id
+
+
+def new_forward_result_id():
+    # 64bit random id of the result stored by the last stage of the chain
+    return os.urandom(FORWARD_RESULT_ID_LENGTH // 2).hex().encode('utf-8')
+
+
+def split_forward_result_id(result_id):
+    # returns (targets, forward result id), the id is None on the first stage
+    targets, sep, forward_id = bytes(result_id).partition(FORWARD_RESULT_ID_SEPARATOR)
+    return targets, (forward_id if sep else None)
+
+
+def parse_forward_target(result_id):
+    # returns (host, port, request_id, next_result_id)
+    target, _, next_targets = bytes(result_id).partition(b',')
+    endpoint, slash, request_id = target.partition(b'/')
+    host, _, port = endpoint.rpartition(b':')
+    if not slash or not host or not port.isdigit():
+        raise ValueError('invalid forward target %r' % target)
+    host = host.decode('utf-8').strip('[]')
+    return host, int(port), slash + request_id, next_targets or None
+
+
+class RpcForwarder:
+    def __init__(self, client=None, timeout=None):
+        self.client = client if client is not None else RpcClient(timeout=timeout, propagate_deadline=True)
+
+    async def forward(self, packet, body, forward_id):
+        # send the result as a new request to the target, keeping the original trace_id.
+        # the last target stores the result with forward_id, and replies with it.
+        targets, _ = split_forward_result_id(packet.result_id)
+        host, port, request_id, next_targets = parse_forward_target(targets)
+        if next_targets:
+            send_result_to = RpcRequest.FORWARD_RESULT_TO
+            result_id = next_targets + FORWARD_RESULT_ID_SEPARATOR + forward_id
+        else:
+            send_result_to, result_id = RpcRequest.STORE_RESULT_WITH_ID, forward_id
+        timeout = None
+        if packet.deadline_ns is not None:
+            # the next stage gets what is left of the caller deadline
+            timeout = max(0, packet.deadline_ns - time_ns()) / UNIT_SEC
+        return await self.client.call(host, port, request_id, body, op_type=packet.op_type,
+                                      send_result_to=send_result_to, result_id=result_id,
+                                      trace_id=packet.trace_id, timeout=timeout)
+
+    async def close(self):
+        await self.client.close()
@@ -22,6 +22,11 @@
 #   | 1111 | 1 | 111 | 11111111 | 11111111 | 11111111 |
 #   +------+---+--------------------------------------+
 #   0 rev. 4   5             data length             32
+FRAME_MAX_DATA_LENGTH = (1 << 27) - 1
+# the rev bits 0x8 (compressed) and 0x4 (shm) are frame flags,
+# the rpc packets use only the lower bits as protocol version (0-3).
+FRAME_REV_FLAGS = 0xc
+
 
 def build_frame_header(rev, write_to_wal, length):
     assert rev < 16
@@ -42,15 +47,20 @@ def parse_frame_header(header_bytes):
 
 
 class FrameReader:
+    # the reader works on a memoryview of the frame,
+    # read() and read_all() return views into the frame data without copying it.
     def __init__(self, frame):
         self.offset = 0
-        self.frame = frame
+        self.frame = memoryview(frame)
 
     def read(self, n):
         v = self.frame[self.offset:self.offset + n]
         self.offset += n
         return v
 
+    def read_bytes(self, n):
+        return self.read(n).tobytes()
+
     def read_byte(self):
         v = self.frame[self.offset]
         self.offset += 1
@@ -0,0 +1,232 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Load generator for the rpc_handle servers.
+#  - closed-loop: N workers, each one sends the next request when the previous one completes.
+#  - open-loop: requests are started at a fixed rate, independently of the responses.
+#    the latency is measured from the time the request was supposed to be sent,
+#    so a server that stalls is not hidden by the client sending less (coordinated omission).
+#
+#   python -m dnaco.rpc.loadgen --port 57025 --request-id /test --mode open --rate 5000 --duration 10
+#   python -m dnaco.rpc.loadgen --unix /tmp/dnaco.sock --request-id /test --mode closed --concurrency 64
+
+import argparse
+import asyncio
+import random
+from time import perf_counter_ns
+
+from dnaco.telemetry.histogram import Histogram
+from dnaco.util import humans
+
+from .client import RpcClient
+from .packet import RpcRequest, RpcResponse
+
+OP_TYPES = {
+    'read': RpcRequest.OP_TYPE_READ,
+    'write': RpcRequest.OP_TYPE_WRITE,
+    'rw': RpcRequest.OP_TYPE_RW,
+    'compute': RpcRequest.OP_TYPE_COMPUTE,
+}
+
+
+def parse_size_mix(spec):
+    # "100:9,65536:1" -> 90% of 100bytes requests, 10% of 64K requests
+    sizes = []
+    weights = []
+    for item in spec.split(','):
+        size, _, weight = item.partition(':')
+        sizes.append(int(size))
+        weights.append(float(weight) if weight else 1.0)
+    return sizes, weights
+
+
+class LoadStats:
+    def __init__(self):
+        self.latency = Histogram(Histogram.DEFAULT_NS_DURATION_BOUNDS)
+        self.queue_time = Histogram(Histogram.DEFAULT_NS_DURATION_BOUNDS)
+        self.exec_time = Histogram(Histogram.DEFAULT_NS_DURATION_BOUNDS)
+        self.succeeded = 0
+        self.failed = 0
+        self.errors = 0
+        self.req_bytes = 0
+        self.resp_bytes = 0
+        self.start_ns = 0
+        self.end_ns = 0
+
+    def add_response(self, latency_ns, req_size, resp):
+        self.latency.add(latency_ns)
+        self.queue_time.add(resp.queue_time)
+        self.exec_time.add(resp.exec_time)
+        self.req_bytes += req_size
+        self.resp_bytes += len(resp.body)
+        if resp.op_status == RpcResponse.OP_STATUS_SUCCEEDED:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+
+    def add_error(self, latency_ns, req_size):
+        # timeouts and connection errors: the latency is still recorded
+        self.latency.add(latency_ns)
+        self.req_bytes += req_size
+        self.errors += 1
+
+    def count(self):
+        return self.succeeded + self.failed + self.errors
+
+    def human_report(self):
+        elapsed_ns = max(1, self.end_ns - self.start_ns)
+        elapsed_sec = elapsed_ns / humans.UNIT_SEC
+        buf = []
+        buf.append('Requests: %s in %s (%.0f req/sec) - Succeeded:%s Failed:%s Errors:%s' % (
+            humans.human_count(self.count()), humans.human_time_diff_ns(elapsed_ns),
+            self.count() / elapsed_sec, humans.human_count(self.succeeded),
+            humans.human_count(self.failed), humans.human_count(self.errors)))
+        buf.append('Sent: %s (%s/sec) - Received: %s (%s/sec)' % (
+            humans.human_size(self.req_bytes), humans.human_size(self.req_bytes / elapsed_sec),
+            humans.human_size(self.resp_bytes), humans.human_size(self.resp_bytes / elapsed_sec)))
+        buf.append('')
+        buf.append('Client Latency')
+        buf.append(self.latency.human_report(humans.human_time_diff_ns))
+        buf.append('')
+        buf.append('Server Queue Time')
+        buf.append(self.queue_time.human_report(humans.human_time_diff_ns))
+        buf.append('')
+        buf.append('Server Exec Time')
+        buf.append(self.exec_time.human_report(humans.human_time_diff_ns))
+        return '\n'.join(buf)
+
+
+class LoadGenerator:
+    def __init__(self, client, host, port, request_id, sizes=(100,), weights=None,
+                 op_type=RpcRequest.OP_TYPE_READ, seed=None):
+        self.client = client
+        self.host = host
+        self.port = port
+        self.request_id = request_id
+        self.op_type = op_type
+        # the bodies are allocated once, the request picks one of them
+        self.bodies = [b'x' * size for size in sizes]
+        self.weights = weights
+        self.random = random.Random(seed)
+        self.stats = LoadStats()
+
+    def next_body(self):
+        if len(self.bodies) == 1:
+            return self.bodies[0]
+        return self.random.choices(self.bodies, self.weights)[0]
+
+    async def _send(self, start_ns, body):
+        # start_ns is the time the request was supposed to be sent
+        try:
+            resp = await self.client.call(self.host, self.port, self.request_id, body, self.op_type)
+        except (asyncio.TimeoutError, ConnectionError, OSError):
+            self.stats.add_error(perf_counter_ns() - start_ns, len(body))
+        else:
+            self.stats.add_response(perf_counter_ns() - start_ns, len(body), resp)
+
+    async def run_closed_loop(self, concurrency, duration_ns=None, requests=None):
+        # each worker has one request in flight, stops after duration_ns or when the requests are done
+        state = {'remaining': requests}
+
+        async def _worker(end_ns):
+            while perf_counter_ns() < end_ns:
+                if state['remaining'] is not None:
+                    if state['remaining'] <= 0:
+                        break
+                    state['remaining'] -= 1
+                await self._send(perf_counter_ns(), self.next_body())
+
+        self.stats.start_ns = perf_counter_ns()
+        end_ns = (self.stats.start_ns + duration_ns) if duration_ns else float('inf')
+        await asyncio.gather(*[_worker(end_ns) for _ in range(concurrency)])
+        self.stats.end_ns = perf_counter_ns()
+        return self.stats
+
+    async def run_open_loop(self, rate, duration_ns=None, requests=None, max_inflight=10000):
+        # the i-th request is scheduled at start + i/rate. if the client falls behind the
+        # requests are sent immediately, but the latency still starts from the scheduled time.
+        # max_inflight bounds the memory used when the server can't keep up.
+        interval_ns = humans.UNIT_SEC / rate
+        inflight = set()
+        slots = asyncio.Semaphore(max_inflight)
+
+        self.stats.start_ns = perf_counter_ns()
+        end_ns = (self.stats.start_ns + duration_ns) if duration_ns else float('inf')
+        index = 0
+        while requests is None or index < requests:
+            scheduled_ns = self.stats.start_ns + int(index * interval_ns)
+            if scheduled_ns >= end_ns:
+                break
+            delay_ns = scheduled_ns - perf_counter_ns()
+            if delay_ns > 0:
+                await asyncio.sleep(delay_ns / humans.UNIT_SEC)
+
+            await slots.acquire()
+            task = asyncio.ensure_future(self._send(scheduled_ns, self.next_body()))
+            task.add_done_callback(lambda t: slots.release())
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+            index += 1
+
+        if inflight:
+            await asyncio.gather(*inflight)
+        self.stats.end_ns = perf_counter_ns()
+        return self.stats
+
+
+async def run_load(args):
+    sizes, weights = parse_size_mix(args.sizes)
+    host, port = (args.unix, None) if args.unix else (args.host, args.port)
+    duration_ns = int(args.duration * humans.UNIT_SEC) if args.duration else None
+    async with RpcClient(rev=args.rev, pool_size=args.connections, timeout=args.timeout) as client:
+        loadgen = LoadGenerator(client, host, port, args.request_id, sizes, weights, OP_TYPES[args.op_type], args.seed)
+        if args.warmup:
+            await loadgen.run_closed_loop(args.concurrency, requests=args.warmup)
+            loadgen.stats = LoadStats()
+
+        if args.mode == 'open':
+            return await loadgen.run_open_loop(args.rate, duration_ns, args.requests, args.max_inflight)
+        return await loadgen.run_closed_loop(args.concurrency, duration_ns, args.requests)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='dnaco rpc load generator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=57025)
+    parser.add_argument('--unix', help='unix socket path, instead of host/port')
+    # the rev bits 0x8 and 0x4 are frame flags (compression, shm)
+    parser.add_argument('--rev', type=int, choices=range(4), default=1, help='protocol version (0-3)')
+    parser.add_argument('--request-id', required=True)
+    parser.add_argument('--op-type', choices=sorted(OP_TYPES), default='read')
+    parser.add_argument('--mode', choices=('open', 'closed'), default='closed')
+    parser.add_argument('--rate', type=float, default=1000, help='open-loop: requests per second')
+    parser.add_argument('--max-inflight', type=int, default=10000, help='open-loop: max requests in flight')
+    parser.add_argument('--concurrency', type=int, default=16, help='closed-loop: requests in flight')
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--sizes', default='100', help='request body size mix, e.g. 100:9,65536:1')
+    parser.add_argument('--duration', type=float, default=10, help='duration in sec (0 to use --requests)')
+    parser.add_argument('--requests', type=int, help='total number of requests')
+    parser.add_argument('--warmup', type=int, default=0, help='requests sent before measuring')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    stats = asyncio.run(run_load(args))
+    print(stats.human_report())
+
+
+if __name__ == '__main__':
+    main()
@@ -38,12 +38,14 @@ class Meta:
 
     @staticmethod
     def parse(data):
+        # if data is a memoryview (e.g. RpcRequest.body) the BYTES/PROMISE
+        # values returned are views into it, no data is copied.
         kvs = {}
         offset = 0
         length = len(data)
         while offset < length:
             offset, key, val = Meta._parse_entry(data, offset)
-            kvs[key.decode('utf-8')] = val
+            kvs[str(key, 'utf-8')] = val
         return kvs
 
     @staticmethod
@@ -76,9 +78,9 @@ class Meta:
         elif vtype == Meta.VALUE_TYPE_BYTES:
             return offset, key, val
         elif vtype == Meta.VALUE_TYPE_ARRAY:
-            return offset, key, json.loads(val)
+            return offset, key, json.loads(str(val, 'utf-8'))
         elif vtype == Meta.VALUE_TYPE_OBJECT:
-            return offset, key, json.loads(val)
+            return offset, key, json.loads(str(val, 'utf-8'))
         else:
             raise NotImplementedError
 
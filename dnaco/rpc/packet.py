@@ -14,6 +14,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from .frame import FRAME_REV_FLAGS, build_frame_header
+
+
 class RpcPacket:
     def __init__(self, trace_id, pkg_id):
         self.trace_id = trace_id
@@ -21,6 +24,18 @@ class RpcPacket:
         self.rev = None
         self.write_to_wal = None
 
+    def own_body(self):
+        # parsed packets have the body as a memoryview into the received frame.
+        # if the handler needs to keep the data around, it should take ownership
+        # of a copy instead of pinning the whole frame buffer.
+        if isinstance(self.body, memoryview):
+            self.body = self.body.tobytes()
+        return self.body
+
+
+def _repr_body(body):
+    return repr(body.tobytes() if isinstance(body, memoryview) else body)
+
 
 class RpcRequest(RpcPacket):
     # - Operation Type: 2bit (READ, WRITE, RW, COMPUTE)
@@ -42,13 +57,15 @@ class RpcRequest(RpcPacket):
         self.result_id = result_id
         self.request_id = request_id
         self.body = body
+        # absolute time_ns() deadline, set by the receiver from the DEADLINE control budget
+        self.deadline_ns = None
 
     def __repr__(self) -> str:
         return 'RpcRequest [traceId=' + repr(self.trace_id) \
                + ', pkg_id=' + repr(self.pkg_id) \
                + ', op_type=' + repr(self.op_type) \
                + ', request_id=' + repr(self.request_id) \
-               + ', body=' + repr(self.body) \
+               + ', body=' + _repr_body(self.body) \
                + ', send_result_to=' + repr(self.send_result_to) \
                + ', result_id=' + repr(self.result_id) \
                + ']'
@@ -73,7 +90,61 @@ class RpcResponse(RpcPacket):
                + ', op_status=' + repr(self.op_status) \
                + ', queue_time=' + repr(self.queue_time) \
                + ', exec_time=' + repr(self.exec_time) \
-               + ', body=' + repr(self.body) \
+               + ', body=' + _repr_body(self.body) \
+               + ']'
+
+
+class RpcEvent(RpcPacket):
+    # - Event Type: 2bit (STREAM_DATA, STREAM_END, STREAM_WINDOW, STREAM_ABORT)
+    # stream events refer to the stream opened by the request with the same pkg_id.
+    # the value is the chunk sequence number for STREAM_DATA/STREAM_END,
+    # and the number of chunks the sender can send for STREAM_WINDOW.
+    EVENT_STREAM_DATA = 0
+    EVENT_STREAM_END = 1
+    EVENT_STREAM_WINDOW = 2
+    EVENT_STREAM_ABORT = 3
+
+    def __init__(self, trace_id, pkg_id, event_type, value, body):
+        super(RpcEvent, self).__init__(trace_id, pkg_id)
+        self.event_type = event_type
+        self.value = value
+        self.body = body
+
+    def __repr__(self) -> str:
+        return 'RpcEvent [traceId=' + repr(self.trace_id) \
+               + ', pkg_id=' + repr(self.pkg_id) \
+               + ', event_type=' + repr(self.event_type) \
+               + ', value=' + repr(self.value) \
+               + ', body=' + _repr_body(self.body) \
+               + ']'
+
+
+class RpcControl(RpcPacket):
+    # - Control Type: 2bit (CANCEL, DEADLINE, BATCH, _)
+    # CANCEL: cancel the request with the same pkg_id.
+    # DEADLINE: the body is a request packet (with the same pkg_id), and the value
+    #           the time budget in ns, relative to when the receiver gets the frame.
+    # BATCH: the body is a list of length-prefixed packets, and the value has the flags.
+    #        with BATCH_STREAM_RESPONSES the responses are sent back individually as they complete,
+    #        otherwise they are sent back together in a BATCH packet.
+    CONTROL_CANCEL = 0
+    CONTROL_DEADLINE = 1
+    CONTROL_BATCH = 2
+
+    BATCH_STREAM_RESPONSES = 1
+
+    def __init__(self, trace_id, pkg_id, control_type, value, body):
+        super(RpcControl, self).__init__(trace_id, pkg_id)
+        self.control_type = control_type
+        self.value = value
+        self.body = body
+
+    def __repr__(self) -> str:
+        return 'RpcControl [traceId=' + repr(self.trace_id) \
+               + ', pkg_id=' + repr(self.pkg_id) \
+               + ', control_type=' + repr(self.control_type) \
+               + ', value=' + repr(self.value) \
+               + ', body=' + _repr_body(self.body) \
                + ']'
 
 
@@ -107,8 +178,10 @@ def parse_rpc_packet(frame):
         send_result_to = (req_head >> 12) & 0x3
         request_id_len = 1 + ((req_head >> 6) & 0x3f)
         result_id_len = req_head & 0x3f
-        request_id = frame.read(request_id_len)
-        result_id = frame.read(result_id_len)
+        # request/result ids are tiny and used as lookup keys, so they are copied.
+        # the body is a view into the frame.
+        request_id = frame.read_bytes(request_id_len)
+        result_id = frame.read_bytes(result_id_len)
         data = frame.read_all()
         return RpcRequest(trace_id, pkg_id, op_type, request_id, data, send_result_to, result_id)
 
@@ -130,24 +203,159 @@ def parse_rpc_packet(frame):
         data = frame.read_all()
         return RpcResponse(trace_id, pkg_id, op_status, queue_time, exec_time, data)
 
+    if pkg_type == 2:
+        # RPC Event Packets are composed of:
+        # - Event Type: 2bit (STREAM_DATA, STREAM_END, STREAM_WINDOW, STREAM_ABORT)
+        #   +----+--------+ +-------------+
+        #   | 11 | 111111 | | Value (u32) |
+        #   +----+--------+ +-------------+
+        #   0    2        8
+        event_head = frame.read_byte()
+        event_type = (event_head >> 6) & 0x3
+        value = int.from_bytes(frame.read(4), byteorder='little')
+        data = frame.read_all()
+        return RpcEvent(trace_id, pkg_id, event_type, value, data)
+
+    if pkg_type == 3:
+        # RPC Control Packets are composed of:
+        # - Control Type: 2bit (CANCEL, DEADLINE, BATCH, _)
+        # - Value length: 3bit (1 + (0-7)) max 8bytes int
+        #   +----+-----+-----+ +-------+
+        #   | 11 | 111 | 111 | | Value |
+        #   +----+-----+-----+ +-------+
+        #   0    2     5     8
+        control_head = frame.read_byte()
+        control_type = (control_head >> 6) & 0x3
+        value_len = 1 + ((control_head >> 3) & 0x7)
+        value = int.from_bytes(frame.read(value_len), byteorder='little')
+        data = frame.read_all()
+        return RpcControl(trace_id, pkg_id, control_type, value, data)
+
     raise NotImplementedError
 
 
 def build_rpc_request_head(op_type, request_id, send_result_to=0, result_id=None):
+    # the request sub-head, without the rpc head (layout in encode_rpc_request())
+    return _encode_request_head(op_type, request_id, send_result_to, result_id)
+
+
+def build_rpc_response_head(op_status, queue_time, exec_time):
+    # the response sub-head, without the rpc head (layout in encode_rpc_response())
+    return _encode_response_head(op_status, queue_time, exec_time)
+
+
+def build_rpc_event_head(event_type, value):
+    # the event sub-head, without the rpc head (layout in encode_rpc_event())
+    return bytes([event_type << 6]) + value.to_bytes(4, byteorder='little')
+
+
+def build_rpc_control_head(control_type, value):
+    # the control sub-head, without the rpc head (layout in encode_rpc_control())
+    value_len = ((value.bit_length() + 7) // 8) if value > 0 else 1
+    return bytes([(control_type << 6) | ((value_len - 1) << 3)]) + value.to_bytes(value_len, byteorder='little')
+
+
+def build_rpc_batch(packets):
+    # each packet is prefixed by its length (u32)
+    buf = []
+    for packet in packets:
+        buf.append(len(packet).to_bytes(4, byteorder='little'))
+        buf.append(packet)
+    return b''.join(buf)
+
+
+def parse_rpc_batch(body):
+    # returns the list of packets (memoryviews into the body)
+    body = memoryview(body)
+    packets = []
+    offset = 0
+    while offset < len(body):
+        length = int.from_bytes(body[offset:offset + 4], byteorder='little')
+        offset += 4
+        packets.append(body[offset:offset + length])
+        offset += length
+    return packets
+
+
+def build_rpc_head(pkg_type, trace_id, pkg_id):
+    # the rpc head with the trace and packet ids (layout in _encode_rpc_head())
+    return _encode_rpc_head(pkg_type, trace_id, pkg_id)
+
+
+# ==========================================================================================
+#  Single-buffer encoding
+# ==========================================================================================
+# the packets are encoded as a few parts: (optional) frame header, rpc head (packed
+# with its ids in a single int), sub-head and body, joined once into a buffer of the
+# total size, so the body is copied once. with vectored=True the result is
+# [frame header + heads, body] for writelines(), and the body is not copied at all.
+RPC_MAX_REQUEST_ID_LENGTH = 64
+RPC_MAX_RESULT_ID_LENGTH = 63
+
+
+def _encode_parts(frame_rev, write_to_wal, vectored, rpc_head, sub_head, body):
+    if frame_rev is None:
+        # only the packet, without the frame header
+        if vectored:
+            return [rpc_head + sub_head, body]
+        return b''.join((rpc_head, sub_head, body))
+
+    length = len(rpc_head) + len(sub_head) + len(body)
+    frame_head = build_frame_header(frame_rev, write_to_wal, length)
+    if vectored:
+        return [b''.join((frame_head, rpc_head, sub_head)), body]
+    return b''.join((frame_head, rpc_head, sub_head, body))
+
+
+def _encode_rpc_head(pkg_type, trace_id, pkg_id):
+    # RPC packets are composed of:
+    # - Packet Type: 2bit (REQUEST, RESPONSE, EVENT, CONTROL)
+    # - Trace Id length: 3bit (1-8 bytes ID)
+    # - Packet Id length: 3bit (1-8 bytes ID)
+    #  +----+-----+-----+ +----------+ +-----------+
+    #  | 11 | 111 | 111 | | Trace Id | | Packet Id |
+    #  +----+-----+-----+ +----------+ +-----------+
+    #  0    2     5     8
+    trace_id_len = ((trace_id.bit_length() + 7) >> 3) or 1
+    pkg_id_len = ((pkg_id.bit_length() + 7) >> 3) or 1
+    rpc_head = (pkg_type << 6) | ((trace_id_len - 1) << 3) | (pkg_id_len - 1)
+    rpc_head |= (trace_id << 8) | (pkg_id << (8 + (trace_id_len << 3)))
+    return rpc_head.to_bytes(1 + trace_id_len + pkg_id_len, byteorder='little')
+
+
+def _encode_request_head(op_type, request_id, send_result_to, result_id):
+    # the lengths are encoded in 6bit: request id 1-64 bytes, result id 0-63 bytes
+    result_id_len = len(result_id) if result_id else 0
+    if not 0 < len(request_id) <= RPC_MAX_REQUEST_ID_LENGTH:
+        raise ValueError('request_id must be 1-%d bytes, got %d' % (RPC_MAX_REQUEST_ID_LENGTH, len(request_id)))
+    if result_id_len > RPC_MAX_RESULT_ID_LENGTH:
+        raise ValueError('result_id must be at most %d bytes, got %d' % (RPC_MAX_RESULT_ID_LENGTH, result_id_len))
+    req_head = (op_type << 14) | (send_result_to << 12) | ((len(request_id) - 1) << 6) | result_id_len
+    return req_head.to_bytes(2, byteorder='big') + request_id + (result_id if result_id_len else b'')
+
+
+def _encode_response_head(op_status, queue_time, exec_time):
+    queue_time_len = ((queue_time.bit_length() + 7) >> 3) or 1
+    exec_time_len = ((exec_time.bit_length() + 7) >> 3) or 1
+    resp_head = (op_status << 6) | ((queue_time_len - 1) << 3) | (exec_time_len - 1)
+    resp_head |= (queue_time << 8) | (exec_time << (8 + (queue_time_len << 3)))
+    return resp_head.to_bytes(1 + queue_time_len + exec_time_len, byteorder='little')
+
+
+def encode_rpc_request(frame_rev, write_to_wal, vectored, trace_id, pkg_id, op_type, request_id, body,
+                       send_result_to=0, result_id=None):
     # RPC Request packets are composed of:
     # - Operation Type: 2bit (READ, WRITE, RW, COMPUTE)
     # - Send Result to: 2bit (CALLER, STORE_IN_MEMORY, STORE_WITH_ID, FORWARD_TO)
     #  +----+----+--------+-------+ +------------+ +------------+
     #  | 11 | 11 | 111111 | 11111 | | Request Id | | Result Id  |
     #  +----+----+--------+-------+ +------------+ +------------+
-    #  0    2    4       10      16  (1-64 bytes)   (1-64 bytes)
-    req_head = (op_type << 14) | (send_result_to << 12)
-    req_head |= (len(request_id) - 1) << 6
-    req_head |= len(result_id) if result_id else 0
-    return req_head.to_bytes(2, byteorder='big') + request_id + (result_id if result_id else b'')
+    #  0    2    4       10      16  (1-64 bytes)   (0-63 bytes)
+    req_head = _encode_request_head(op_type, request_id, send_result_to, result_id)
+    return _encode_parts(frame_rev, write_to_wal, vectored, _encode_rpc_head(0, trace_id, pkg_id), req_head, body)
 
 
-def build_rpc_response_head(op_status, queue_time, exec_time):
+def encode_rpc_response(frame_rev, write_to_wal, vectored, trace_id, pkg_id, op_status, queue_time, exec_time, body):
     # RPC Response Packets are composed of:
     # - Operation Status: 2bit (SUCCEEDED, FAILED, CANCELLED, _)
     # - Queue Time length: 3bit
@@ -156,30 +364,37 @@ def build_rpc_response_head(op_status, queue_time, exec_time):
     #   | 11 | 111 | 111 | | Queue Time ns | | Exec Time ns |
     #   +----+-----+-----+ +---------------+ +--------------+
     #   0    2     5     8
-    queue_time_len = ((queue_time.bit_length() + 7) // 8) if queue_time > 0 else 1
-    exec_time_len = ((exec_time.bit_length() + 7) // 8) if exec_time > 0 else 1
-    resp_head = (op_status << 6) | ((queue_time_len - 1) << 3) | (exec_time_len - 1)
-    return bytes([resp_head]) + queue_time.to_bytes(queue_time_len, byteorder='little') + exec_time.to_bytes(
-        exec_time_len, byteorder='little')
+    resp_head = _encode_response_head(op_status, queue_time, exec_time)
+    return _encode_parts(frame_rev, write_to_wal, vectored, _encode_rpc_head(1, trace_id, pkg_id), resp_head, body)
 
 
-def build_rpc_head(pkg_type, trace_id, pkg_id):
-    # RPC packets are composed of:
-    # - Packet Type: 2bit (REQUEST, RESPONSE, EVENT, CONTROL)
-    # - Trace Id length: 3bit (1-8 bytes ID)
-    # - Packet Id length: 3bit (1-8 bytes ID)
-    #  +----+-----+-----+ +----------+ +-----------+
-    #  | 11 | 111 | 111 | | Trace Id | | Packet Id |
-    #  +----+-----+-----+ +----------+ +-----------+
-    #  0    2     5     8
-    trace_id_len = ((trace_id.bit_length() + 7) // 8)
-    pkg_id_len = ((pkg_id.bit_length() + 7) // 8)
-    rpc_head = (pkg_type << 6) | ((trace_id_len - 1) << 3) | (pkg_id_len - 1)
-    return bytes([rpc_head]) + trace_id.to_bytes(trace_id_len, byteorder='little') + pkg_id.to_bytes(pkg_id_len, byteorder='little')
+def encode_rpc_event(frame_rev, write_to_wal, vectored, trace_id, pkg_id, event_type, value, body):
+    # RPC Event Packets are composed of:
+    # - Event Type: 2bit (STREAM_DATA, STREAM_END, STREAM_WINDOW, STREAM_ABORT)
+    #   +----+--------+ +-------------+
+    #   | 11 | 111111 | | Value (u32) |
+    #   +----+--------+ +-------------+
+    #   0    2        8
+    return _encode_parts(frame_rev, write_to_wal, vectored, _encode_rpc_head(2, trace_id, pkg_id),
+                         build_rpc_event_head(event_type, value), body)
+
+
+def encode_rpc_control(frame_rev, write_to_wal, vectored, trace_id, pkg_id, control_type, value, body):
+    # RPC Control Packets are composed of:
+    # - Control Type: 2bit (CANCEL, DEADLINE, BATCH, _)
+    # - Value length: 3bit (1 + (0-7)) max 8bytes int
+    #   +----+-----+-----+ +-------+
+    #   | 11 | 111 | 111 | | Value |
+    #   +----+-----+-----+ +-------+
+    #   0    2     5     8
+    return _encode_parts(frame_rev, write_to_wal, vectored, _encode_rpc_head(3, trace_id, pkg_id),
+                         build_rpc_control_head(control_type, value), body)
 
 
 class RpcPacketBuilder:
     def __init__(self, rev):
+        if rev & FRAME_REV_FLAGS or not 0 <= rev < 16:
+            raise ValueError('invalid rev %r, the bits 0x%x are frame flags' % (rev, FRAME_REV_FLAGS))
         self.trace_id = 0
         self.packet_id = 0
         self.rev = rev
@@ -193,11 +408,34 @@ class RpcPacketBuilder:
         return self.packet_id
 
     def new_request(self, trace_id, op_type, request_id, body, send_result_to=0, result_id=None):
-        req = build_rpc_request_head(op_type, request_id, send_result_to, result_id) + body
-        req = build_rpc_head(0, trace_id, self.next_packet_id()) + req
-        return req
+        return encode_rpc_request(None, False, False, trace_id, self.next_packet_id(), op_type, request_id, body,
+                                  send_result_to, result_id)
+
+    def new_request_frame(self, trace_id, op_type, request_id, body, send_result_to=0, result_id=None,
+                          write_to_wal=False, vectored=False):
+        # the request with the frame header, ready to be written
+        return encode_rpc_request(self.rev, write_to_wal, vectored, trace_id, self.next_packet_id(), op_type,
+                                  request_id, body, send_result_to, result_id)
 
     def new_response(self, trace_id, pkg_id, op_status, queue_time, exec_time, body):
-        resp = build_rpc_response_head(op_status, queue_time, exec_time) + body
-        resp = build_rpc_head(1, trace_id, pkg_id) + resp
-        return resp
+        return encode_rpc_response(None, False, False, trace_id, pkg_id, op_status, queue_time, exec_time, body)
+
+    def new_response_frame(self, trace_id, pkg_id, op_status, queue_time, exec_time, body,
+                           write_to_wal=False, vectored=False):
+        # the response with the frame header, ready to be written
+        return encode_rpc_response(self.rev, write_to_wal, vectored, trace_id, pkg_id, op_status,
+                                   queue_time, exec_time, body)
+
+    def new_control(self, trace_id, pkg_id, control_type, value, body=b''):
+        return encode_rpc_control(None, False, False, trace_id, pkg_id, control_type, value, body)
+
+    def new_batch(self, trace_id, packets, stream_responses=False):
+        # many packets (e.g. from new_request()) in a single frame, each one keeps its own pkg_id
+        flags = RpcControl.BATCH_STREAM_RESPONSES if stream_responses else 0
+        return self.new_control(trace_id, self.next_packet_id(), RpcControl.CONTROL_BATCH, flags, build_rpc_batch(packets))
+
+    def new_event(self, trace_id, pkg_id, event_type, value, body=b''):
+        return encode_rpc_event(None, False, False, trace_id, pkg_id, event_type, value, body)
+
+    def new_event_frame(self, trace_id, pkg_id, event_type, value, body=b'', vectored=False):
+        return encode_rpc_event(self.rev, False, vectored, trace_id, pkg_id, event_type, value, body)
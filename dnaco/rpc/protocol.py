@@ -0,0 +1,195 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import contextvars
+from time import time_ns
+
+from .frame import parse_frame_header
+from .server import FrameWriter, RPC_MAX_INFLIGHT_PER_CONNECTION, RpcConnectionState, _frame_exec, rpc_connection, \
+    rpc_frame_handler, server_rx_bytes, server_rx_frames
+
+
+class FrameProtocol(asyncio.BufferedProtocol):
+    # BufferedProtocol alternative to frame_handle(): the transport reads
+    # directly into our receive buffer, and every buffer_updated() call parses
+    # all the complete frames available. Frames that do not fit in the receive
+    # buffer get a preallocated body buffer that the transport fills directly.
+    # Frames are dispatched to the same handler(rev, write_to_wal, req_recv_ns, data)
+    # used by frame_handle(), with up to max_inflight concurrent handlers.
+    RECV_BUFFER_SIZE = 256 << 10
+
+    def __init__(self, handler, max_inflight=RPC_MAX_INFLIGHT_PER_CONNECTION, recv_buffer_size=RECV_BUFFER_SIZE):
+        self.handler = handler
+        self.max_inflight = max_inflight
+        self.transport = None
+        self.frame_writer = None
+        self.connection = None
+        self.context = None
+        self.tasks = set()
+        # receive buffer: recv_buffer[0:recv_length] contains unparsed data
+        self.recv_buffer = bytearray(recv_buffer_size)
+        self.recv_view = memoryview(self.recv_buffer)
+        self.recv_length = 0
+        # preallocated buffer for the body of a frame larger than the receive buffer
+        self.body_buffer = None
+        self.body_offset = 0
+        self.body_head = None
+        # flow control state
+        self._read_paused = False
+        self._write_paused = False
+        self._drain_waiters = []
+        self._eof = False
+        self._lost = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.frame_writer = FrameWriter(transport, self._drain)
+        # the frame tasks are created in the context of the connection
+        self.connection = RpcConnectionState(self.frame_writer)
+        self.context = contextvars.copy_context()
+        self.context.run(rpc_connection.set, self.connection)
+
+    def connection_lost(self, exc):
+        self._eof = True
+        self._lost = True
+        self.connection.close()
+        if not self.tasks:
+            self.connection.close_shm()
+        self._wake_drain_waiters()
+
+    def eof_received(self):
+        # keep the transport open until the in-flight responses are sent
+        self._eof = True
+        if not self.tasks:
+            self._close()
+        return True
+
+    def get_buffer(self, sizehint):
+        if self.body_buffer is not None:
+            return memoryview(self.body_buffer)[self.body_offset:]
+        return self.recv_view[self.recv_length:]
+
+    def buffer_updated(self, nbytes):
+        if self.body_buffer is not None:
+            self.body_offset += nbytes
+            if self.body_offset == len(self.body_buffer):
+                req_recv_ns, rev, write_to_wal = self.body_head
+                body = self.body_buffer
+                self.body_buffer = None
+                self.body_head = None
+                self._dispatch(req_recv_ns, rev, write_to_wal, body)
+            return
+
+        self.recv_length += nbytes
+        self._parse_frames()
+
+    def _parse_frames(self):
+        buf = self.recv_view
+        offset = 0
+        avail = self.recv_length
+        while (avail - offset) >= 4 and self.body_buffer is None:
+            if len(self.tasks) >= self.max_inflight:
+                self._pause_reading()
+                break
+
+            rev, write_to_wal, length = parse_frame_header(buf[offset:offset + 4])
+            frame_end = offset + 4 + length
+            if frame_end <= avail:
+                # the whole frame is in the receive buffer, copy it out since the buffer is reused
+                req_recv_ns = time_ns()
+                self._dispatch(req_recv_ns, rev, write_to_wal, buf[offset + 4:frame_end].tobytes())
+                offset = frame_end
+            elif (4 + length) > len(self.recv_buffer):
+                # large frame: read the rest of the body straight into its own buffer
+                self.body_head = (time_ns(), rev, write_to_wal)
+                self.body_buffer = bytearray(length)
+                self.body_offset = avail - (offset + 4)
+                self.body_buffer[0:self.body_offset] = buf[offset + 4:avail]
+                offset = avail
+            else:
+                # wait for the rest of the frame
+                break
+
+        # move the partial frame to the head of the receive buffer
+        remaining = avail - offset
+        if remaining > 0 and offset > 0:
+            buf[0:remaining] = buf[offset:avail]
+        self.recv_length = remaining
+
+    def _dispatch(self, req_recv_ns, rev, write_to_wal, data):
+        server_rx_bytes.add(4 + len(data))
+        server_rx_frames.inc()
+        frame_exec = _frame_exec(self.frame_writer, self.handler, req_recv_ns, rev, write_to_wal, data)
+        task = self.context.run(asyncio.ensure_future, frame_exec)
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # TODO: use logger
+            print('FAIL frame handler', task.exception())
+            self._close()
+            return
+
+        if self._read_paused and not self.transport.is_closing():
+            self._resume_reading()
+            self._parse_frames()
+        if self._eof and not self.tasks:
+            self._close()
+            if self._lost:
+                self.connection.close_shm()
+
+    def _close(self):
+        if not self.transport.is_closing():
+            self.frame_writer.flush()
+            self.transport.close()
+
+    def _pause_reading(self):
+        if not self._read_paused:
+            self._read_paused = True
+            self.transport.pause_reading()
+
+    def _resume_reading(self):
+        if self._read_paused and not self.transport.is_closing():
+            self._read_paused = False
+            self.transport.resume_reading()
+
+    def pause_writing(self):
+        self._write_paused = True
+
+    def resume_writing(self):
+        self._write_paused = False
+        self._wake_drain_waiters()
+
+    def _wake_drain_waiters(self):
+        waiters = self._drain_waiters
+        self._drain_waiters = []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _drain(self):
+        if self._write_paused and not self.transport.is_closing():
+            waiter = asyncio.get_running_loop().create_future()
+            self._drain_waiters.append(waiter)
+            await waiter
+
+
+def rpc_protocol(max_inflight=RPC_MAX_INFLIGHT_PER_CONNECTION):
+    # usage: await loop.create_server(rpc_protocol, host, port)
+    return FrameProtocol(rpc_frame_handler, max_inflight)
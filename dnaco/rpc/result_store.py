@@ -0,0 +1,81 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import uuid
+
+from dnaco.util import humans
+from dnaco.util.lru_cache import SizedLruCache, buffer_size
+
+
+class RpcResultStore:
+    # In-memory store for the results of the requests sent with
+    # STORE_RESULT_IN_MEMORY/STORE_RESULT_WITH_ID. Results are kept as
+    # (op_status, queue_ns, exec_ns, body) in a LRU bounded by the body size,
+    # with a per-entry TTL. The body is stored as returned by the handler.
+    # While the request is executing, readers wait on their own future, removed
+    # when the reader is cancelled or times out. Both the results in execution
+    # and the readers of each one are bounded.
+    def __init__(self, max_size=256 << 20, default_ttl_ns=10 * humans.UNIT_MIN, max_pending=64 << 10, max_waiters=1024):
+        self.results = SizedLruCache(max_size, default_ttl_ns, size_func=lambda result: buffer_size(result[3]))
+        self.max_pending = max_pending
+        self.max_waiters = max_waiters
+        # result_id -> set of the reader futures
+        self.pending = {}
+
+    @staticmethod
+    def next_result_id():
+        return uuid.uuid4().hex.encode('utf-8')
+
+    def begin(self, result_id):
+        self.results.remove(result_id)
+        if result_id not in self.pending:
+            if len(self.pending) >= self.max_pending:
+                raise OverflowError('too many results in execution')
+            self.pending[result_id] = set()
+
+    def put(self, result_id, op_status, queue_ns, exec_ns, body, ttl_ns=None):
+        result = (op_status, queue_ns, exec_ns, body)
+        self.results.put(result_id, result, ttl_ns)
+        waiters = self.pending.pop(result_id, None)
+        if waiters:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(result)
+
+    async def get(self, result_id, timeout=None):
+        # returns None if the result is not found, or not ready within timeout sec
+        result = self.results.get(result_id)
+        if result is not None:
+            return result
+
+        waiters = self.pending.get(result_id)
+        if waiters is None:
+            return None
+        if len(waiters) >= self.max_waiters:
+            raise OverflowError('too many readers waiting for the result')
+
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.add(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters.discard(waiter)
+
+    def remove(self, result_id):
+        return self.results.remove(result_id)
@@ -14,16 +14,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import collections
+import contextvars
+import errno
+import os
+import socket
+import stat
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from time import time_ns
 
-from dnaco.rpc.packet import RpcRequest, RpcResponse
+from dnaco.rpc.packet import RpcControl, RpcEvent, RpcRequest, RpcResponse
 from dnaco.telemetry.collector import TelemetryCollector
+from dnaco.telemetry.histogram import Histogram
+from dnaco.telemetry.histogram_map import HistogramMap
 from dnaco.telemetry.time_range_counter import TimeRangeCounter
 from dnaco.telemetry.max_and_avg_time_range_counter import MaxAndAvgTimeRangeGauge
+from dnaco.telemetry.topk import TopK
 from dnaco.util import humans
 
-from .frame import FrameReader, parse_frame_header, build_frame_header
-from .packet import RpcPacketBuilder, parse_rpc_packet
+from .frame import FRAME_REV_FLAGS, FrameReader, parse_frame_header, build_frame_header
+from .batching import RpcRequestBatcher
+from .cache import RpcResponseCache, rpc_request_key
+from .coalescing import RpcRequestCoalescer
+from .compression import compression_frame_handler
+from .forward import RPC_MAX_FORWARD_TARGETS_LENGTH, RpcForwarder, new_forward_result_id, \
+    split_forward_result_id
+from .packet import build_rpc_batch, encode_rpc_control, encode_rpc_event, encode_rpc_response, parse_rpc_batch, \
+    parse_rpc_packet
+from .result_store import RpcResultStore
+from .shm import shm_frame_handler
+from .stream import RpcStream, RpcStreamError, handle_stream_event
+from .tracing import RPC_TRACES_FETCH_ID, rpc_server_span, rpc_server_span_begin, rpc_traces_body
 
 # ==========================================================================================
 #  AsyncIO Frame Handling
@@ -71,24 +93,252 @@ async def read_frame(reader):
     return start_ns, rev, write_to_wal, frame_data
 
 
-async def frame_handle(reader, writer, handler):
+class FrameWriter:
+    # Coalesce the frames produced within the same event-loop iteration:
+    # the first write schedules a flush with call_soon(), every other response
+    # ready in the same tick is appended to the pending buffers, and the flush
+    # sends them all with a single writelines(). drain() is awaited only when
+    # the transport is above its high-water mark.
+    def __init__(self, transport, drain):
+        self.transport = transport
+        self.buffers = []
+        self.pending_bytes = 0
+        self._flush_handle = None
+        self._drain = drain
+        self._drain_lock = asyncio.Lock()
+
+    def write(self, rev, write_to_wal, data):
+        self.buffers.append(build_frame_header(rev, write_to_wal, len(data)))
+        self.buffers.append(data)
+        self.pending_bytes += 4 + len(data)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_soon(self.flush)
+
+        # update packet stats
+        server_tx_bytes.add(4 + len(data))
+        server_tx_frames.inc()
+
+    def write_framed(self, buffers):
+        # buffers starting with the frame header, e.g. from new_event_frame(..., vectored=True)
+        length = 0
+        for buf in buffers:
+            self.buffers.append(buf)
+            length += len(buf)
+        self.pending_bytes += length
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_soon(self.flush)
+
+        # update packet stats
+        server_tx_bytes.add(length)
+        server_tx_frames.inc()
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if not self.buffers:
+            return
+
+        buffers = self.buffers
+        self.buffers = []
+        self.pending_bytes = 0
+        if not self.transport.is_closing():
+            self.transport.writelines(buffers)
+
+    def need_drain(self):
+        _, high_water = self.transport.get_write_buffer_limits()
+        return (self.pending_bytes + self.transport.get_write_buffer_size()) > high_water
+
+    async def drain(self):
+        if self.need_drain():
+            self.flush()
+            async with self._drain_lock:
+                await self._drain()
+
+
+# streams opened by the events, before (or without) the request that opens them
+RPC_MAX_STREAMS_PER_CONNECTION = 64
+# ids of the closed streams remembered, to drop the events received after the close
+RPC_MAX_CLOSED_STREAMS = 1024
+
+
+class RpcConnectionState:
+    # per-connection state (e.g. the open streams) available to the frame handlers
+    # through the rpc_connection context variable.
+    def __init__(self, frame_writer):
+        self.frame_writer = frame_writer
+        self.streams = {}
+        self.closed_streams = set()
+        self._closed_streams_order = collections.deque()
+        # shared memory channel attached by the client (unix sockets only)
+        self.shm = None
+        # tasks of the requests in execution, and the ones cancelled by the client
+        self.requests = {}
+        self.cancelled = set()
+
+    def get_stream(self, pkg_id):
+        # the stream events may be handled before the request that opens the stream.
+        # returns None if the stream is closed: the late events are dropped, instead
+        # of creating a stream that nobody reads.
+        stream = self.streams.get(pkg_id)
+        if stream is None:
+            if pkg_id in self.closed_streams:
+                return None
+            if len(self.streams) >= RPC_MAX_STREAMS_PER_CONNECTION:
+                # too many streams, the request opening this one will fail
+                self.close_stream(pkg_id)
+                return None
+            stream = RpcStream()
+            self.streams[pkg_id] = stream
+        return stream
+
+    def close_stream(self, pkg_id):
+        self.streams.pop(pkg_id, None)
+        if pkg_id not in self.closed_streams:
+            self.closed_streams.add(pkg_id)
+            self._closed_streams_order.append(pkg_id)
+            if len(self._closed_streams_order) > RPC_MAX_CLOSED_STREAMS:
+                self.closed_streams.discard(self._closed_streams_order.popleft())
+
+    def cancel_request(self, pkg_id):
+        task = self.requests.get(pkg_id)
+        if task is not None and not task.done():
+            self.cancelled.add(pkg_id)
+            task.cancel()
+
+    def close(self):
+        streams = self.streams
+        self.streams = {}
+        for stream in streams.values():
+            stream.abort(ConnectionResetError('connection closed'))
+
+    def close_shm(self):
+        # called once the frame handlers are completed
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+
+
+rpc_connection = contextvars.ContextVar('dnaco_rpc_connection', default=None)
+
+
+async def _frame_exec(frame_writer, handler, req_recv_ns, rev, write_to_wal, data):
+    # let the handler compute a new frame
+    result = await handler(rev, write_to_wal, req_recv_ns, data)
+    if result is None:
+        # nothing to send back (e.g. the handler consumed a response packet)
+        return
+
+    # write back the frame as response
+    rev, write_to_wal, data = result
+    frame_writer.write(rev, write_to_wal, data)
+    await frame_writer.drain()
+
+    # set by the request handler, only if the request is sampled
+    span = rpc_server_span.get()
+    if span is not None:
+        span.record_write(time_ns())
+
+
+def _peek_rpc_control(data):
+    # (control_type, value) of a CONTROL packet, without parsing the wrapped packet
+    rpc_head = data[0]
+    offset = 3 + ((rpc_head >> 3) & 0x7) + (rpc_head & 0x7)
+    if len(data) <= offset:
+        return None, 0
+    control_head = data[offset]
+    value_len = 1 + ((control_head >> 3) & 0x7)
+    value = int.from_bytes(data[offset + 1:offset + 1 + value_len], byteorder='little')
+    return (control_head >> 6) & 0x3, value
+
+
+def _frame_needs_inflight_slot(rev, data):
+    # the stream events and the cancels are consumed by the requests already executing:
+    # they don't take an in-flight slot, otherwise the requests holding all the slots
+    # would never receive them. compressed and shm frames are opaque at this point,
+    # the client sends the events and the controls as plain frames.
+    if rev & FRAME_REV_FLAGS or not data:
+        return True
+    pkg_type = (data[0] >> 6) & 0x3
+    if pkg_type == 2:
+        return False
+    if pkg_type == 3:
+        control_type, _ = _peek_rpc_control(data)
+        return control_type != RpcControl.CONTROL_CANCEL
+    return True
+
+
+def _frame_deadline_ns(rev, data, req_recv_ns):
+    # deadline of a plain DEADLINE control frame, None for any other frame
+    if rev & FRAME_REV_FLAGS or not data or ((data[0] >> 6) & 0x3) != 3:
+        return None
+    control_type, value = _peek_rpc_control(data)
+    if control_type != RpcControl.CONTROL_DEADLINE:
+        return None
+    return req_recv_ns + value
+
+
+async def _acquire_before(semaphore, deadline_ns):
+    # False if no slot was free before the deadline
+    if not semaphore.locked():
+        await semaphore.acquire()
+        return True
+    timeout_ns = deadline_ns - time_ns()
+    if timeout_ns <= 0:
+        return False
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout_ns / humans.UNIT_SEC)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def frame_handle(reader, writer, handler, max_inflight=1):
+    # with max_inflight > 1 the connection is pipelined: frames keep being read
+    # while the previous ones are still executing, and each response is sent
+    # as soon as its handler completes (matched by the client via pkg_id/trace_id).
+    inflight = asyncio.Semaphore(max_inflight)
+    frame_writer = FrameWriter(writer.transport, writer.drain)
+    connection = RpcConnectionState(frame_writer)
+    tasks = set()
+    slot_tasks = set()
+
+    # the frame tasks inherit the context of the connection task
+    rpc_connection.set(connection)
+
+    def _task_done(task):
+        tasks.discard(task)
+        if task in slot_tasks:
+            slot_tasks.discard(task)
+            inflight.release()
+        if not task.cancelled() and task.exception() is not None:
+            # request failures are replied with a FAILED response by the rpc handlers,
+            # what gets here is a framing or protocol error: the connection is not usable.
+            # TODO: use logger
+            print('FAIL frame handler', task.exception())
+            writer.close()
+
     try:
         while not reader.at_eof():
             # wait for a frame...
             req_recv_ns, rev, write_to_wal, data = await read_frame(reader)
 
-            # let the handler compute a new frame
-            rev, write_to_wal, data = await handler(rev, write_to_wal, req_recv_ns, data)
-
-            # write back the frame as response
-            # print('write response', rev, write_to_wal, len(data), data)
-            writer.write(build_frame_header(rev, write_to_wal, len(data)))
-            writer.write(data)
-            await writer.drain()
-
-            # update packet stats
-            server_tx_bytes.add(4 + len(data))
-            server_tx_frames.inc()
+            # wait for an in-flight slot, then let the handler run concurrently
+            need_slot = _frame_needs_inflight_slot(rev, data)
+            if need_slot:
+                deadline_ns = _frame_deadline_ns(rev, data, req_recv_ns)
+                if deadline_ns is None:
+                    await inflight.acquire()
+                else:
+                    # don't wait past the deadline: the request is dispatched
+                    # without a slot and replied DEADLINE EXCEEDED, without executing it
+                    need_slot = await _acquire_before(inflight, deadline_ns)
+            task = asyncio.ensure_future(_frame_exec(frame_writer, handler, req_recv_ns, rev, write_to_wal, data))
+            tasks.add(task)
+            if need_slot:
+                slot_tasks.add(task)
+            task.add_done_callback(_task_done)
 
     except Exception as e:
         # TODO: use logger
@@ -97,6 +347,12 @@ async def frame_handle(reader, writer, handler):
         else:
             print('FAIL incomplete read', e)
     finally:
+        # the client may have half-closed the connection, flush the pending responses
+        connection.close()
+        if tasks:
+            await asyncio.wait(tasks)
+        connection.close_shm()
+        frame_writer.flush()
         writer.close()
         await writer.wait_closed()
 
@@ -112,38 +368,622 @@ server_rpc_exec_time = TelemetryCollector.register(
     collector=MaxAndAvgTimeRangeGauge(60 * humans.UNIT_MIN, 1 * humans.UNIT_MIN)
 )
 
+server_rpc_route_queue_time = TelemetryCollector.register(
+    name='dnaco_rpc_route_queue_time',
+    label='RPC Queue Time by Route',
+    help_descr='Time between the frame received and the handler execution, by request id',
+    unit=humans.HUMAN_TIME_NS,
+    collector=HistogramMap(Histogram.DEFAULT_NS_DURATION_BOUNDS)
+)
+
+server_rpc_route_exec_time = TelemetryCollector.register(
+    name='dnaco_rpc_route_exec_time',
+    label='RPC Exec Time by Route',
+    help_descr='Handler execution time, by request id',
+    unit=humans.HUMAN_TIME_NS,
+    collector=HistogramMap(Histogram.DEFAULT_NS_DURATION_BOUNDS)
+)
+
+server_rpc_route_req_size = TelemetryCollector.register(
+    name='dnaco_rpc_route_req_size',
+    label='RPC Request Size by Route',
+    help_descr='Request body size, by request id',
+    unit=humans.HUMAN_SIZE,
+    collector=HistogramMap(Histogram.DEFAULT_SIZE_BOUNDS)
+)
+
+server_rpc_route_resp_size = TelemetryCollector.register(
+    name='dnaco_rpc_route_resp_size',
+    label='RPC Response Size by Route',
+    help_descr='Response body size, by request id',
+    unit=humans.HUMAN_SIZE,
+    collector=HistogramMap(Histogram.DEFAULT_SIZE_BOUNDS)
+)
+
+server_rpc_slowest_calls = TelemetryCollector.register(
+    name='dnaco_rpc_slowest_calls',
+    label='RPC Slowest Calls',
+    help_descr='Slowest calls (queue + exec time) by request id, with the trace ids of the slowest ones',
+    unit=humans.HUMAN_TIME_NS,
+    collector=TopK(16)
+)
+
+server_rpc_cancelled = TelemetryCollector.register(
+    name='dnaco_rpc_cancelled',
+    label='RPC Cancelled',
+    help_descr='Requests cancelled or skipped because of the deadline, divided by minute',
+    unit=humans.HUMAN_COUNT,
+    collector=TimeRangeCounter(60 * humans.UNIT_MIN, 1 * humans.UNIT_MIN)
+)
+
+
+rpc_batch_packets = TelemetryCollector.register(
+    name='dnaco_rpc_batch_packets',
+    label='RPC Batched Packets',
+    help_descr='Packets received in BATCH frames, divided by minute',
+    unit=humans.HUMAN_COUNT,
+    collector=TimeRangeCounter(60 * humans.UNIT_MIN, 1 * humans.UNIT_MIN)
+)
+
+
+class RpcRoute:
+    # Execution policy of the handler:
+    # - INLINE: the handler is called directly on the event loop
+    # - THREAD_POOL: the handler is called in the rpc thread pool
+    # - PROCESS_POOL: the handler is called in the rpc process pool,
+    #   the handler must be a module-level function and the packet body is copied.
+    # when no policy is specified, OP_TYPE_COMPUTE requests are offloaded to the thread pool.
+    # coroutine handlers are always awaited on the event loop, inside the task
+    # of their frame, so a handler waiting on I/O does not stall the others.
+    EXEC_INLINE = 0
+    EXEC_THREAD_POOL = 1
+    EXEC_PROCESS_POOL = 2
+
+    def __init__(self, name, func, execution=None, cache=None, coalescer=None):
+        self.name = name
+        self.func = func
+        self.execution = execution
+        self.cache = cache
+        self.coalescer = coalescer
+        self.batcher = None
+        self.is_stream = False
+        self.is_async = asyncio.iscoroutinefunction(func)
+        if self.is_async and execution not in (None, self.EXEC_INLINE):
+            raise ValueError('coroutine handler %s can only be executed inline' % name)
+
+    def execution_for(self, packet):
+        if self.is_async:
+            return self.EXEC_INLINE
+        if self.execution is not None:
+            return self.execution
+        if packet.op_type == RpcRequest.OP_TYPE_COMPUTE:
+            return self.EXEC_THREAD_POOL
+        return self.EXEC_INLINE
+
+
 _rpc_handlers = {}
+_rpc_executors = {}
+# the executor threads don't survive a fork (e.g. the workers), the child creates its own executors
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_rpc_executors.clear)
+_rpc_admission = None
 
 
-def rpc_handler(name):
+def rpc_handler(name, execution=None, cache_size=0, cache_ttl_ns=None, coalesce=False):
+    # cache_size > 0 enables the response cache for the OP_TYPE_READ requests of this route
+    # coalesce enables the single-flight execution of identical OP_TYPE_READ requests
     def _handler(func):
-        _rpc_handlers[name.encode('utf-8')] = func
+        cache = RpcResponseCache(name, cache_size, cache_ttl_ns) if cache_size > 0 else None
+        coalescer = RpcRequestCoalescer(name) if coalesce else None
+        _rpc_handlers[name.encode('utf-8')] = RpcRoute(name, func, execution, cache, coalescer)
         print('rpc handler', name, func)
         return func
 
     return _handler
 
 
+def rpc_batch_handler(name, max_batch_size=64, max_batch_delay_ns=1 * humans.UNIT_MS, execution=None):
+    # the handler receives the list of requests gathered within max_batch_delay_ns
+    # (or up to max_batch_size requests) and returns the list of response bodies.
+    def _handler(func):
+        route = RpcRoute(name, func, execution)
+        route.batcher = RpcRequestBatcher(name, lambda packets: _route_exec(route, packets),
+                                          max_batch_size, max_batch_delay_ns)
+        _rpc_handlers[name.encode('utf-8')] = route
+        print('rpc batch handler', name, func)
+        return func
+
+    return _handler
+
+
+def rpc_stream_handler(name):
+    # the handler is an async generator func(packet, stream): the packet body is the
+    # head of the request, the input chunks are read by iterating the stream,
+    # and every chunk yielded is sent back to the client. The final response
+    # (with an empty body) is sent when the generator completes.
+    # the stream holds an in-flight slot of the connection until completion,
+    # the input chunks are received only with max_inflight > 1 (e.g. rpc_handle()).
+    def _handler(func):
+        route = RpcRoute(name, func)
+        route.is_stream = True
+        _rpc_handlers[name.encode('utf-8')] = route
+        print('rpc stream handler', name, func)
+        return func
+
+    return _handler
+
+
+def invalidate_rpc_cache(name, body=None):
+    # drop the cached response of the request body, or every cached response of the route
+    route = _rpc_handlers.get(name.encode('utf-8'))
+    if route is not None and route.cache is not None:
+        route.cache.invalidate(body)
+
+
+def set_rpc_executor(execution, executor):
+    # replace the default executor used for the THREAD_POOL/PROCESS_POOL routes
+    old_executor = _rpc_executors.get(execution)
+    _rpc_executors[execution] = executor
+    return old_executor
+
+
+def shutdown_rpc_executors(wait=True):
+    # shutdown the executors of the THREAD_POOL/PROCESS_POOL routes (e.g. on worker exit)
+    executors = list(_rpc_executors.values())
+    _rpc_executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+
+def set_rpc_admission_controller(controller):
+    # enable the admission control (e.g. RpcAdmissionController) or disable it with None
+    global _rpc_admission
+    old_controller = _rpc_admission
+    _rpc_admission = controller
+    return old_controller
+
+
+def _get_rpc_executor(execution):
+    executor = _rpc_executors.get(execution)
+    if executor is None:
+        if execution == RpcRoute.EXEC_PROCESS_POOL:
+            executor = ProcessPoolExecutor()
+        else:
+            executor = ThreadPoolExecutor(thread_name_prefix='dnaco-rpc')
+        _rpc_executors[execution] = executor
+    return executor
+
+
+def _timed_call(func, packet):
+    # executed in the pool, to measure the real wait and run time
+    start_ns = time_ns()
+    resp_body = func(packet)
+    return start_ns, time_ns(), resp_body
+
+
+async def _timed_call_async(func, packet):
+    # the exec time includes the time spent suspended waiting on I/O
+    start_ns = time_ns()
+    resp_body = await func(packet)
+    return start_ns, time_ns(), resp_body
+
+
+async def _route_exec(route, arg):
+    # arg is the packet, or the list of packets for the batch handlers
+    packets = arg if isinstance(arg, list) else (arg,)
+    execution = route.execution_for(packets[0])
+    if route.is_async:
+        return await _timed_call_async(route.func, arg)
+    if execution == RpcRoute.EXEC_INLINE:
+        return _timed_call(route.func, arg)
+
+    if execution == RpcRoute.EXEC_PROCESS_POOL:
+        # memoryviews can't be pickled
+        for packet in packets:
+            packet.own_body()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_rpc_executor(execution), _timed_call, route.func, arg)
+
+
+RPC_OVERLOADED_BODY = b'overloaded'
+RPC_ROUTE_NOT_FOUND_BODY = b'route not found'
+RPC_RESULT_NOT_FOUND_BODY = b'result not found'
+RPC_INVALID_TRACE_ID_BODY = b'invalid trace id'
+RPC_CANCELLED_BODY = b'cancelled'
+RPC_DEADLINE_EXCEEDED_BODY = b'deadline exceeded'
+
+# READ request with the result id as body, to fetch a stored result
+RPC_RESULT_FETCH_ID = b'/dnaco/result'
+
+_rpc_result_store = RpcResultStore()
+_rpc_forwarder = None
+_rpc_wal = None
+_rpc_background_tasks = set()
+
+
+def set_rpc_result_store(store):
+    global _rpc_result_store
+    old_store = _rpc_result_store
+    _rpc_result_store = store
+    return old_store
+
+
+def set_rpc_wal(wal):
+    # frames flagged write_to_wal are appended to the wal (e.g. WalWriter) before execution.
+    # the server does not replay the wal: the frames of the previous runs must be
+    # replayed by the caller (e.g. with replay_wal) before calling set_rpc_wal().
+    global _rpc_wal
+    old_wal = _rpc_wal
+    _rpc_wal = wal
+    return old_wal
+
+
+def set_rpc_forwarder(forwarder):
+    global _rpc_forwarder
+    old_forwarder = _rpc_forwarder
+    _rpc_forwarder = forwarder
+    return old_forwarder
+
+
+def _get_rpc_forwarder():
+    global _rpc_forwarder
+    if _rpc_forwarder is None:
+        _rpc_forwarder = RpcForwarder()
+    return _rpc_forwarder
+
+
+async def _exec_request(route, packet, req_recv_ns):
+    if packet.deadline_ns is not None:
+        now_ns = time_ns()
+        if now_ns >= packet.deadline_ns:
+            # the caller already gave up, skip the execution
+            server_rpc_cancelled.inc()
+            return RpcResponse.OP_STATUS_CANCELLED, max(0, now_ns - req_recv_ns), 0, RPC_DEADLINE_EXCEEDED_BODY
+
+    admission = _rpc_admission
+    if admission is not None:
+        now_ns = time_ns()
+        dequeue_ns = max(0, now_ns - req_recv_ns)
+        if not admission.admit(route.name, dequeue_ns, now_ns):
+            # reject early, instead of accepting work that would complete late
+            return RpcResponse.OP_STATUS_FAILED, dequeue_ns, 0, RPC_OVERLOADED_BODY
+
+    try:
+        if route.batcher is not None:
+            start_ns, end_ns, resp_body = await route.batcher.submit(packet)
+        else:
+            start_ns, end_ns, resp_body = await _route_exec(route, packet)
+    finally:
+        if admission is not None:
+            admission.release(route.name, dequeue_ns)
+
+    queue_ns = max(0, start_ns - req_recv_ns)
+    exec_ns = end_ns - start_ns
+    server_rpc_exec_time.update(exec_ns)
+    return RpcResponse.OP_STATUS_SUCCEEDED, queue_ns, exec_ns, resp_body
+
+
+async def _exec_read_request(route, packet, req_recv_ns):
+    cache = route.cache
+    coalescer = route.coalescer
+    if (cache is None and coalescer is None) or packet.op_type != RpcRequest.OP_TYPE_READ:
+        return await _exec_request(route, packet, req_recv_ns)
+
+    start_ns = time_ns()
+    key = rpc_request_key(route.name, packet.body)
+    if cache is not None:
+        resp_body = cache.get(key)
+        if resp_body is not None:
+            return RpcResponse.OP_STATUS_SUCCEEDED, max(0, start_ns - req_recv_ns), time_ns() - start_ns, resp_body
+        generation = cache.generation
+
+    if coalescer is not None:
+        result = await coalescer.execute(key, lambda: _exec_request(route, packet, req_recv_ns), req_recv_ns)
+    else:
+        result = await _exec_request(route, packet, req_recv_ns)
+
+    if cache is not None and result[0] == RpcResponse.OP_STATUS_SUCCEEDED:
+        cache.put(key, result[3], generation)
+    return result
+
+
+async def _exec_and_store_result(store, route, packet, req_recv_ns, result_id):
+    try:
+        op_status, queue_ns, exec_ns, resp_body = await _exec_request(route, packet, req_recv_ns)
+    except Exception as e:
+        # TODO: use logger
+        print('FAIL rpc handler', route.name, e)
+        op_status, queue_ns, exec_ns, resp_body = RpcResponse.OP_STATUS_FAILED, 0, 0, str(e).encode('utf-8')
+    store.put(result_id, op_status, queue_ns, exec_ns, resp_body)
+
+
+async def _forward_result(route, packet, resp_body, forward_id):
+    try:
+        resp = await _get_rpc_forwarder().forward(packet, resp_body, forward_id)
+        if resp.op_status != RpcResponse.OP_STATUS_SUCCEEDED:
+            # TODO: use logger
+            print('FAIL rpc forward', route.name, packet.result_id, bytes(resp.body))
+    except Exception as e:
+        # TODO: use logger
+        print('FAIL rpc forward', route.name, packet.result_id, e)
+
+
+async def _exec_and_forward_result(route, packet, req_recv_ns):
+    targets, forward_id = split_forward_result_id(packet.result_id)
+    if forward_id is None:
+        # first stage of the chain: the id of the result, unique across the callers
+        if len(targets) > RPC_MAX_FORWARD_TARGETS_LENGTH:
+            raise ValueError('forward targets must be at most %d bytes' % RPC_MAX_FORWARD_TARGETS_LENGTH)
+        forward_id = new_forward_result_id()
+
+    op_status, queue_ns, exec_ns, resp_body = await _exec_request(route, packet, req_recv_ns)
+    if op_status != RpcResponse.OP_STATUS_SUCCEEDED:
+        return op_status, queue_ns, exec_ns, resp_body
+
+    # the result goes to the next stage in background, the caller gets the id
+    # of the result that the last stage will store.
+    _spawn_background_task(_forward_result(route, packet, resp_body, forward_id))
+    return RpcResponse.OP_STATUS_SUCCEEDED, queue_ns, exec_ns, forward_id
+
+
+async def _exec_stream(connection, route, packet, req_recv_ns):
+    frame_writer = connection.frame_writer
+
+    def _send_event(event_type, value, data=b''):
+        # the output chunks are written without copying them
+        event = encode_rpc_event(packet.rev, False, True, packet.trace_id, packet.pkg_id, event_type, value, data)
+        frame_writer.write_framed(event)
+
+    stream = connection.get_stream(packet.pkg_id)
+    if stream is None:
+        raise RpcStreamError('stream %d already closed or too many streams' % packet.pkg_id)
+    stream.send_event = _send_event
+    stream.drain = frame_writer.drain
+
+    start_ns = time_ns()
+    try:
+        async for chunk in route.func(packet, stream):
+            await stream.write(chunk)
+        op_status, resp_body = RpcResponse.OP_STATUS_SUCCEEDED, b''
+    except ConnectionError:
+        raise
+    except Exception as e:
+        # TODO: use logger
+        print('FAIL rpc stream handler', route.name, e)
+        op_status, resp_body = RpcResponse.OP_STATUS_FAILED, str(e).encode('utf-8')
+    finally:
+        connection.close_stream(packet.pkg_id)
+
+    end_ns = time_ns()
+    server_rpc_exec_time.update(end_ns - start_ns)
+    return op_status, max(0, start_ns - req_recv_ns), end_ns - start_ns, resp_body
+
+
+def _uncancel_current_task():
+    # the cancellation was handled, the task keeps running to send the response
+    task = asyncio.current_task()
+    if hasattr(task, 'uncancel'):
+        task.uncancel()
+
+
+async def _exec_cancellable(connection, packet, req_recv_ns, exec_coro):
+    # the request is cancelled by a CANCEL control packet (with the same pkg_id),
+    # or when its deadline expires. coroutine handlers are cancelled, handlers
+    # running in the pools complete in background, but the caller gets the
+    # CANCELLED response right away.
+    if connection is not None:
+        connection.requests[packet.pkg_id] = asyncio.current_task()
+    try:
+        if packet.deadline_ns is None:
+            return await exec_coro
+
+        timeout_ns = max(0, packet.deadline_ns - time_ns())
+        try:
+            return await asyncio.wait_for(exec_coro, timeout_ns / humans.UNIT_SEC)
+        except asyncio.TimeoutError:
+            if time_ns() < packet.deadline_ns:
+                # raised by the handler
+                raise
+            resp_body = RPC_DEADLINE_EXCEEDED_BODY
+    except asyncio.CancelledError:
+        if connection is None or packet.pkg_id not in connection.cancelled:
+            raise
+        _uncancel_current_task()
+        resp_body = RPC_CANCELLED_BODY
+    finally:
+        if connection is not None:
+            connection.requests.pop(packet.pkg_id, None)
+            connection.cancelled.discard(packet.pkg_id)
+
+    server_rpc_cancelled.inc()
+    return RpcResponse.OP_STATUS_CANCELLED, max(0, time_ns() - req_recv_ns), 0, resp_body
+
+
+def _record_route_stats(route, packet, queue_ns, exec_ns, resp_body):
+    # called once per request on the event loop, keep it cheap
+    name = route.name
+    server_rpc_route_queue_time.add(name, queue_ns)
+    server_rpc_route_exec_time.add(name, exec_ns)
+    server_rpc_route_req_size.add(name, len(packet.body))
+    server_rpc_route_resp_size.add(name, len(resp_body))
+    server_rpc_slowest_calls.add(name, queue_ns + exec_ns, packet.trace_id)
+
+
+def _spawn_background_task(coro):
+    # keep a reference to the task until it completes
+    task = asyncio.ensure_future(coro)
+    _rpc_background_tasks.add(task)
+    task.add_done_callback(_rpc_background_tasks.discard)
+    return task
+
+
+def _encode_response(packet, op_status, queue_ns, exec_ns, body):
+    # heads and body joined once, the frame header is added by the FrameWriter
+    return encode_rpc_response(None, False, False, packet.trace_id, packet.pkg_id, op_status, queue_ns, exec_ns, body)
+
+
+async def _request_handle(rev, packet, req_recv_ns):
+    # a failing request gets a FAILED response, the other requests
+    # in flight on the same connection are not affected.
+    try:
+        return await _request_exec(rev, packet, req_recv_ns)
+    except Exception as e:
+        # TODO: use logger
+        print('FAIL rpc request', bytes(packet.request_id), e)
+        resp = _encode_response(packet, RpcResponse.OP_STATUS_FAILED, max(0, time_ns() - req_recv_ns), 0,
+                                str(e).encode('utf-8'))
+        return rev, False, resp
+
+
+async def _request_exec(rev, packet, req_recv_ns):
+    if packet.request_id == RPC_RESULT_FETCH_ID:
+        result = await _rpc_result_store.get(packet.own_body())
+        if result is None:
+            result = (RpcResponse.OP_STATUS_FAILED, 0, 0, RPC_RESULT_NOT_FOUND_BODY)
+        resp = _encode_response(packet, *result)
+        return rev, False, resp
+    if packet.request_id == RPC_TRACES_FETCH_ID:
+        traces = rpc_traces_body(packet.body)
+        if traces is None:
+            resp = _encode_response(packet, RpcResponse.OP_STATUS_FAILED, 0, 0, RPC_INVALID_TRACE_ID_BODY)
+        else:
+            resp = _encode_response(packet, RpcResponse.OP_STATUS_SUCCEEDED, 0, 0, traces)
+        return rev, False, resp
+
+    route = _rpc_handlers.get(packet.request_id)
+    if not route:
+        resp = _encode_response(packet, RpcResponse.OP_STATUS_FAILED, max(0, time_ns() - req_recv_ns), 0,
+                                RPC_ROUTE_NOT_FOUND_BODY)
+        return rev, False, resp
+
+    connection = rpc_connection.get()
+    if route.is_stream:
+        if connection is None:
+            raise ValueError('stream requests require a connection context')
+        span = rpc_server_span_begin(packet.trace_id, route.name, req_recv_ns)
+        result = await _exec_cancellable(connection, packet, req_recv_ns,
+                                         _exec_stream(connection, route, packet, req_recv_ns))
+        _record_route_stats(route, packet, result[1], result[2], result[3])
+        if span is not None:
+            span.record_exec(result[1], result[2])
+        return rev, False, _encode_response(packet, *result)
+
+    if packet.send_result_to in (RpcRequest.STORE_RESULT_IN_MEMORY, RpcRequest.STORE_RESULT_WITH_ID):
+        # fire-and-forget: reply with the result id, the result is stored when the execution completes.
+        store = _rpc_result_store
+        result_id = packet.result_id or store.next_result_id()
+        store.begin(result_id)
+        _spawn_background_task(_exec_and_store_result(store, route, packet, req_recv_ns, result_id))
+        resp = _encode_response(packet, RpcResponse.OP_STATUS_SUCCEEDED, 0, 0, result_id)
+        return rev, False, resp
+
+    span = rpc_server_span_begin(packet.trace_id, route.name, req_recv_ns)
+    if packet.send_result_to == RpcRequest.FORWARD_RESULT_TO:
+        exec_coro = _exec_and_forward_result(route, packet, req_recv_ns)
+    else:
+        exec_coro = _exec_read_request(route, packet, req_recv_ns)
+    op_status, queue_ns, exec_ns, resp_body = await _exec_cancellable(connection, packet, req_recv_ns, exec_coro)
+    _record_route_stats(route, packet, queue_ns, exec_ns, resp_body)
+    if span is not None:
+        span.record_exec(queue_ns, exec_ns)
+    resp = _encode_response(packet, op_status, queue_ns, exec_ns, resp_body)
+    return rev, False, resp
+
+
+async def _batch_handle(rev, write_to_wal, req_recv_ns, batch):
+    # the packets of the batch are dispatched concurrently
+    packets = [parse_rpc_packet(FrameReader(data)) for data in parse_rpc_batch(batch.body)]
+    rpc_batch_packets.add(len(packets))
+    if batch.value & RpcControl.BATCH_STREAM_RESPONSES:
+        connection = rpc_connection.get()
+        if connection is None:
+            raise NotImplementedError('streamed batch responses require a connection context')
+
+        async def _dispatch_and_write(packet):
+            result = await _packet_dispatch(rev, write_to_wal, req_recv_ns, packet)
+            if result is not None:
+                connection.frame_writer.write(*result)
+                await connection.frame_writer.drain()
+
+        await asyncio.gather(*[_dispatch_and_write(packet) for packet in packets])
+        return None
+
+    results = await asyncio.gather(*[_packet_dispatch(rev, write_to_wal, req_recv_ns, packet) for packet in packets])
+    responses = [result[2] for result in results if result is not None]
+    resp = encode_rpc_control(None, False, False, batch.trace_id, batch.pkg_id, RpcControl.CONTROL_BATCH, 0,
+                              build_rpc_batch(responses))
+    return rev, False, resp
+
+
+def _wal_failed_response(rev, packet, req_recv_ns, error):
+    # the frame was not written to the wal: the requests in it fail, the connection is kept
+    if isinstance(packet, RpcControl):
+        if packet.control_type == RpcControl.CONTROL_DEADLINE:
+            return _wal_failed_response(rev, parse_rpc_packet(FrameReader(packet.body)), req_recv_ns, error)
+        if packet.control_type == RpcControl.CONTROL_BATCH:
+            responses = []
+            for data in parse_rpc_batch(packet.body):
+                result = _wal_failed_response(rev, parse_rpc_packet(FrameReader(data)), req_recv_ns, error)
+                if result is not None:
+                    responses.append(result[2])
+            resp = encode_rpc_control(None, False, False, packet.trace_id, packet.pkg_id, RpcControl.CONTROL_BATCH, 0,
+                                      build_rpc_batch(responses))
+            return rev, False, resp
+    if not isinstance(packet, RpcRequest):
+        return None
+    resp = _encode_response(packet, RpcResponse.OP_STATUS_FAILED, max(0, time_ns() - req_recv_ns), 0,
+                            ('wal write failed: %s' % error).encode('utf-8'))
+    return rev, False, resp
+
+
 async def packet_handle(rev, write_to_wal, req_recv_ns, data):
     reader = FrameReader(data)
     packet = parse_rpc_packet(reader)
-    packet.rev = rev
-    packet.write_to_wal = write_to_wal
-    if isinstance(packet, RpcRequest):
-        func = _rpc_handlers.get(packet.request_id)
-        if not func:
-            # TODO: handle with RPC NOT FOUND
-            raise NotImplementedError
+    if write_to_wal and _rpc_wal is not None:
+        # wait for the group commit, the response is sent only once the frame is durable
+        try:
+            await _rpc_wal.append(rev, data)
+        except Exception as e:
+            # TODO: use logger
+            print('FAIL rpc wal append', e)
+            return _wal_failed_response(rev, packet, req_recv_ns, e)
 
-        start_ns = time_ns()
-        queue_ns = start_ns - req_recv_ns
-        resp_body = func(packet)
-        exec_ns = time_ns() - start_ns
+    return await _packet_dispatch(rev, write_to_wal, req_recv_ns, packet)
 
-        pkg_builder = RpcPacketBuilder(rev)
-        resp = pkg_builder.new_response(packet.trace_id, packet.pkg_id, RpcResponse.OP_STATUS_SUCCEEDED, queue_ns, exec_ns, resp_body)
-        return rev, False, resp
 
+async def _packet_dispatch(rev, write_to_wal, req_recv_ns, packet):
+    if isinstance(packet, RpcControl):
+        if packet.control_type == RpcControl.CONTROL_DEADLINE:
+            # the request wrapped by the control packet, with the time budget relative to the frame receive time
+            deadline_ns = req_recv_ns + packet.value
+            packet = parse_rpc_packet(FrameReader(packet.body))
+            if not isinstance(packet, RpcRequest):
+                raise NotImplementedError('deadline control with a non-request packet')
+            packet.deadline_ns = deadline_ns
+        elif packet.control_type == RpcControl.CONTROL_CANCEL:
+            connection = rpc_connection.get()
+            if connection is not None:
+                connection.cancel_request(packet.pkg_id)
+            return None
+        elif packet.control_type == RpcControl.CONTROL_BATCH:
+            return await _batch_handle(rev, write_to_wal, req_recv_ns, packet)
+        else:
+            # TODO: handle other control packets...
+            raise NotImplementedError
+
+    packet.rev = rev
+    packet.write_to_wal = write_to_wal
+    if isinstance(packet, RpcRequest):
+        return await _request_handle(rev, packet, req_recv_ns)
+    elif isinstance(packet, RpcEvent):
+        connection = rpc_connection.get()
+        if connection is not None:
+            if packet.event_type in (RpcEvent.EVENT_STREAM_DATA, RpcEvent.EVENT_STREAM_END):
+                stream = connection.get_stream(packet.pkg_id)
+            else:
+                stream = connection.streams.get(packet.pkg_id)
+            if stream is not None:
+                handle_stream_event(stream, packet)
     elif isinstance(packet, RpcResponse):
         # TODO: handle responses
         pass
@@ -152,5 +992,32 @@ async def packet_handle(rev, write_to_wal, req_recv_ns, data):
         raise NotImplementedError
 
 
-async def rpc_handle(reader, writer):
-    await frame_handle(reader, writer, packet_handle)
+# packet_handle() with the negotiated frame compression, and the shared memory frames
+rpc_frame_handler = shm_frame_handler(compression_frame_handler(packet_handle), rpc_connection)
+
+RPC_MAX_INFLIGHT_PER_CONNECTION = 64
+
+
+async def rpc_handle(reader, writer, max_inflight=RPC_MAX_INFLIGHT_PER_CONNECTION):
+    await frame_handle(reader, writer, rpc_frame_handler, max_inflight)
+
+
+def _is_live_unix_socket(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+    finally:
+        sock.close()
+
+
+async def start_rpc_unix_server(path, client_connected_cb=rpc_handle):
+    # same-host clients skip the TCP stack, and can attach a shared memory channel
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        if _is_live_unix_socket(path):
+            raise OSError(errno.EADDRINUSE, 'rpc server already listening on %s' % path)
+        # stale socket of a previous run
+        os.unlink(path)
+    return await asyncio.start_unix_server(client_connected_cb, path)
@@ -0,0 +1,255 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mmap
+import os
+import secrets
+import socket
+import struct
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from dnaco.telemetry.collector import TelemetryCollector
+from dnaco.telemetry.time_range_counter import TimeRangeCounter
+from dnaco.util import humans
+
+# Frames with the FRAME_REV_SHM bit set in the rev, have the frame data in the
+# shared memory ring of the connection, and only the descriptor goes through the socket.
+#   +------+ +---------------+ +--------------+
+#   | kind | | Position (u64)| | Length (u32) |
+#   +------+ +---------------+ +--------------+
+#   0      1                 9               13
+# the SHM_ATTACH descriptor has the ring size and the name of the shared memory
+# segment created by the client, instead of position/length.
+#   +------+ +-----------------+ +------+
+#   | kind | | Ring Size (u32) | | Name |
+#   +------+ +-----------------+ +------+
+#   0      1                   5
+FRAME_REV_SHM = 0x4
+
+SHM_ATTACH = 0
+SHM_DATA = 1
+SHM_DESCRIPTOR_SIZE = 13
+
+# frames above the threshold are sent through the shared memory ring
+SHM_THRESHOLD = 64 << 10
+SHM_RING_SIZE = 64 << 20
+SHM_MAX_RING_SIZE = 1 << 30
+
+# the server attaches only the segments named like the ones created by ShmChannel.create()
+SHM_NAME_PREFIX = 'dnaco-'
+SHM_NAME_RANDOM_BYTES = 8
+
+# each ring has a header with the consumer position, the producer position is local
+SHM_RING_HEADER_SIZE = 64
+
+rpc_shm_bytes = TelemetryCollector.register(
+    name='dnaco_rpc_shm_bytes',
+    label='Bytes sent through Shared Memory',
+    help_descr='Frame data sent through the shared memory rings, divided by minute',
+    unit=humans.HUMAN_SIZE,
+    collector=TimeRangeCounter(60 * humans.UNIT_MIN, 1 * humans.UNIT_MIN)
+)
+
+
+class ShmRing:
+    # Single producer/single consumer ring. The producer writes the frame data at
+    # its position (skipping the end of the ring when the data does not fit),
+    # and the consumer copies it out in the same order, advancing the tail.
+    # when the ring is full the producer returns None, and the frame is sent inline.
+    def __init__(self, buf):
+        self.header = buf[:SHM_RING_HEADER_SIZE]
+        self.data = buf[SHM_RING_HEADER_SIZE:]
+        self.size = len(self.data)
+        self.head = self.tail()
+
+    def tail(self):
+        return struct.unpack_from('<Q', self.header, 0)[0]
+
+    def write(self, data):
+        length = len(data)
+        if length > self.size:
+            return None
+
+        pos = self.head
+        offset = pos % self.size
+        if offset + length > self.size:
+            pos += self.size - offset
+            offset = 0
+        if (pos + length - self.tail()) > self.size:
+            return None
+
+        self.data[offset:offset + length] = data
+        self.head = pos + length
+        rpc_shm_bytes.add(length)
+        return pos
+
+    def read(self, pos, length):
+        offset = pos % self.size
+        data = bytes(self.data[offset:offset + length])
+        struct.pack_into('<Q', self.header, 0, pos + length)
+        return data
+
+    def write_frame(self, data):
+        # returns the descriptor to send instead of the frame data, or None if the ring is full
+        pos = self.write(data)
+        if pos is None:
+            return None
+        return struct.pack('<BQI', SHM_DATA, pos, len(data))
+
+    def read_frame(self, descriptor):
+        if len(descriptor) != SHM_DESCRIPTOR_SIZE or descriptor[0] != SHM_DATA:
+            raise ValueError('invalid shared memory descriptor')
+        _, pos, length = struct.unpack_from('<BQI', descriptor, 0)
+        # the producer never writes past tail + size, and never wraps a frame
+        tail = self.tail()
+        if length > self.size or pos < tail or (pos + length - tail) > self.size or (pos % self.size) + length > self.size:
+            raise ValueError('invalid shared memory frame pos=%d length=%d tail=%d size=%d' % (pos, length, tail, self.size))
+        return self.read(pos, length)
+
+    def release(self):
+        self.header.release()
+        self.data.release()
+
+
+# segments created by this process, the resource tracker already knows about them
+_created_segments = set()
+
+
+def _segment_name(shm):
+    # shm.name may have the leading '/' of the posix name
+    return shm.name.lstrip('/')
+
+
+def _channel_size(ring_size):
+    return 2 * (SHM_RING_HEADER_SIZE + ring_size)
+
+
+def _is_channel_name(name):
+    if not name.startswith(SHM_NAME_PREFIX):
+        return False
+    suffix = name[len(SHM_NAME_PREFIX):]
+    return len(suffix) == 2 * SHM_NAME_RANDOM_BYTES and all(c in '0123456789abcdef' for c in suffix)
+
+
+def _posix_segment_size(name):
+    # size of the segment, without mapping it
+    import _posixshmem
+    fd = _posixshmem.shm_open('/' + name, os.O_RDONLY, mode=0o600)
+    try:
+        return os.fstat(fd).st_size
+    finally:
+        os.close(fd)
+
+
+class ShmChannel:
+    # A shared memory segment with two rings, created by the client:
+    # the first one for the client->server frames, the second one for the replies.
+    def __init__(self, shm, owner, ring_size):
+        self.shm = shm
+        self.owner = owner
+        self.ring_size = ring_size
+        half_size = SHM_RING_HEADER_SIZE + ring_size
+        rings = (ShmRing(shm.buf[:half_size]), ShmRing(shm.buf[half_size:2 * half_size]))
+        self.tx, self.rx = rings if owner else reversed(rings)
+
+    @staticmethod
+    def create(ring_size=SHM_RING_SIZE):
+        if not 0 < ring_size <= SHM_MAX_RING_SIZE:
+            raise ValueError('invalid shared memory ring size %d' % ring_size)
+        while True:
+            name = SHM_NAME_PREFIX + secrets.token_hex(SHM_NAME_RANDOM_BYTES)
+            try:
+                shm = SharedMemory(name=name, create=True, size=_channel_size(ring_size))
+                break
+            except FileExistsError:
+                continue
+        _created_segments.add(_segment_name(shm))
+        return ShmChannel(shm, True, ring_size)
+
+    @staticmethod
+    def attach(name, ring_size):
+        # the name and the size come from the client: check them before mapping anything
+        if not _is_channel_name(name):
+            raise ValueError('invalid shared memory name %r' % name)
+        if not 0 < ring_size <= SHM_MAX_RING_SIZE:
+            raise ValueError('invalid shared memory ring size %d' % ring_size)
+        expected_size = _channel_size(ring_size)
+        size = _posix_segment_size(name)
+        # the segment size may be rounded up to the page size
+        page_size = mmap.PAGESIZE
+        if size != expected_size and size != ((expected_size + page_size - 1) // page_size) * page_size:
+            raise ValueError('unexpected shared memory size %d, expected %d' % (size, expected_size))
+        shm = SharedMemory(name=name)
+        # the segment is owned (and unlinked) by the client,
+        # the resource tracker of this process must not unlink it on exit
+        name = _segment_name(shm)
+        if name not in _created_segments:
+            # the tracker has the posix name
+            resource_tracker.unregister('/' + name, 'shared_memory')
+        return ShmChannel(shm, False, ring_size)
+
+    def attach_descriptor(self):
+        return struct.pack('<BI', SHM_ATTACH, self.ring_size) + self.shm.name.encode('utf-8')
+
+    def close(self):
+        self.tx.release()
+        self.rx.release()
+        self.shm.close()
+        if self.owner:
+            _created_segments.discard(_segment_name(self.shm))
+            self.shm.unlink()
+
+
+def _is_unix_transport(transport):
+    sock = transport.get_extra_info('socket')
+    return sock is not None and sock.family == getattr(socket, 'AF_UNIX', None)
+
+
+def shm_frame_handler(handler, connection_var, threshold=SHM_THRESHOLD):
+    # wrap a frame handler(rev, write_to_wal, req_recv_ns, data): the frame data
+    # of the FRAME_REV_SHM frames is read from the connection ring (before any await,
+    # so in the order the frames were received), and the large replies are
+    # written to the reply ring. shared memory is accepted only on unix sockets.
+    async def _handler(rev, write_to_wal, req_recv_ns, data):
+        connection = connection_var.get()
+        if rev & FRAME_REV_SHM:
+            rev &= ~FRAME_REV_SHM
+            if data[0] == SHM_ATTACH:
+                if connection is None or not _is_unix_transport(connection.frame_writer.transport):
+                    raise NotImplementedError('shared memory is supported only on unix sockets')
+                connection.close_shm()
+                if len(data) <= 5:
+                    raise ValueError('invalid shared memory attach descriptor')
+                ring_size, = struct.unpack_from('<I', data, 1)
+                connection.shm = ShmChannel.attach(bytes(data[5:]).decode('utf-8'), ring_size)
+                return None
+            if connection is None or connection.shm is None:
+                raise ValueError('shared memory frame without an attached channel')
+            data = connection.shm.rx.read_frame(data)
+
+        result = await handler(rev, write_to_wal, req_recv_ns, data)
+        if result is None or connection is None or connection.shm is None:
+            return result
+
+        resp_rev, resp_write_to_wal, resp_data = result
+        if len(resp_data) >= threshold:
+            descriptor = connection.shm.tx.write_frame(resp_data)
+            if descriptor is not None:
+                return resp_rev | FRAME_REV_SHM, resp_write_to_wal, descriptor
+        return result
+
+    return _handler
@@ -0,0 +1,152 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+from .packet import RpcEvent
+
+# max number of chunks that a sender can have in flight, before receiving a STREAM_WINDOW
+RPC_STREAM_WINDOW = 16
+# the chunks written are split to keep the frames (and the receiver buffers) small
+RPC_STREAM_CHUNK_SIZE = 1 << 20
+
+
+class RpcStreamError(Exception):
+    pass
+
+
+class RpcStream:
+    # One direction of data in, one direction of data out, both chunked in
+    # STREAM_DATA events. The inbound chunks are numbered, since the frames
+    # of a connection may complete out of order (e.g. decompressed in the executor),
+    # and are reordered before being returned by read().
+    # Flow control is credit based: the sender starts with RPC_STREAM_WINDOW credits,
+    # each chunk sent consumes one, and the receiver gives them back with a
+    # STREAM_WINDOW event once the chunks are consumed.
+    def __init__(self, window=RPC_STREAM_WINDOW):
+        self.window = window
+        # send_event(event_type, value, data) and drain() are set by the connection owning the stream
+        self.send_event = None
+        self.drain = None
+        self.error = None
+        # inbound state
+        self.chunks = {}
+        self.read_seq = 0
+        self.eof_seq = None
+        self.consumed = 0
+        self._read_waiter = None
+        # outbound state
+        self.write_seq = 0
+        self.write_credits = window
+        self._credit_waiter = None
+
+    def feed(self, seq, chunk):
+        if seq < self.read_seq or seq in self.chunks or len(self.chunks) >= self.window:
+            self.abort(RpcStreamError('stream window exceeded or chunk %d duplicated' % seq))
+            return
+        self.chunks[seq] = chunk
+        self._wake_reader()
+
+    def feed_eof(self, seq=None):
+        # seq is the number of chunks sent, None if all the chunks were already received
+        self.eof_seq = seq if seq is not None else (self.read_seq + len(self.chunks))
+        self._wake_reader()
+
+    def grant(self, credits):
+        self.write_credits += credits
+        self._wake_writer()
+
+    def abort(self, error):
+        if self.error is None:
+            self.error = error
+        self._wake_reader()
+        self._wake_writer()
+
+    def is_eof(self):
+        return self.eof_seq is not None and self.read_seq >= self.eof_seq
+
+    async def read(self):
+        # returns the next chunk, or None at the end of the stream
+        while True:
+            chunk = self.chunks.pop(self.read_seq, None)
+            if chunk is not None:
+                self.read_seq += 1
+                self.consumed += 1
+                if self.consumed >= max(1, self.window // 2) and self.send_event is not None:
+                    self.send_event(RpcEvent.EVENT_STREAM_WINDOW, self.consumed)
+                    self.consumed = 0
+                return chunk
+
+            if self.is_eof():
+                return None
+            if self.error is not None:
+                raise self.error
+
+            self._read_waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._read_waiter
+            finally:
+                self._read_waiter = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self.read()
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
+
+    async def write(self, data):
+        data = memoryview(data)
+        for offset in range(0, len(data), RPC_STREAM_CHUNK_SIZE):
+            while self.write_credits <= 0 and self.error is None:
+                self._credit_waiter = asyncio.get_running_loop().create_future()
+                try:
+                    await self._credit_waiter
+                finally:
+                    self._credit_waiter = None
+
+            if self.error is not None:
+                raise self.error
+
+            self.write_credits -= 1
+            self.send_event(RpcEvent.EVENT_STREAM_DATA, self.write_seq, data[offset:offset + RPC_STREAM_CHUNK_SIZE])
+            self.write_seq += 1
+            await self.drain()
+
+    async def write_eof(self):
+        self.send_event(RpcEvent.EVENT_STREAM_END, self.write_seq)
+        await self.drain()
+
+    def _wake_reader(self):
+        if self._read_waiter is not None and not self._read_waiter.done():
+            self._read_waiter.set_result(None)
+
+    def _wake_writer(self):
+        if self._credit_waiter is not None and not self._credit_waiter.done():
+            self._credit_waiter.set_result(None)
+
+
+def handle_stream_event(stream, event):
+    if event.event_type == RpcEvent.EVENT_STREAM_DATA:
+        stream.feed(event.value, event.body)
+    elif event.event_type == RpcEvent.EVENT_STREAM_END:
+        stream.feed_eof(event.value)
+    elif event.event_type == RpcEvent.EVENT_STREAM_WINDOW:
+        stream.grant(event.value)
+    else:
+        stream.abort(RpcStreamError('stream aborted by the remote side'))
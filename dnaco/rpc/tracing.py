@@ -0,0 +1,195 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextvars
+import json
+import random
+from array import array
+from time import time_ns
+
+# Sampled spans keyed by trace_id. The sampling decision is taken from the trace_id
+# itself (head-based): every service using the same sample rate records the same
+# traces, without propagating a sampled flag. The spans are stored in a fixed-size
+# ring, preallocated when the tracer is created, the oldest spans are overwritten.
+#
+# Server spans (children of 'rpc.server', from the frame received to the handler result):
+#   rpc.queue: frame received -> handler start
+#   rpc.exec:  handler start -> handler end
+#   rpc.write: handler end -> response frame handed to the transport
+# Client spans ('rpc.client') are children of the server span of the request being executed.
+RPC_TRACE_RING_SIZE = 16 << 10
+
+# READ request with a trace_id (decimal) as body, or an empty body for all the spans
+RPC_TRACES_FETCH_ID = b'/dnaco/traces'
+
+_SAMPLE_HASH_MULT = 0x9E3779B97F4A7C15
+_U64_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+class SpanRing:
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self.trace_ids = array('Q', bytes(8 * size))
+        self.span_ids = array('Q', bytes(8 * size))
+        self.parent_ids = array('Q', bytes(8 * size))
+        self.start_ns = array('q', bytes(8 * size))
+        self.end_ns = array('q', bytes(8 * size))
+        self.names = [None] * size
+        self.tags = [None] * size
+
+    def add(self, trace_id, span_id, parent_id, name, start_ns, end_ns, tag=None):
+        index = self.count % self.size
+        self.trace_ids[index] = trace_id
+        self.span_ids[index] = span_id
+        self.parent_ids[index] = parent_id
+        self.start_ns[index] = start_ns
+        self.end_ns[index] = end_ns
+        self.names[index] = name
+        self.tags[index] = tag
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+
+    def spans(self, trace_id=None):
+        # from the oldest to the newest
+        spans = []
+        for i in range(max(0, self.count - self.size), self.count):
+            index = i % self.size
+            if trace_id is not None and self.trace_ids[index] != trace_id:
+                continue
+            spans.append({
+                'trace_id': self.trace_ids[index],
+                'span_id': self.span_ids[index],
+                'parent_id': self.parent_ids[index],
+                'name': self.names[index],
+                'start_ns': self.start_ns[index],
+                'end_ns': self.end_ns[index],
+                'tag': self.tags[index],
+            })
+        return spans
+
+
+class RpcTracer:
+    def __init__(self, sample_rate=0.01, ring_size=RPC_TRACE_RING_SIZE):
+        self.ring = SpanRing(ring_size)
+        self.threshold = 0
+        self.set_sample_rate(sample_rate)
+        # span ids are unique within the process, the random base avoids clashes between processes
+        self._next_span_id = random.getrandbits(48) << 8
+
+    def set_sample_rate(self, sample_rate):
+        self.threshold = int(max(0.0, min(1.0, sample_rate)) * (1 << 64))
+
+    def is_sampled(self, trace_id):
+        return ((trace_id * _SAMPLE_HASH_MULT) & _U64_MASK) < self.threshold
+
+    def next_span_id(self):
+        self._next_span_id += 1
+        return self._next_span_id
+
+    def add_span(self, trace_id, parent_id, name, start_ns, end_ns, tag=None):
+        span_id = self.next_span_id()
+        self.ring.add(trace_id, span_id, parent_id, name, start_ns, end_ns, tag)
+        return span_id
+
+    def spans(self, trace_id=None):
+        return self.ring.spans(trace_id)
+
+    def dump(self, path, trace_id=None):
+        # one json span per line
+        with open(path, 'w') as fd:
+            for span in self.spans(trace_id):
+                fd.write(json.dumps(span))
+                fd.write('\n')
+
+
+class RpcServerSpan:
+    __slots__ = ('tracer', 'trace_id', 'span_id', 'route', 'recv_ns', 'exec_end_ns')
+
+    def __init__(self, tracer, trace_id, route, recv_ns):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = tracer.next_span_id()
+        self.route = route
+        self.recv_ns = recv_ns
+        self.exec_end_ns = None
+
+    def record_exec(self, queue_ns, exec_ns):
+        start_ns = self.recv_ns + queue_ns
+        self.exec_end_ns = start_ns + exec_ns
+        tracer = self.tracer
+        tracer.add_span(self.trace_id, self.span_id, 'rpc.queue', self.recv_ns, start_ns, self.route)
+        tracer.add_span(self.trace_id, self.span_id, 'rpc.exec', start_ns, self.exec_end_ns, self.route)
+        tracer.ring.add(self.trace_id, self.span_id, 0, 'rpc.server', self.recv_ns, time_ns(), self.route)
+
+    def record_write(self, end_ns):
+        if self.exec_end_ns is not None:
+            self.tracer.add_span(self.trace_id, self.span_id, 'rpc.write', self.exec_end_ns, end_ns, self.route)
+
+
+_rpc_tracer = None
+
+# the server span of the request executed by the current task, None if not sampled
+rpc_server_span = contextvars.ContextVar('rpc_server_span', default=None)
+
+
+def set_rpc_tracer(tracer):
+    # enable the span recording (e.g. RpcTracer(sample_rate=0.01)) or disable it with None
+    global _rpc_tracer
+    old_tracer = _rpc_tracer
+    _rpc_tracer = tracer
+    return old_tracer
+
+
+def get_rpc_tracer():
+    return _rpc_tracer
+
+
+def rpc_server_span_begin(trace_id, route, recv_ns):
+    # returns None (and records nothing) when tracing is disabled or the trace is not sampled
+    tracer = _rpc_tracer
+    if tracer is None or not tracer.is_sampled(trace_id):
+        return None
+    span = RpcServerSpan(tracer, trace_id, route, recv_ns)
+    rpc_server_span.set(span)
+    return span
+
+
+def rpc_client_span_begin(trace_id):
+    # returns (tracer, parent span id), or None when the trace is not sampled
+    tracer = _rpc_tracer
+    if tracer is None or not tracer.is_sampled(trace_id):
+        return None
+    parent = rpc_server_span.get()
+    return tracer, (parent.span_id if parent is not None and parent.trace_id == trace_id else 0)
+
+
+def rpc_traces_body(trace_id_body):
+    # body of the RPC_TRACES_FETCH_ID response: the json list of the spans.
+    # returns None if the request body is not a trace id
+    trace_id = None
+    if len(trace_id_body) > 0:
+        try:
+            trace_id = int(bytes(trace_id_body))
+        except ValueError:
+            return None
+
+    tracer = _rpc_tracer
+    if tracer is None:
+        return b'[]'
+    return json.dumps(tracer.spans(trace_id)).encode('utf-8')
@@ -0,0 +1,261 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import mmap
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from time import time_ns
+
+from dnaco.telemetry.collector import TelemetryCollector
+from dnaco.telemetry.max_and_avg_time_range_counter import MaxAndAvgTimeRangeGauge
+from dnaco.telemetry.time_range_counter import TimeRangeCounter
+from dnaco.util import humans
+
+from .frame import build_frame_header, parse_frame_header
+
+# The WAL is a directory of append-only segments named <seqid>.wal
+# each record is the frame, with the crc32 of the frame data after the frame header.
+#   +--------------+-------------+-------------------+
+#   | frame header | crc32 (u32) | ...frame data...  |
+#   +--------------+-------------+-------------------+
+#   0              4             8
+WAL_SEGMENT_EXT = '.wal'
+WAL_RECORD_HEADER_SIZE = 8
+
+wal_sync_time = TelemetryCollector.register(
+    name='dnaco_rpc_wal_sync_time',
+    label='WAL Group Commit Sync Time',
+    help_descr='Time spent writing and syncing a WAL batch',
+    unit=humans.HUMAN_TIME_NS,
+    collector=MaxAndAvgTimeRangeGauge(60 * humans.UNIT_MIN, 1 * humans.UNIT_MIN)
+)
+
+wal_sync_bytes = TelemetryCollector.register(
+    name='dnaco_rpc_wal_sync_bytes',
+    label='WAL Bytes Written',
+    help_descr='Bytes written to the WAL divided by minute',
+    unit=humans.HUMAN_SIZE,
+    collector=TimeRangeCounter(60 * humans.UNIT_MIN, 1 * humans.UNIT_MIN)
+)
+
+wal_sync_count = TelemetryCollector.register(
+    name='dnaco_rpc_wal_sync_count',
+    label='WAL Syncs',
+    help_descr='WAL group commits (fsync) divided by minute',
+    unit=humans.HUMAN_COUNT,
+    collector=TimeRangeCounter(60 * humans.UNIT_MIN, 1 * humans.UNIT_MIN)
+)
+
+
+def wal_segments(directory):
+    segments = []
+    for name in os.listdir(directory):
+        if name.endswith(WAL_SEGMENT_EXT) and name[:-len(WAL_SEGMENT_EXT)].isdigit():
+            segments.append((int(name[:-len(WAL_SEGMENT_EXT)]), os.path.join(directory, name)))
+    segments.sort()
+    return segments
+
+
+def _scan_segment(seqid, view):
+    offset = 0
+    length = len(view)
+    while (offset + WAL_RECORD_HEADER_SIZE) <= length:
+        rev, _, data_length = parse_frame_header(view[offset:offset + 4])
+        crc = int.from_bytes(view[offset + 4:offset + 8], byteorder='little')
+        data_offset = offset + WAL_RECORD_HEADER_SIZE
+        if (data_offset + data_length) > length:
+            # truncated record, the batch was never acknowledged
+            break
+
+        data = view[data_offset:data_offset + data_length]
+        if zlib.crc32(data) != crc:
+            # TODO: use logger
+            print('WAL segment', seqid, 'corrupted record at offset', offset)
+            break
+
+        yield seqid, offset, rev, data
+        offset = data_offset + data_length
+
+
+def replay_wal(directory):
+    # yields (seqid, offset, rev, data) for each record in the WAL.
+    # not called by the server: the application replays the records on startup,
+    # before the WalWriter for the new segments is installed with set_rpc_wal().
+    # data is a memoryview on the mmap-ed segment, valid only until the next record:
+    # copy it (bytes(data)) if it must be kept.
+    for seqid, path in wal_segments(directory):
+        with open(path, 'rb') as fd:
+            if os.fstat(fd.fileno()).st_size == 0:
+                continue
+            mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+        try:
+            for record in _scan_segment(seqid, view):
+                yield record
+                record[3].release()
+        finally:
+            view.release()
+            try:
+                mm.close()
+            except BufferError:
+                # the caller is still holding a view, the mmap is closed when released
+                pass
+
+
+class WalWriter:
+    # Append-only segmented WAL with group commit: the records appended within
+    # group_commit_window sec (or until group_commit_bytes are pending) are written
+    # with a single writev() and share a single fsync. append() returns only once
+    # the record batch is durable. the records appended while a sync is in progress
+    # form the next batch, which is synced as soon as the current one completes.
+    def __init__(self, directory, max_segment_size=64 << 20, group_commit_window=0.002, group_commit_bytes=1 << 20):
+        self.directory = directory
+        self.max_segment_size = max_segment_size
+        self.group_commit_window = group_commit_window
+        self.group_commit_bytes = group_commit_bytes
+        os.makedirs(directory, exist_ok=True)
+        segments = wal_segments(directory)
+        # never append to the existing segments, the tail may be a partial batch
+        self.seqid = (segments[-1][0] + 1) if segments else 0
+        self.segment_fd = None
+        self.segment_size = 0
+        self.pending_buffers = []
+        self.pending_futures = []
+        self.pending_bytes = 0
+        self._flush_handle = None
+        self._flush_task = None
+        self.closed = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dnaco-wal')
+
+    async def append(self, rev, data):
+        if self.closed:
+            raise ValueError('WAL is closed')
+        header = build_frame_header(rev, True, len(data)) + zlib.crc32(data).to_bytes(4, byteorder='little')
+        future = asyncio.get_running_loop().create_future()
+        self.pending_buffers.append(header)
+        self.pending_buffers.append(data)
+        self.pending_futures.append(future)
+        self.pending_bytes += WAL_RECORD_HEADER_SIZE + len(data)
+
+        if self.pending_bytes >= self.group_commit_bytes:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.group_commit_window, self._start_flush)
+        await future
+
+    async def close(self):
+        if self.closed:
+            return
+        # no new appends and no new flushes scheduled, the pending records are flushed here
+        self.closed = True
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is not None:
+            await asyncio.wait([self._flush_task])
+        while self.pending_futures:
+            buffers, futures = self._take_pending()
+            await self._flush(buffers, futures)
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close_segment)
+        # the executor is idle, don't block the loop waiting for the thread to exit
+        self._executor.shutdown(wait=False)
+
+    def _take_pending(self):
+        buffers = self.pending_buffers
+        futures = self.pending_futures
+        self.pending_buffers = []
+        self.pending_futures = []
+        self.pending_bytes = 0
+        return buffers, futures
+
+    def _start_flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if self.closed or not self.pending_futures:
+            return
+        if self._flush_task is not None and not self._flush_task.done():
+            # restarted when the current sync completes
+            return
+
+        buffers, futures = self._take_pending()
+        self._flush_task = asyncio.ensure_future(self._flush(buffers, futures))
+
+    async def _flush(self, buffers, futures):
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._write_sync, buffers)
+            for future in futures:
+                if not future.done():
+                    future.set_result(None)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            if not self.closed and self.pending_futures and self._flush_handle is None:
+                asyncio.get_running_loop().call_soon(self._start_flush)
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, '%020d%s' % (self.seqid, WAL_SEGMENT_EXT))
+        self.segment_fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.segment_size = 0
+        self.seqid += 1
+        # make the new segment entry durable
+        dir_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _close_segment(self):
+        if self.segment_fd is not None:
+            os.close(self.segment_fd)
+            self.segment_fd = None
+
+    def _write_sync(self, buffers):
+        # executed in the wal thread
+        start_ns = time_ns()
+        if self.segment_fd is None:
+            self._open_segment()
+
+        length = 0
+        iov_max = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024
+        for i in range(0, len(buffers), iov_max):
+            chunk = buffers[i:i + iov_max]
+            chunk_length = sum(len(buf) for buf in chunk)
+            written = os.writev(self.segment_fd, chunk)
+            if written != chunk_length:
+                # short write, write the remaining part
+                remaining = memoryview(b''.join(chunk))[written:]
+                while remaining:
+                    remaining = remaining[os.write(self.segment_fd, remaining):]
+            length += chunk_length
+
+        if hasattr(os, 'fdatasync'):
+            os.fdatasync(self.segment_fd)
+        else:
+            os.fsync(self.segment_fd)
+
+        self.segment_size += length
+        if self.segment_size >= self.max_segment_size:
+            self._close_segment()
+
+        wal_sync_time.update(time_ns() - start_ns)
+        wal_sync_bytes.add(length)
+        wal_sync_count.inc()
@@ -0,0 +1,170 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import time
+
+from dnaco.telemetry.collector import TELEMETRY_COLLECTOR_REGISTRY
+from dnaco.telemetry.merge import merge_snapshots
+
+from .server import rpc_handle, shutdown_rpc_executors
+
+
+def _reuseport_socket(host, port):
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise NotImplementedError('SO_REUSEPORT is not supported on this platform')
+
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.setblocking(False)
+    return sock
+
+
+async def _worker_loop(worker_id, host, port, client_connected_cb, telemetry_queue, telemetry_interval):
+    # the supervisor stops the worker with SIGTERM
+    stopped = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+
+    sock = _reuseport_socket(host, port)
+    server = await asyncio.start_server(client_connected_cb, sock=sock)
+    parent_pid = os.getppid()
+    async with server:
+        while not stopped.is_set():
+            if os.getppid() != parent_pid:
+                # TODO: use logger
+                print('WORKER', worker_id, 'supervisor is gone, exiting')
+                break
+            try:
+                await asyncio.wait_for(stopped.wait(), telemetry_interval)
+            except asyncio.TimeoutError:
+                telemetry_queue.put((worker_id, os.getpid(), TELEMETRY_COLLECTOR_REGISTRY.snapshot()))
+
+
+def _worker_main(worker_id, host, port, client_connected_cb, telemetry_queue, telemetry_interval):
+    # the supervisor is in charge of the shutdown
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        asyncio.run(_worker_loop(worker_id, host, port, client_connected_cb, telemetry_queue, telemetry_interval))
+    finally:
+        # the pool processes (EXEC_PROCESS_POOL routes) are children of the worker
+        shutdown_rpc_executors(wait=True)
+
+
+class RpcWorkerSupervisor:
+    # Fork num_workers processes, each one listening on the same host:port
+    # with SO_REUSEPORT (the kernel balances the connections between them)
+    # and serving with client_connected_cb (rpc_handle by default).
+    # The supervisor restarts the workers that exit, and collects the
+    # telemetry snapshots that each worker sends every telemetry_interval sec.
+    RESTART_DELAY_SEC = 1.0
+
+    def __init__(self, host, port, num_workers=None, client_connected_cb=rpc_handle, telemetry_interval=10):
+        self.host = host
+        self.port = port
+        self.num_workers = num_workers or os.cpu_count()
+        self.client_connected_cb = client_connected_cb
+        self.telemetry_interval = telemetry_interval
+        self._mp = multiprocessing.get_context('fork')
+        self.telemetry_queue = self._mp.Queue()
+        self.workers = [None] * self.num_workers
+        self.workers_start_time = [0] * self.num_workers
+        self.worker_snapshots = {}
+        self.restarts = 0
+        self.running = False
+
+    def _start_worker(self, worker_id):
+        process = self._mp.Process(
+            target=_worker_main,
+            name='dnaco-rpc-worker-%d' % worker_id,
+            args=(worker_id, self.host, self.port, self.client_connected_cb, self.telemetry_queue, self.telemetry_interval),
+            # not daemonic: the workers can have children (e.g. the EXEC_PROCESS_POOL routes).
+            # stop() terminates them, and they exit on their own if the supervisor is gone.
+            daemon=False
+        )
+        process.start()
+        self.workers[worker_id] = process
+        self.workers_start_time[worker_id] = time.monotonic()
+        return process
+
+    def start(self):
+        self.running = True
+        for worker_id in range(self.num_workers):
+            self._start_worker(worker_id)
+
+    def stop(self, timeout=5):
+        self.running = False
+        self.collect_telemetry()
+        for process in self.workers:
+            if process is not None and process.is_alive():
+                process.terminate()
+        killed = False
+        for process in self.workers:
+            if process is not None:
+                process.join(timeout)
+                if process.is_alive():
+                    process.kill()
+                    killed = True
+        if not killed:
+            # a killed worker may have left a partial snapshot in the queue
+            self.collect_telemetry()
+
+    def check_workers(self):
+        for worker_id, process in enumerate(self.workers):
+            if self.running and process is not None and not process.is_alive():
+                # avoid a fork loop if the worker dies on startup
+                if (time.monotonic() - self.workers_start_time[worker_id]) < self.RESTART_DELAY_SEC:
+                    continue
+                # TODO: use logger
+                print('WORKER', worker_id, 'pid', process.pid, 'exited with', process.exitcode, 'restarting')
+                process.join()
+                self.restarts += 1
+                self._start_worker(worker_id)
+
+    def collect_telemetry(self, timeout=0):
+        try:
+            while True:
+                worker_id, pid, snapshot = self.telemetry_queue.get(timeout=timeout)
+                self.worker_snapshots[worker_id] = snapshot
+                timeout = 0
+        except queue.Empty:
+            pass
+
+    def snapshot(self):
+        # server-wide snapshot: the latest snapshot of each worker merged together
+        return merge_snapshots(list(self.worker_snapshots.values()))
+
+    def run(self, check_interval=0.5):
+        # blocking supervisor loop, until SIGINT/SIGTERM
+        def _stop(signum, frame):
+            self.running = False
+
+        signal.signal(signal.SIGINT, _stop)
+        signal.signal(signal.SIGTERM, _stop)
+        self.start()
+        try:
+            while self.running:
+                self.collect_telemetry(check_interval)
+                self.check_workers()
+        finally:
+            self.stop()
@@ -14,6 +14,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from bisect import bisect_left
+
 from dnaco.util import humans
 
 
@@ -74,6 +76,13 @@ class Histogram:
         75000, 120000,  # min
     ]
 
+    DEFAULT_NS_DURATION_BOUNDS = [
+        10000, 25000, 50000, 75000, 100000, 250000, 500000, 750000,  # usec
+        1000000, 2500000, 5000000, 7500000, 10000000, 25000000, 50000000, 75000000,  # msec
+        100000000, 250000000, 500000000, 750000000,
+        1000000000, 2500000000, 5000000000, 10000000000, 30000000000, 60000000000,  # sec
+    ]
+
     DEFAULT_SIZE_BOUNDS = [
         0, 128, 256, 512,
         1 << 10, 2 << 10, 4 << 10, 8 << 10, 16 << 10, 32 << 10, 64 << 10, 128 << 10, 256 << 10, 512 << 10,  # kb
@@ -91,12 +100,10 @@ class Histogram:
         self.vmax = 0
 
     def add(self, value, num_events=1):
-        index = 0
-        bounds = self.bounds
-        while (index < len(bounds)) and (value > bounds[index]):
-            index += 1
-        self.events[index] += num_events
-        self.vmax = max(self.vmax, value)
+        # index of the first bound >= value, or the overflow bucket
+        self.events[bisect_left(self.bounds, value)] += num_events
+        if value > self.vmax:
+            self.vmax = value
 
     def snapshot(self):
         return {
@@ -0,0 +1,49 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .histogram import Histogram
+
+
+class HistogramMap:
+    # one Histogram per key (e.g. per rpc route), all with the same bounds
+    COLLECTOR_TYPE = 'HISTOGRAM_MAP'
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.data = {}
+
+    def clear(self):
+        self.data = {}
+
+    def add(self, key, value, num_events=1):
+        histo = self.data.get(key)
+        if histo is None:
+            histo = Histogram(self.bounds)
+            self.data[key] = histo
+        histo.add(value, num_events)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def snapshot(self):
+        return {key: histo.snapshot() for key, histo in self.data.items()}
+
+    def human_report(self, human_converter):
+        buf = []
+        for key, histo in sorted(self.data.items()):
+            buf.append(' - %s' % key)
+            buf.append(histo.human_report(human_converter))
+        return '\n'.join(buf)
@@ -0,0 +1,147 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Merge the TELEMETRY_COLLECTOR_REGISTRY snapshots of different processes
+# (e.g. the rpc server workers) into a single snapshot with the same format.
+
+
+def _merge_time_range_counter(datas):
+    # counters[-1] is the slot starting at last_interval, counters[-(i + 1)] at last_interval - (i * window)
+    window = datas[0]['window']
+    slots = {}
+    for data in datas:
+        for i, value in enumerate(reversed(data['counters'])):
+            ts = data['last_interval'] - (i * window)
+            slots[ts] = slots.get(ts, 0) + value
+
+    last_interval = max(data['last_interval'] for data in datas)
+    nslots = min(max(len(data['counters']) for data in datas), 1 + ((last_interval - min(slots)) // window))
+    return {
+        'window': window,
+        'last_interval': last_interval,
+        'counters': [slots.get(last_interval - (i * window), 0) for i in reversed(range(nslots))]
+    }
+
+
+def _merge_max_and_avg_time_range_gauge(datas):
+    # the processes don't export the number of samples,
+    # so the avg of a slot is the mean of the non-zero process averages.
+    window = datas[0]['window']
+    slots_max = {}
+    slots_avg = {}
+    for data in datas:
+        events = data['events']
+        for i, (vavg, vmax) in enumerate(zip(reversed(events['avg']), reversed(events['max']))):
+            ts = data['last_interval'] - (i * window)
+            slots_max[ts] = max(slots_max.get(ts, 0), vmax)
+            if vavg > 0:
+                slots_avg.setdefault(ts, []).append(vavg)
+
+    last_interval = max(data['last_interval'] for data in datas)
+    nslots = min(max(len(data['events']['avg']) for data in datas), 1 + ((last_interval - min(slots_max)) // window))
+    timestamps = [last_interval - (i * window) for i in reversed(range(nslots))]
+    return {
+        'events': {
+            'avg': [(sum(slots_avg[ts]) // len(slots_avg[ts])) if ts in slots_avg else 0 for ts in timestamps],
+            'max': [slots_max.get(ts, 0) for ts in timestamps]
+        },
+        'slots': max(data['slots'] for data in datas),
+        'window': window,
+        'last_interval': last_interval
+    }
+
+
+def _merge_histogram(datas):
+    events = [0] * len(datas[0]['events'])
+    for data in datas:
+        for i, value in enumerate(data['events']):
+            events[i] += value
+    return {
+        'bounds': datas[0]['bounds'][:],
+        'events': events,
+        'nevents': sum(events),
+        'max_value': max(data['max_value'] for data in datas)
+    }
+
+
+def _merge_histogram_map(datas):
+    histograms = {}
+    for data in datas:
+        for key, value in data.items():
+            histograms.setdefault(key, []).append(value)
+    return {key: _merge_histogram(values) for key, values in histograms.items()}
+
+
+def _merge_counter_map(datas):
+    merged = {}
+    for data in datas:
+        for key, value in data.items():
+            merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def _merge_top_k(datas):
+    merged = {}
+    for data in datas:
+        for entry in data:
+            current = merged.get(entry['key'])
+            if current is None:
+                merged[entry['key']] = dict(entry, trace_ids=list(entry['trace_ids']))
+                continue
+
+            freq = current['freq'] + entry['freq']
+            current['avg'] = ((current['avg'] * current['freq']) + (entry['avg'] * entry['freq'])) // freq
+            current['freq'] = freq
+            current['min'] = min(current['min'], entry['min'])
+            if entry['max'] >= current['max']:
+                current['max'] = entry['max']
+                current['max_ts'] = entry['max_ts']
+                current['trace_ids'] = (current['trace_ids'] + list(entry['trace_ids']))[-5:]
+
+    k = max(len(data) for data in datas)
+    return sorted(merged.values(), key=lambda e: e['max'], reverse=True)[:k]
+
+
+_MERGE_FUNCS = {
+    'TIME_RANGE_COUNTER': _merge_time_range_counter,
+    'MAX_AND_AVG_TIME_RANGE_GAUGE': _merge_max_and_avg_time_range_gauge,
+    'HISTOGRAM': _merge_histogram,
+    'HISTOGRAM_MAP': _merge_histogram_map,
+    'COUNTER_MAP': _merge_counter_map,
+    'GAUGE_MAP': _merge_counter_map,
+    'TOP_K': _merge_top_k,
+}
+
+
+def merge_collector_data(collector_type, datas):
+    merge_func = _MERGE_FUNCS.get(collector_type)
+    if merge_func is None:
+        # unknown collector, keep the data of the first process
+        return datas[0]
+    return merge_func(datas)
+
+
+def merge_snapshots(snapshots):
+    # snapshots: list of TELEMETRY_COLLECTOR_REGISTRY.snapshot()
+    collectors = {}
+    for snapshot in snapshots:
+        for name, collector_info in snapshot.items():
+            collectors.setdefault(name, []).append(collector_info)
+
+    merged = {}
+    for name, infos in collectors.items():
+        merged[name] = dict(infos[0], data=merge_collector_data(infos[0]['type'], [info['data'] for info in infos]))
+    return merged
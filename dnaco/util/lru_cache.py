@@ -0,0 +1,91 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+from time import time_ns
+
+
+def buffer_size(value):
+    return value.nbytes if isinstance(value, memoryview) else len(value)
+
+
+class SizedLruCache:
+    # LRU cache bounded by the total size of the values (as computed by size_func),
+    # each entry has its own expiration time. values are stored as they are, no copies.
+    def __init__(self, max_size, default_ttl_ns=None, size_func=buffer_size):
+        self.max_size = max_size
+        self.default_ttl_ns = default_ttl_ns
+        self.size_func = size_func
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def get(self, key, now=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        value, size, expire_ns = entry
+        if expire_ns is not None and (now or time_ns()) >= expire_ns:
+            self._remove(key)
+            return None
+
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value, ttl_ns=None, now=None):
+        # returns the number of entries evicted to make room for the new one
+        size = self.size_func(value)
+        self.remove(key)
+        if size > self.max_size:
+            return 0
+
+        ttl_ns = ttl_ns if ttl_ns is not None else self.default_ttl_ns
+        expire_ns = ((now or time_ns()) + ttl_ns) if ttl_ns is not None else None
+        evicted = 0
+        while self.entries and (self.size + size) > self.max_size:
+            self._remove(next(iter(self.entries)))
+            evicted += 1
+
+        self.entries[key] = (value, size, expire_ns)
+        self.size += size
+        return evicted
+
+    def remove(self, key):
+        if key in self.entries:
+            self._remove(key)
+            return True
+        return False
+
+    def remove_expired(self, now=None):
+        now = now or time_ns()
+        expired = [key for key, (_, _, expire_ns) in self.entries.items() if expire_ns is not None and now >= expire_ns]
+        for key in expired:
+            self._remove(key)
+        return len(expired)
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
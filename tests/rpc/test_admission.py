@@ -0,0 +1,62 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+
+from dnaco.rpc.admission import RpcAdmissionController
+from dnaco.util import humans
+
+MS = humans.UNIT_MS
+
+
+class TestRpcAdmission(TestCase):
+    def test_concurrency_limit(self):
+        admission = RpcAdmissionController(initial_limit=2)
+        self.assertTrue(admission.admit('/foo', 0, 1))
+        self.assertTrue(admission.admit('/foo', 0, 1))
+        self.assertFalse(admission.admit('/foo', 0, 1))
+        # limits are per route
+        self.assertTrue(admission.admit('/bar', 0, 1))
+
+        admission.release('/foo', 0)
+        self.assertGreater(admission.routes['/foo'].limit, 2)
+        self.assertTrue(admission.admit('/foo', 0, 1))
+
+    def test_limit_backoff(self):
+        admission = RpcAdmissionController(initial_limit=10, backoff_ratio=0.5, interval_ns=100 * MS)
+        for _ in range(4):
+            self.assertTrue(admission.admit('/foo', 0, 1))
+        # a burst of slow completions within the same interval backs off once
+        for i in range(3):
+            admission.release('/foo', 100 * MS, 1000 * MS + i)
+        self.assertEqual(admission.routes['/foo'].limit, 5)
+        # the next interval backs off again
+        admission.release('/foo', 100 * MS, 1100 * MS)
+        self.assertEqual(admission.routes['/foo'].limit, 2.5)
+        self.assertTrue(admission.admit('/foo', 0, 1))
+        self.assertTrue(admission.admit('/foo', 0, 1))
+        self.assertFalse(admission.admit('/foo', 0, 1))
+
+    def test_codel_standing_queue(self):
+        admission = RpcAdmissionController(target_queue_ns=5 * MS, interval_ns=100 * MS, initial_limit=100)
+        # above target, but not for a full interval yet
+        self.assertTrue(admission.admit('/foo', 10 * MS, 1000 * MS))
+        self.assertTrue(admission.admit('/foo', 10 * MS, 1050 * MS))
+        # standing queue: shed until the queue delay goes below target
+        self.assertFalse(admission.admit('/foo', 10 * MS, 1100 * MS))
+        self.assertFalse(admission.admit('/foo', 20 * MS, 1150 * MS))
+        self.assertTrue(admission.admit('/foo', 1 * MS, 1200 * MS))
+        self.assertTrue(admission.admit('/foo', 10 * MS, 1250 * MS))
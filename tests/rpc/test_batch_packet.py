@@ -0,0 +1,85 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from time import time_ns
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from dnaco.rpc.client import RpcClient
+from dnaco.rpc.frame import FrameReader
+from dnaco.rpc.packet import RpcControl, RpcPacketBuilder, RpcRequest, RpcResponse, parse_rpc_batch, parse_rpc_packet
+from dnaco.rpc.server import packet_handle, rpc_handle, rpc_handler
+
+
+@rpc_handler('/test/batch/upper')
+def _upper_handler(packet):
+    return bytes(packet.body).upper()
+
+
+@rpc_handler('/test/batch/sleep')
+async def _sleep_handler(packet):
+    await asyncio.sleep(int(packet.own_body()) / 1000)
+    return packet.body
+
+
+class TestRpcBatchPacket(TestCase):
+    def test_build_parse(self):
+        builder = RpcPacketBuilder(1)
+        packets = [builder.new_request(1, RpcRequest.OP_TYPE_READ, b'/test/batch/upper', b'%d' % i) for i in range(3)]
+        batch = parse_rpc_packet(FrameReader(builder.new_batch(1, packets, stream_responses=True)))
+        self.assertIsInstance(batch, RpcControl)
+        self.assertEqual(batch.control_type, RpcControl.CONTROL_BATCH)
+        self.assertEqual(batch.value, RpcControl.BATCH_STREAM_RESPONSES)
+        self.assertEqual(batch.pkg_id, 4)
+        requests = [parse_rpc_packet(FrameReader(data)) for data in parse_rpc_batch(batch.body)]
+        self.assertEqual([req.pkg_id for req in requests], [1, 2, 3])
+        self.assertEqual([req.body for req in requests], [b'0', b'1', b'2'])
+
+
+class TestRpcBatchExec(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await asyncio.start_server(rpc_handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_packet_handle(self):
+        builder = RpcPacketBuilder(1)
+        packets = [builder.new_request(1, RpcRequest.OP_TYPE_READ, b'/test/batch/upper', b'req-%d' % i) for i in range(4)]
+        _, _, resp = await packet_handle(1, False, time_ns(), builder.new_batch(1, packets))
+        batch = parse_rpc_packet(FrameReader(resp))
+        self.assertEqual(batch.control_type, RpcControl.CONTROL_BATCH)
+        responses = [parse_rpc_packet(FrameReader(data)) for data in parse_rpc_batch(batch.body)]
+        self.assertEqual([resp.pkg_id for resp in responses], [1, 2, 3, 4])
+        self.assertEqual([resp.body for resp in responses], [b'REQ-%d' % i for i in range(4)])
+
+    async def test_single_batch_response(self):
+        async with RpcClient() as client:
+            requests = [('/test/batch/upper', b'key-%d' % i) for i in range(100)]
+            responses = await client.call_batch('127.0.0.1', self.port, requests, timeout=1)
+            self.assertEqual([resp.body for resp in responses], [b'KEY-%d' % i for i in range(100)])
+            self.assertTrue(all(resp.op_status == RpcResponse.OP_STATUS_SUCCEEDED for resp in responses))
+
+    async def test_streamed_responses(self):
+        # the requests are executed concurrently, the fast responses do not wait the slow ones
+        async with RpcClient() as client:
+            requests = [('/test/batch/sleep', b'%d' % msec) for msec in (200, 100, 1)]
+            start = time_ns()
+            responses = await client.call_batch('127.0.0.1', self.port, requests, stream_responses=True, timeout=1)
+            self.assertLess(time_ns() - start, 290 * 1000000)
+            self.assertEqual([resp.body for resp in responses], [b'200', b'100', b'1'])
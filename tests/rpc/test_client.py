@@ -0,0 +1,71 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from dnaco.rpc.client import RpcClient
+from dnaco.rpc.frame import FrameReader
+from dnaco.rpc.packet import RpcPacketBuilder, RpcResponse, parse_rpc_packet
+from dnaco.rpc.server import frame_handle
+
+
+async def _sleep_handler(rev, write_to_wal, req_recv_ns, data):
+    # the request body is the number of msec to wait before replying
+    packet = parse_rpc_packet(FrameReader(data))
+    await asyncio.sleep(int(packet.own_body()) / 1000)
+    resp = RpcPacketBuilder(rev).new_response(packet.trace_id, packet.pkg_id, RpcResponse.OP_STATUS_SUCCEEDED, 0, 0, packet.body)
+    return rev, False, resp
+
+
+class TestRpcClient(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await asyncio.start_server(lambda r, w: frame_handle(r, w, _sleep_handler, 16), '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_multiplexed_calls(self):
+        async with RpcClient(pool_size=1) as client:
+            bodies = [b'%d' % (50 - i * 10) for i in range(5)]
+            responses = await asyncio.gather(*[client.call('127.0.0.1', self.port, '/sleep', body) for body in bodies])
+            self.assertEqual([resp.body for resp in responses], bodies)
+            self.assertEqual(len(client.pools[('127.0.0.1', self.port)]), 1)
+
+    async def test_pool_size(self):
+        async with RpcClient(pool_size=3) as client:
+            await asyncio.gather(*[client.call('127.0.0.1', self.port, '/sleep', b'20') for _ in range(8)])
+            self.assertEqual(len(client.pools[('127.0.0.1', self.port)]), 3)
+
+    async def test_timeout(self):
+        async with RpcClient(pool_size=1) as client:
+            with self.assertRaises(asyncio.TimeoutError):
+                await client.call('127.0.0.1', self.port, '/sleep', b'500', timeout=0.05)
+            resp = await client.call('127.0.0.1', self.port, '/sleep', b'1', timeout=1)
+            self.assertEqual(resp.body, b'1')
+            self.assertEqual(client.pools[('127.0.0.1', self.port)][0].inflight(), 0)
+
+    async def test_trace_ids(self):
+        # each client starts from a random base, the ids of its calls keep increasing
+        async with RpcClient(pool_size=1) as client, RpcClient(pool_size=1) as other:
+            responses = [await client.call('127.0.0.1', self.port, '/sleep', b'1') for _ in range(3)]
+            other_resp = await other.call('127.0.0.1', self.port, '/sleep', b'1')
+        trace_ids = [resp.trace_id for resp in responses]
+        self.assertEqual(trace_ids, list(range(trace_ids[0], trace_ids[0] + 3)))
+        self.assertNotIn(other_resp.trace_id, trace_ids)
+        self.assertGreater(trace_ids[0], 1 << 16)
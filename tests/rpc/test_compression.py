@@ -0,0 +1,82 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+from unittest import IsolatedAsyncioTestCase
+
+from dnaco.rpc.client import RpcClient
+from dnaco.rpc.compression import CODEC_LZMA, CODEC_NONE, CODEC_ZLIB, decode_frame_data, encode_frame_data, \
+    rpc_tx_compressed_bytes
+from dnaco.rpc.server import rpc_handle, rpc_handler
+
+
+@rpc_handler('/test/compression/echo')
+def _echo_handler(packet):
+    return bytes(packet.body) * 2
+
+
+class TestCompression(IsolatedAsyncioTestCase):
+    async def test_encode_decode(self):
+        data = b'abcd' * 1000
+        for codec in (CODEC_ZLIB, CODEC_LZMA):
+            frame = await encode_frame_data(data, codec, 1 << CODEC_ZLIB)
+            self.assertLess(len(frame), len(data))
+            self.assertEqual(await decode_frame_data(frame), (1 << CODEC_ZLIB, codec, data))
+
+        # below threshold, or not compressible
+        random_data = os.urandom(4096)
+        for data in (b'abcd', random_data):
+            frame = await encode_frame_data(data, CODEC_ZLIB, 0)
+            self.assertEqual(frame, b'\x00' + data)
+            self.assertEqual(await decode_frame_data(frame), (0, CODEC_NONE, data))
+
+        # offloaded to the executor
+        data = b'x' * (1 << 20)
+        frame = await encode_frame_data(data, CODEC_ZLIB)
+        _, _, decoded = await decode_frame_data(frame)
+        self.assertEqual(decoded, data)
+
+    async def test_decompression_limit(self):
+        data = b'x' * (1 << 20)
+        for codec in (CODEC_ZLIB, CODEC_LZMA):
+            frame = await encode_frame_data(data, codec)
+            self.assertLess(len(frame), 64 << 10)
+            _, _, decoded = await decode_frame_data(frame, len(data))
+            self.assertEqual(decoded, data)
+            with self.assertRaises(ValueError):
+                await decode_frame_data(frame, len(data) - 1)
+            with self.assertRaises(ValueError):
+                await decode_frame_data(frame[:len(frame) // 2])
+
+    async def test_client_server(self):
+        server = await asyncio.start_server(rpc_handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            for codec in (None, CODEC_NONE, CODEC_ZLIB, CODEC_LZMA):
+                async with RpcClient(codec=codec) as client:
+                    for body in (b'small', b'large-body' * 1000):
+                        tx_compressed = sum(rpc_tx_compressed_bytes.counters)
+                        resp = await client.call('127.0.0.1', port, '/test/compression/echo', body)
+                        self.assertEqual(resp.body, body * 2)
+                        self.assertEqual(resp.rev, 1)
+                        if codec is None:
+                            self.assertEqual(sum(rpc_tx_compressed_bytes.counters), tx_compressed)
+                        else:
+                            self.assertGreater(sum(rpc_tx_compressed_bytes.counters), tx_compressed)
+        finally:
+            server.close()
+            await server.wait_closed()
@@ -0,0 +1,149 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from time import time_ns
+from unittest import IsolatedAsyncioTestCase
+
+from dnaco.rpc.client import RpcClient, RpcConnection
+from dnaco.rpc.frame import FrameReader, build_frame_header
+from dnaco.rpc.packet import RpcControl, RpcPacketBuilder, RpcRequest, RpcResponse, parse_rpc_packet
+from dnaco.rpc.server import RPC_CANCELLED_BODY, RPC_DEADLINE_EXCEEDED_BODY, packet_handle, read_frame, rpc_handle, \
+    rpc_handler
+from dnaco.util.humans import UNIT_MS
+
+_deadline_calls = []
+_cancelled_calls = []
+
+
+@rpc_handler('/test/deadline/sleep')
+async def _sleep_handler(packet):
+    _deadline_calls.append(bytes(packet.body))
+    try:
+        await asyncio.sleep(int(packet.own_body()) / 1000)
+    except asyncio.CancelledError:
+        _cancelled_calls.append(bytes(packet.body))
+        raise
+    return packet.body
+
+
+async def call_with_deadline(body, budget_ns, req_recv_ns=None):
+    builder = RpcPacketBuilder(1)
+    trace_id = builder.next_trace_id()
+    req = builder.new_request(trace_id, RpcRequest.OP_TYPE_READ, b'/test/deadline/sleep', body)
+    req = builder.new_control(trace_id, builder.packet_id, RpcControl.CONTROL_DEADLINE, budget_ns, req)
+    req_recv_ns = req_recv_ns if req_recv_ns is not None else time_ns()
+    _, _, resp = await packet_handle(1, False, req_recv_ns, req)
+    return parse_rpc_packet(FrameReader(resp))
+
+
+class TestRpcDeadline(IsolatedAsyncioTestCase):
+    async def test_within_deadline(self):
+        resp = await call_with_deadline(b'1', 1000 * UNIT_MS)
+        self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_SUCCEEDED)
+        self.assertEqual(resp.body, b'1')
+
+    async def test_expired_at_dequeue(self):
+        # the request waited in the queue longer than its budget, the handler is not called
+        _deadline_calls.clear()
+        resp = await call_with_deadline(b'2', 10 * UNIT_MS, time_ns() - 20 * UNIT_MS)
+        self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_CANCELLED)
+        self.assertEqual(resp.body, RPC_DEADLINE_EXCEEDED_BODY)
+        self.assertEqual(_deadline_calls, [])
+
+    async def test_expired_while_running(self):
+        _cancelled_calls.clear()
+        resp = await call_with_deadline(b'1000', 50 * UNIT_MS)
+        self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_CANCELLED)
+        self.assertEqual(resp.body, RPC_DEADLINE_EXCEEDED_BODY)
+        self.assertEqual(_cancelled_calls, [b'1000'])
+
+
+class TestRpcCancel(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await asyncio.start_server(rpc_handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_cancel_control(self):
+        _cancelled_calls.clear()
+        conn = await RpcConnection.open('127.0.0.1', self.port, 1)
+        try:
+            call = asyncio.ensure_future(conn.call(1, RpcRequest.OP_TYPE_READ, b'/test/deadline/sleep', b'5000'))
+            await asyncio.sleep(0.05)
+            conn.cancel(1, conn.pkg_builder.packet_id)
+            resp = await asyncio.wait_for(call, 1)
+            self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_CANCELLED)
+            self.assertEqual(resp.body, RPC_CANCELLED_BODY)
+            self.assertEqual(_cancelled_calls, [b'5000'])
+        finally:
+            await conn.close()
+
+    async def test_client_timeout(self):
+        _cancelled_calls.clear()
+        async with RpcClient(propagate_deadline=True) as client:
+            with self.assertRaises(asyncio.TimeoutError):
+                await client.call('127.0.0.1', self.port, '/test/deadline/sleep', b'5001', timeout=0.05)
+            # the server gave up on the request too
+            for _ in range(100):
+                if _cancelled_calls:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(_cancelled_calls, [b'5001'])
+            resp = await client.call('127.0.0.1', self.port, '/test/deadline/sleep', b'1', timeout=1)
+            self.assertEqual(resp.body, b'1')
+
+    async def test_controls_on_saturated_connection(self):
+        # a single in-flight slot, held by a long request
+        server = await asyncio.start_server(lambda r, w: rpc_handle(r, w, 1), '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            builder = RpcPacketBuilder(1)
+
+            def _send(data):
+                writer.write(build_frame_header(1, False, len(data)))
+                writer.write(data)
+
+            _send(builder.new_request(1, RpcRequest.OP_TYPE_READ, b'/test/deadline/sleep', b'5002'))
+            long_pkg_id = builder.packet_id
+
+            # the deadline expires while waiting for the slot
+            start_ns = time_ns()
+            req = builder.new_request(2, RpcRequest.OP_TYPE_READ, b'/test/deadline/sleep', b'1')
+            _send(builder.new_control(2, builder.packet_id, RpcControl.CONTROL_DEADLINE, 50 * UNIT_MS, req))
+            await writer.drain()
+            _, _, _, data = await asyncio.wait_for(read_frame(reader), 1)
+            resp = parse_rpc_packet(FrameReader(data))
+            self.assertEqual(resp.trace_id, 2)
+            self.assertEqual(resp.body, RPC_DEADLINE_EXCEEDED_BODY)
+            self.assertLess(time_ns() - start_ns, 1000 * UNIT_MS)
+
+            # the cancel reaches the request holding the slot
+            _send(builder.new_control(1, long_pkg_id, RpcControl.CONTROL_CANCEL, 0))
+            await writer.drain()
+            _, _, _, data = await asyncio.wait_for(read_frame(reader), 1)
+            resp = parse_rpc_packet(FrameReader(data))
+            self.assertEqual(resp.pkg_id, long_pkg_id)
+            self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_CANCELLED)
+            self.assertEqual(resp.body, RPC_CANCELLED_BODY)
+        finally:
+            writer.close()
+            server.close()
+            await server.wait_closed()
@@ -0,0 +1,117 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from dnaco.rpc.client import RpcClient
+from dnaco.rpc.forward import build_forward_targets, parse_forward_target, split_forward_result_id
+from dnaco.rpc.packet import RpcRequest, RpcResponse
+from dnaco.rpc.server import RPC_RESULT_FETCH_ID, rpc_handle, rpc_handler
+
+_stage_trace_ids = []
+
+
+@rpc_handler('/t/fwd')
+def _stage_handler(packet):
+    _stage_trace_ids.append(packet.trace_id)
+    return bytes(packet.body) + b'+'
+
+
+@rpc_handler('/t/fs')
+async def _slow_stage_handler(packet):
+    _stage_trace_ids.append(packet.trace_id)
+    await asyncio.sleep(0.5)
+    return bytes(packet.body) + b'+'
+
+
+class TestForwardTarget(TestCase):
+    def test_build_parse(self):
+        result_id = build_forward_targets([('127.0.0.1', 57025, '/foo'), ('::1', 123, '/bar')])
+        self.assertEqual(result_id, b'127.0.0.1:57025/foo,[::1]:123/bar')
+        self.assertEqual(parse_forward_target(result_id), ('127.0.0.1', 57025, b'/foo', b'[::1]:123/bar'))
+        self.assertEqual(parse_forward_target(b'[::1]:123/bar'), ('::1', 123, b'/bar', None))
+
+        with self.assertRaises(ValueError):
+            parse_forward_target(b'127.0.0.1/foo')
+
+        self.assertEqual(split_forward_result_id(result_id), (result_id, None))
+        self.assertEqual(split_forward_result_id(b'[::1]:123/bar#0123456789abcdef'), (b'[::1]:123/bar', b'0123456789abcdef'))
+
+    def test_build_too_long(self):
+        with self.assertRaises(ValueError):
+            build_forward_targets([('127.0.0.1', 57025, '/stage-%d' % i) for i in range(4)])
+
+
+class TestForward(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.servers = [await asyncio.start_server(rpc_handle, '127.0.0.1', 0) for _ in range(3)]
+        self.ports = [server.sockets[0].getsockname()[1] for server in self.servers]
+        _stage_trace_ids.clear()
+
+    async def asyncTearDown(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+
+    async def _fetch_result(self, client, port, result_id):
+        # the last stage stores the result
+        for _ in range(100):
+            resp = await client.call('127.0.0.1', port, RPC_RESULT_FETCH_ID, result_id)
+            if resp.op_status == RpcResponse.OP_STATUS_SUCCEEDED:
+                break
+            await asyncio.sleep(0.05)
+        return resp
+
+    async def test_forward_chain(self):
+        result_id = build_forward_targets([('127.0.0.1', port, '/t/fs') for port in self.ports[1:]])
+        async with RpcClient() as client:
+            # the first stage replies without waiting for the slow stages
+            start = asyncio.get_running_loop().time()
+            resp = await client.call('127.0.0.1', self.ports[0], '/t/fwd', b'x', trace_id=1234,
+                                     send_result_to=RpcRequest.FORWARD_RESULT_TO, result_id=result_id)
+            loop_time = asyncio.get_running_loop().time()
+            self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_SUCCEEDED)
+            self.assertLess(loop_time - start, 0.5)
+
+            resp = await self._fetch_result(client, self.ports[2], bytes(resp.body))
+        self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_SUCCEEDED)
+        self.assertEqual(bytes(resp.body), b'x+++')
+        self.assertEqual(_stage_trace_ids, [1234, 1234, 1234])
+
+    async def test_concurrent_chains(self):
+        # two callers with the same trace id, each one gets its own result
+        result_id = build_forward_targets([('127.0.0.1', port, '/t/fwd') for port in self.ports[1:]])
+
+        async def _chain(body):
+            async with RpcClient() as client:
+                resp = await client.call('127.0.0.1', self.ports[0], '/t/fwd', body, trace_id=1,
+                                         send_result_to=RpcRequest.FORWARD_RESULT_TO, result_id=result_id)
+                self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_SUCCEEDED)
+                forward_id = bytes(resp.body)
+                return forward_id, await self._fetch_result(client, self.ports[2], forward_id)
+
+        (id_a, resp_a), (id_b, resp_b) = await asyncio.gather(_chain(b'a'), _chain(b'b'))
+        self.assertNotEqual(id_a, id_b)
+        self.assertEqual(bytes(resp_a.body), b'a+++')
+        self.assertEqual(bytes(resp_b.body), b'b+++')
+
+    async def test_targets_too_long(self):
+        result_id = b'127.0.0.1:%d/t/fwd,' % self.ports[1] + b'x' * 40
+        async with RpcClient() as client:
+            resp = await client.call('127.0.0.1', self.ports[0], '/t/fwd', b'x',
+                                     send_result_to=RpcRequest.FORWARD_RESULT_TO, result_id=result_id)
+        self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_FAILED)
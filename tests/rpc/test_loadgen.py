@@ -0,0 +1,82 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from time import perf_counter_ns
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from dnaco.rpc.client import RpcClient
+from dnaco.rpc.loadgen import LoadGenerator, parse_size_mix
+from dnaco.rpc.server import rpc_handle, rpc_handler
+from dnaco.util import humans
+
+
+@rpc_handler('/test/loadgen/echo')
+def _echo_handler(packet):
+    return packet.body
+
+
+@rpc_handler('/test/loadgen/sleep')
+async def _sleep_handler(packet):
+    await asyncio.sleep(0.05)
+    return b''
+
+
+class TestSizeMix(TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_size_mix('100'), ([100], [1.0]))
+        self.assertEqual(parse_size_mix('100:9,65536:1'), ([100, 65536], [9.0, 1.0]))
+
+
+class TestLoadGenerator(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await asyncio.start_server(rpc_handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_closed_loop(self):
+        async with RpcClient(pool_size=2, timeout=5) as client:
+            loadgen = LoadGenerator(client, '127.0.0.1', self.port, '/test/loadgen/echo', [10, 1000], [1, 1], seed=1)
+            stats = await loadgen.run_closed_loop(8, requests=200)
+        self.assertEqual(stats.succeeded, 200)
+        self.assertEqual(stats.errors, 0)
+        self.assertEqual(stats.req_bytes, stats.resp_bytes)
+        self.assertEqual(sum(stats.latency.events), 200)
+        self.assertEqual(sum(stats.exec_time.events), 200)
+        self.assertIn('Client Latency', stats.human_report())
+
+    async def test_open_loop_rate(self):
+        # 100 req/sec for 20 requests: the run lasts ~200ms, regardless of the concurrency
+        async with RpcClient(pool_size=2, timeout=5) as client:
+            loadgen = LoadGenerator(client, '127.0.0.1', self.port, '/test/loadgen/sleep')
+            start_ns = perf_counter_ns()
+            stats = await loadgen.run_open_loop(100, requests=20)
+            elapsed_ns = perf_counter_ns() - start_ns
+        self.assertEqual(stats.succeeded, 20)
+        self.assertGreaterEqual(elapsed_ns, 190 * humans.UNIT_MS)
+        self.assertGreaterEqual(stats.latency.vmax, 50 * humans.UNIT_MS)
+
+    async def test_open_loop_no_coordinated_omission(self):
+        # with a single request in flight, the requests queue up on the client:
+        # the latency includes the time spent waiting to be sent.
+        async with RpcClient(pool_size=1, timeout=5) as client:
+            loadgen = LoadGenerator(client, '127.0.0.1', self.port, '/test/loadgen/sleep')
+            stats = await loadgen.run_open_loop(1000, requests=5, max_inflight=1)
+        self.assertEqual(stats.succeeded, 5)
+        self.assertGreaterEqual(stats.latency.vmax, 200 * humans.UNIT_MS)
@@ -47,3 +47,16 @@ class TestRpcMeta(TestCase):
         self.assertEqual(meta_map['arrai'], [1, 2, 3])
         self.assertEqual(meta_map['obje'], {'a': 10, 'b': 'bbb'})
 
+    def test_parse_memoryview(self):
+        meta = Meta()
+        meta.add_bytes('bitez', b'\xABCD')
+        meta.add_int('inte', 123)
+        meta.add_object('obje', {'a': 10})
+        data = meta.get_data()
+
+        meta_map = Meta.parse(memoryview(data))
+        self.assertIsInstance(meta_map['bitez'], memoryview)
+        self.assertIs(meta_map['bitez'].obj, data)
+        self.assertEqual(meta_map['bitez'], b'\xABCD')
+        self.assertEqual(meta_map['inte'], 123)
+        self.assertEqual(meta_map['obje'], {'a': 10})
@@ -17,7 +17,8 @@
 from unittest import TestCase
 
 from dnaco.rpc.frame import FrameReader, parse_frame_header
-from dnaco.rpc.packet import RpcPacketBuilder, RpcRequest, RpcResponse, parse_rpc_packet
+from dnaco.rpc.packet import RpcPacketBuilder, RpcRequest, RpcResponse, build_rpc_head, build_rpc_request_head, \
+    build_rpc_response_head, encode_rpc_request, encode_rpc_response, parse_rpc_packet
 
 
 class TestRpcPacket(TestCase):
@@ -44,3 +45,76 @@ class TestRpcPacket(TestCase):
         self.assertEqual(resp_packet.queue_time, 123)
         self.assertEqual(resp_packet.exec_time, 456)
         self.assertEqual(resp_packet.body, b'resp-body')
+
+    def test_zero_copy_body(self):
+        pkg_builder = RpcPacketBuilder(1)
+        body = b'x' * (1 << 20)
+        frame = pkg_builder.new_request(1, RpcRequest.OP_TYPE_WRITE, b'/foo', body)
+
+        req_packet = parse_rpc_packet(FrameReader(frame))
+        self.assertIsInstance(req_packet.request_id, bytes)
+        self.assertIsInstance(req_packet.body, memoryview)
+        self.assertIs(req_packet.body.obj, frame)
+        self.assertEqual(req_packet.body, body)
+
+        owned_body = req_packet.own_body()
+        self.assertIsInstance(owned_body, bytes)
+        self.assertIs(req_packet.body, owned_body)
+        self.assertEqual(owned_body, body)
+
+    def test_single_buffer_encoding(self):
+        # ids and times of every int width
+        for trace_id, pkg_id, queue_time, exec_time in ((1, 2, 0, 0), (300, 1 << 20, 1 << 40, (1 << 56) + 3),
+                                                        ((1 << 63) + 1, 255, 65535, 1 << 17)):
+            req = encode_rpc_request(None, False, False, trace_id, pkg_id, RpcRequest.OP_TYPE_RW, b'/foo', b'body', 1, b'res')
+            req = parse_rpc_packet(FrameReader(req))
+            self.assertEqual((req.trace_id, req.pkg_id, req.op_type, req.request_id, req.send_result_to, bytes(req.result_id), bytes(req.body)),
+                             (trace_id, pkg_id, RpcRequest.OP_TYPE_RW, b'/foo', 1, b'res', b'body'))
+            resp = encode_rpc_response(None, False, False, trace_id, pkg_id, RpcResponse.OP_STATUS_FAILED, queue_time, exec_time, b'body')
+            resp = parse_rpc_packet(FrameReader(resp))
+            self.assertEqual((resp.trace_id, resp.pkg_id, resp.op_status, resp.queue_time, resp.exec_time, bytes(resp.body)),
+                             (trace_id, pkg_id, RpcResponse.OP_STATUS_FAILED, queue_time, exec_time, b'body'))
+
+        # | rpc head | trace id | pkg id | req head (u16) | request id | result id | body |
+        self.assertEqual(encode_rpc_request(None, False, False, 300, 2, RpcRequest.OP_TYPE_RW, b'/foo', b'body', 1, b'res'),
+                         b'\x08\x2c\x01\x02\x90\xc3/foores' + b'body')
+        # | rpc head | trace id | pkg id | resp head | queue time | exec time | body |
+        self.assertEqual(encode_rpc_response(None, False, False, 1, 2, RpcResponse.OP_STATUS_FAILED, 0, 300, b'body'),
+                         b'\x40\x01\x02\x41\x00\x2c\x01' + b'body')
+
+        # the head builders produce the same bytes
+        self.assertEqual(build_rpc_head(0, 300, 2) + build_rpc_request_head(RpcRequest.OP_TYPE_RW, b'/foo', 1, b'res') + b'body',
+                         encode_rpc_request(None, False, False, 300, 2, RpcRequest.OP_TYPE_RW, b'/foo', b'body', 1, b'res'))
+        self.assertEqual(build_rpc_head(1, 1, 2) + build_rpc_response_head(RpcResponse.OP_STATUS_FAILED, 0, 300) + b'body',
+                         encode_rpc_response(None, False, False, 1, 2, RpcResponse.OP_STATUS_FAILED, 0, 300, b'body'))
+
+        pkg_builder = RpcPacketBuilder(2)
+        body = b'x' * 1000
+        frame = pkg_builder.new_response_frame(7, 9, RpcResponse.OP_STATUS_SUCCEEDED, 10, 20, body, write_to_wal=True)
+        self.assertEqual(parse_frame_header(frame[:4]), (2, True, len(frame) - 4))
+        self.assertEqual(frame[4:], pkg_builder.new_response(7, 9, RpcResponse.OP_STATUS_SUCCEEDED, 10, 20, body))
+
+        head, vectored_body = pkg_builder.new_response_frame(7, 9, RpcResponse.OP_STATUS_SUCCEEDED, 10, 20, body, vectored=True)
+        self.assertIs(vectored_body, body)
+        self.assertEqual(head[4:] + vectored_body, frame[4:])
+        self.assertEqual(parse_frame_header(head[:4]), (2, False, len(frame) - 4))
+
+        frame = pkg_builder.new_request_frame(1, RpcRequest.OP_TYPE_READ, b'/foo', b'req-body')
+        self.assertEqual(parse_frame_header(frame[:4]), (2, False, 17))
+        self.assertEqual(frame[4:], b'\x00\x01\x01\x00\xc0/fooreq-body')
+
+    def test_rev_flags(self):
+        for rev in (0, 1, 2, 3):
+            self.assertEqual(RpcPacketBuilder(rev).rev, rev)
+        for rev in (4, 8, 1 | 8, 16, -1):
+            with self.assertRaises(ValueError):
+                RpcPacketBuilder(rev)
+
+    def test_id_length_limits(self):
+        encode_rpc_request(None, False, False, 1, 2, RpcRequest.OP_TYPE_RW, b'x' * 64, b'', 1, b'r' * 63)
+        with self.assertRaises(ValueError):
+            encode_rpc_request(None, False, False, 1, 2, RpcRequest.OP_TYPE_RW, b'', b'')
+        with self.assertRaises(ValueError):
+            encode_rpc_request(None, False, False, 1, 2, RpcRequest.OP_TYPE_RW, b'x' * 65, b'')
+        with self.assertRaises(ValueError):
+            encode_rpc_request(None, False, False, 1, 2, RpcRequest.OP_TYPE_RW, b'/foo', b'', 1, b'r' * 64)
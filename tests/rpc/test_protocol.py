@@ -0,0 +1,73 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from dnaco.rpc.frame import build_frame_header
+from dnaco.rpc.protocol import FrameProtocol
+from dnaco.rpc.server import read_frame
+
+
+async def _echo_handler(rev, write_to_wal, req_recv_ns, data):
+    # frames starting with 's' wait a bit before replying
+    if data[:1] == b's':
+        await asyncio.sleep(0.05)
+    return rev, write_to_wal, bytes(data)
+
+
+class TestFrameProtocol(IsolatedAsyncioTestCase):
+    async def _run_frames(self, frames, max_inflight=16, recv_buffer_size=64):
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: FrameProtocol(_echo_handler, max_inflight, recv_buffer_size), '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            # send every frame with a single write, to have many frames per buffer_updated()
+            writer.write(b''.join(build_frame_header(1, False, len(data)) + data for data in frames))
+            await writer.drain()
+            writer.write_eof()
+
+            results = []
+            for _ in frames:
+                _, _, _, data = await read_frame(reader)
+                results.append(data)
+            self.assertEqual(await reader.read(), b'')
+            writer.close()
+            await writer.wait_closed()
+            return results
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    async def test_many_small_frames(self):
+        frames = [b'frame-%d' % i for i in range(100)] + [b'']
+        results = await self._run_frames(frames)
+        self.assertEqual(results, frames)
+
+    async def test_large_frames(self):
+        frames = [b'a' * 10, b'b' * 100, b'c' * (1 << 20), b'd' * 20, b'e' * 63, b'f' * 64]
+        results = await self._run_frames(frames)
+        self.assertEqual(results, frames)
+
+    async def test_out_of_order(self):
+        results = await self._run_frames([b'slow', b'fast'])
+        self.assertEqual(results, [b'fast', b'slow'])
+
+    async def test_max_inflight(self):
+        frames = [b's-%d' % i for i in range(20)]
+        results = await self._run_frames(frames, max_inflight=2)
+        self.assertEqual(sorted(results), sorted(frames))
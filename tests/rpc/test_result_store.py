@@ -0,0 +1,62 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from dnaco.rpc.result_store import RpcResultStore
+
+
+class TestRpcResultStore(IsolatedAsyncioTestCase):
+    async def test_wait_result(self):
+        store = RpcResultStore()
+        store.begin(b'res-1')
+        readers = [asyncio.ensure_future(store.get(b'res-1')) for _ in range(3)]
+        await asyncio.sleep(0)
+        self.assertEqual(len(store.pending[b'res-1']), 3)
+        store.put(b'res-1', 0, 1, 2, b'body')
+        self.assertEqual(await asyncio.gather(*readers), [(0, 1, 2, b'body')] * 3)
+        self.assertEqual(store.pending, {})
+        self.assertEqual(await store.get(b'res-1'), (0, 1, 2, b'body'))
+
+    async def test_waiter_removed_on_cancel_and_timeout(self):
+        store = RpcResultStore()
+        store.begin(b'res-1')
+        self.assertIsNone(await store.get(b'res-1', timeout=0.01))
+        self.assertEqual(store.pending[b'res-1'], set())
+
+        reader = asyncio.ensure_future(store.get(b'res-1'))
+        await asyncio.sleep(0)
+        reader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await reader
+        self.assertEqual(store.pending[b'res-1'], set())
+
+    async def test_limits(self):
+        store = RpcResultStore(max_pending=2, max_waiters=1)
+        store.begin(b'res-1')
+        store.begin(b'res-1')
+        store.begin(b'res-2')
+        with self.assertRaises(OverflowError):
+            store.begin(b'res-3')
+
+        reader = asyncio.ensure_future(store.get(b'res-1'))
+        await asyncio.sleep(0)
+        with self.assertRaises(OverflowError):
+            await store.get(b'res-1')
+        store.put(b'res-1', 0, 0, 0, b'')
+        await reader
+        store.begin(b'res-3')
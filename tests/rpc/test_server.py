@@ -0,0 +1,388 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import threading
+import time
+from unittest import IsolatedAsyncioTestCase
+
+from dnaco.rpc.client import RpcClient
+from dnaco.rpc.frame import FrameReader, build_frame_header
+from dnaco.rpc.packet import RpcPacketBuilder, RpcRequest, RpcResponse, parse_rpc_packet
+from dnaco.rpc.cache import rpc_cache_hits, rpc_cache_misses
+from dnaco.rpc.coalescing import RpcRequestCoalescer
+from dnaco.rpc.server import RPC_RESULT_FETCH_ID, RPC_ROUTE_NOT_FOUND_BODY, FrameWriter, RpcRoute, frame_handle, invalidate_rpc_cache, packet_handle, read_frame, \
+    rpc_batch_handler, rpc_handle, rpc_handler, server_rpc_route_exec_time, server_rpc_route_req_size, server_rpc_route_resp_size, \
+    server_rpc_slowest_calls
+from dnaco.telemetry.collector import TELEMETRY_COLLECTOR_REGISTRY
+
+
+async def _sleep_echo_handler(rev, write_to_wal, req_recv_ns, data):
+    # the frame body is the number of msec to wait before replying
+    await asyncio.sleep(int(data) / 1000)
+    return rev, write_to_wal, data
+
+
+@rpc_handler('/test/server/thread-name')
+def _thread_name_handler(packet):
+    return threading.current_thread().name.encode('utf-8')
+
+
+@rpc_handler('/test/server/process-pid', execution=RpcRoute.EXEC_PROCESS_POOL)
+def _process_pid_handler(packet):
+    time.sleep(0.01)
+    return b'%d' % os.getpid()
+
+
+@rpc_handler('/test/server/busy', execution=RpcRoute.EXEC_THREAD_POOL)
+def _busy_handler(packet):
+    time.sleep(0.2)
+    return bytes(packet.body)
+
+
+@rpc_handler('/test/server/async-sleep')
+async def _async_sleep_handler(packet):
+    await asyncio.sleep(int(packet.own_body()) / 1000)
+    return packet.body
+
+
+@rpc_handler('/test/server/telemetry')
+async def _telemetry_handler(packet):
+    await asyncio.sleep(int(packet.own_body()) / 1000)
+    return b'x' * 1000
+
+
+@rpc_handler('/test/server/raise')
+def _raise_handler(packet):
+    raise KeyError('boom')
+
+
+_cached_calls = []
+
+
+@rpc_handler('/test/server/cached', cache_size=1 << 20)
+def _cached_handler(packet):
+    _cached_calls.append(packet.own_body())
+    return b'resp-%d' % len(_cached_calls)
+
+
+_coalesced_calls = []
+
+
+@rpc_handler('/test/server/coalesced', coalesce=True)
+async def _coalesced_handler(packet):
+    _coalesced_calls.append(packet.own_body())
+    resp_body = b'resp-%d' % len(_coalesced_calls)
+    await asyncio.sleep(0.1)
+    return resp_body
+
+
+_batch_sizes = []
+
+
+@rpc_batch_handler('/test/server/batch', max_batch_size=8, max_batch_delay_ns=20_000_000)
+def _batch_handler(packets):
+    _batch_sizes.append(len(packets))
+    time.sleep(0.08)
+    return [bytes(packet.body).upper() for packet in packets]
+
+
+async def call_packet_handle(request_id, body, op_type=RpcRequest.OP_TYPE_READ, send_result_to=0, result_id=None, trace_id=1):
+    req = RpcPacketBuilder(1).new_request(trace_id, op_type, request_id, body, send_result_to, result_id)
+    result = await packet_handle(1, False, time.time_ns(), req)
+    if result is None:
+        return None
+    _, _, resp = result
+    return parse_rpc_packet(FrameReader(resp))
+
+
+class _FakeTransport:
+    def __init__(self, high_water=1024):
+        self.high_water = high_water
+        self.buffer_size = 0
+        self.writes = []
+
+    def writelines(self, buffers):
+        self.writes.append(list(buffers))
+
+    def is_closing(self):
+        return False
+
+    def get_write_buffer_limits(self):
+        return 0, self.high_water
+
+    def get_write_buffer_size(self):
+        return self.buffer_size
+
+
+class TestFrameWriter(IsolatedAsyncioTestCase):
+    async def test_coalescing(self):
+        transport = _FakeTransport()
+        frame_writer = FrameWriter(transport, None)
+        for i in range(10):
+            frame_writer.write(1, False, b'resp-%d' % i)
+        self.assertEqual(transport.writes, [])
+
+        # all the frames written in the same loop iteration go out with a single writelines()
+        await asyncio.sleep(0)
+        self.assertEqual(len(transport.writes), 1)
+        expected = []
+        for i in range(10):
+            expected.append(build_frame_header(1, False, 6))
+            expected.append(b'resp-%d' % i)
+        self.assertEqual(transport.writes[0], expected)
+
+        frame_writer.write(1, False, b'next')
+        await asyncio.sleep(0)
+        self.assertEqual(len(transport.writes), 2)
+
+    async def test_backpressure(self):
+        drained = []
+
+        async def _drain():
+            drained.append(transport.buffer_size)
+
+        transport = _FakeTransport(high_water=100)
+        frame_writer = FrameWriter(transport, _drain)
+
+        # below the high-water mark, drain() does not wait and the frames stay coalesced
+        frame_writer.write(1, False, b'x' * 50)
+        self.assertFalse(frame_writer.need_drain())
+        await frame_writer.drain()
+        self.assertEqual(drained, [])
+        self.assertEqual(transport.writes, [])
+
+        # pending frames + transport buffer above the mark: flush, then wait for the transport
+        transport.buffer_size = 60
+        self.assertTrue(frame_writer.need_drain())
+        await frame_writer.drain()
+        self.assertEqual(drained, [60])
+        self.assertEqual(len(transport.writes), 1)
+        self.assertEqual(frame_writer.pending_bytes, 0)
+
+
+class TestRpcServer(IsolatedAsyncioTestCase):
+    async def _run_frames(self, max_inflight, frames):
+        server = await asyncio.start_server(lambda r, w: frame_handle(r, w, _sleep_echo_handler, max_inflight), '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            for data in frames:
+                writer.write(build_frame_header(1, False, len(data)))
+                writer.write(data)
+            await writer.drain()
+
+            results = []
+            for _ in frames:
+                _, _, _, data = await read_frame(reader)
+                results.append(data)
+            writer.close()
+            await writer.wait_closed()
+            return results
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    async def test_sequential(self):
+        results = await self._run_frames(1, [b'200', b'10', b'0'])
+        self.assertEqual(results, [b'200', b'10', b'0'])
+
+    async def test_pipelined_out_of_order(self):
+        results = await self._run_frames(8, [b'200', b'10', b'0'])
+        self.assertEqual(results, [b'0', b'10', b'200'])
+
+    async def test_failed_request_keeps_connection(self):
+        # unknown routes and handler errors fail only their own request
+        server = await asyncio.start_server(rpc_handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            async with RpcClient(pool_size=1, timeout=5) as client:
+                slow, unknown, failed = await asyncio.gather(
+                    client.call('127.0.0.1', port, '/test/server/async-sleep', b'100'),
+                    client.call('127.0.0.1', port, '/test/server/unknown', b''),
+                    client.call('127.0.0.1', port, '/test/server/raise', b''))
+                self.assertEqual(len(client.pools[('127.0.0.1', port)]), 1)
+                after = await client.call('127.0.0.1', port, '/test/server/async-sleep', b'1')
+        finally:
+            server.close()
+            await server.wait_closed()
+        self.assertEqual((slow.op_status, slow.body), (RpcResponse.OP_STATUS_SUCCEEDED, b'100'))
+        self.assertEqual((unknown.op_status, unknown.body), (RpcResponse.OP_STATUS_FAILED, RPC_ROUTE_NOT_FOUND_BODY))
+        self.assertEqual(failed.op_status, RpcResponse.OP_STATUS_FAILED)
+        self.assertIn(b'boom', bytes(failed.body))
+        self.assertEqual(after.op_status, RpcResponse.OP_STATUS_SUCCEEDED)
+
+
+class TestRpcPacketHandle(IsolatedAsyncioTestCase):
+    async def test_execution_policy(self):
+        resp = await call_packet_handle(b'/test/server/thread-name', b'', RpcRequest.OP_TYPE_READ)
+        self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_SUCCEEDED)
+        self.assertEqual(resp.body, threading.current_thread().name.encode('utf-8'))
+
+        # compute requests are offloaded to the thread pool by default
+        resp = await call_packet_handle(b'/test/server/thread-name', b'', RpcRequest.OP_TYPE_COMPUTE)
+        self.assertTrue(resp.body.tobytes().startswith(b'dnaco-rpc'))
+
+        resp = await call_packet_handle(b'/test/server/process-pid', b'')
+        self.assertNotEqual(int(resp.own_body()), os.getpid())
+        self.assertGreaterEqual(resp.exec_time, 10_000_000)
+
+    async def test_offload_does_not_block_loop(self):
+        busy = asyncio.ensure_future(call_packet_handle(b'/test/server/busy', b'busy'))
+        await asyncio.sleep(0.01)
+        start = time.monotonic()
+        resp = await call_packet_handle(b'/test/server/thread-name', b'')
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertFalse(busy.done())
+        resp = await busy
+        self.assertEqual(resp.body, b'busy')
+        self.assertGreaterEqual(resp.exec_time, 200_000_000)
+
+    async def test_async_handler(self):
+        start = time.monotonic()
+        responses = await asyncio.gather(*[call_packet_handle(b'/test/server/async-sleep', b'100') for _ in range(10)])
+        self.assertLess(time.monotonic() - start, 0.5)
+        for resp in responses:
+            self.assertEqual(resp.body, b'100')
+            self.assertGreaterEqual(resp.exec_time, 100_000_000)
+
+    def test_async_handler_execution(self):
+        async def _handler(packet):
+            return b''
+
+        with self.assertRaises(ValueError):
+            rpc_handler('/test/server/async-thread', execution=RpcRoute.EXEC_THREAD_POOL)(_handler)
+
+    async def test_store_result(self):
+        resp = await call_packet_handle(b'/test/server/async-sleep', b'100', send_result_to=RpcRequest.STORE_RESULT_WITH_ID, result_id=b'res-1')
+        self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_SUCCEEDED)
+        self.assertEqual(resp.body, b'res-1')
+        self.assertEqual(resp.exec_time, 0)
+
+        # the fetch waits for the execution to complete
+        resp = await call_packet_handle(RPC_RESULT_FETCH_ID, b'res-1')
+        self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_SUCCEEDED)
+        self.assertEqual(resp.body, b'100')
+        self.assertGreaterEqual(resp.exec_time, 100_000_000)
+
+        resp = await call_packet_handle(b'/test/server/async-sleep', b'1', send_result_to=RpcRequest.STORE_RESULT_IN_MEMORY)
+        result_id = resp.own_body()
+        self.assertEqual(len(result_id), 32)
+        await asyncio.sleep(0.05)
+        resp = await call_packet_handle(RPC_RESULT_FETCH_ID, result_id)
+        self.assertEqual(resp.body, b'1')
+
+        resp = await call_packet_handle(RPC_RESULT_FETCH_ID, b'res-unknown')
+        self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_FAILED)
+
+    async def test_response_cache(self):
+        route = '/test/server/cached'
+        for _ in range(3):
+            resp = await call_packet_handle(route.encode('utf-8'), b'a')
+            self.assertEqual(resp.body, b'resp-1')
+        resp = await call_packet_handle(route.encode('utf-8'), b'b')
+        self.assertEqual(resp.body, b'resp-2')
+        self.assertEqual(rpc_cache_hits.data[route], 2)
+        self.assertEqual(rpc_cache_misses.data[route], 2)
+
+        # only READ requests are cached
+        resp = await call_packet_handle(route.encode('utf-8'), b'a', RpcRequest.OP_TYPE_WRITE)
+        self.assertEqual(resp.body, b'resp-3')
+
+        invalidate_rpc_cache(route, b'a')
+        resp = await call_packet_handle(route.encode('utf-8'), b'a')
+        self.assertEqual(resp.body, b'resp-4')
+        resp = await call_packet_handle(route.encode('utf-8'), b'b')
+        self.assertEqual(resp.body, b'resp-2')
+
+        invalidate_rpc_cache(route)
+        resp = await call_packet_handle(route.encode('utf-8'), b'b')
+        self.assertEqual(resp.body, b'resp-5')
+        self.assertEqual(_cached_calls, [b'a', b'b', b'a', b'a', b'b'])
+
+    async def test_coalescing(self):
+        route = b'/test/server/coalesced'
+        responses = await asyncio.gather(*[call_packet_handle(route, b'a', trace_id=i) for i in range(1, 11)],
+                                         call_packet_handle(route, b'b', trace_id=11))
+        self.assertEqual(sorted(_coalesced_calls), [b'a', b'b'])
+        self.assertEqual([resp.trace_id for resp in responses], list(range(1, 12)))
+        self.assertEqual(len(set(resp.body.tobytes() for resp in responses[:10])), 1)
+        self.assertNotEqual(responses[10].body, responses[0].body)
+        for resp in responses:
+            self.assertGreaterEqual(resp.exec_time, 100_000_000)
+
+        # once completed, the next request executes the handler again
+        await call_packet_handle(route, b'a')
+        self.assertEqual(len(_coalesced_calls), 3)
+
+    async def test_coalescing_leader_cancelled(self):
+        coalescer = RpcRequestCoalescer('/test/server/coalescer')
+        calls = []
+
+        async def _exec(name, op_status):
+            calls.append(name)
+            await asyncio.sleep(0.05)
+            return op_status, 0, 50_000_000, b'resp-' + name
+
+        # the leader task is cancelled while the follower waits: the follower executes
+        leader = asyncio.ensure_future(coalescer.execute(b'k', lambda: _exec(b'leader', RpcResponse.OP_STATUS_SUCCEEDED), 0))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(coalescer.execute(b'k', lambda: _exec(b'follower', RpcResponse.OP_STATUS_SUCCEEDED), 0))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        self.assertEqual((await follower)[3], b'resp-follower')
+        self.assertTrue(leader.cancelled())
+
+        # the leader ends with CANCELLED (e.g. deadline exceeded): the followers don't inherit it
+        calls.clear()
+        results = await asyncio.gather(
+            coalescer.execute(b'k', lambda: _exec(b'leader', RpcResponse.OP_STATUS_CANCELLED), 0),
+            coalescer.execute(b'k', lambda: _exec(b'f1', RpcResponse.OP_STATUS_SUCCEEDED), 0),
+            coalescer.execute(b'k', lambda: _exec(b'f2', RpcResponse.OP_STATUS_SUCCEEDED), 0))
+        self.assertEqual(results[0][0], RpcResponse.OP_STATUS_CANCELLED)
+        # the first follower is promoted to leader, the second one shares its result
+        self.assertEqual(calls, [b'leader', b'f1'])
+        self.assertEqual([result[3] for result in results[1:]], [b'resp-f1', b'resp-f1'])
+
+    async def test_batch_handler(self):
+        route = b'/test/server/batch'
+        bodies = [b'req-%d' % i for i in range(10)]
+        responses = await asyncio.gather(*[call_packet_handle(route, body, trace_id=i + 1) for i, body in enumerate(bodies)])
+        self.assertEqual(_batch_sizes, [8, 2])
+        self.assertEqual([resp.body for resp in responses], [body.upper() for body in bodies])
+        self.assertEqual([resp.trace_id for resp in responses], list(range(1, 11)))
+        for resp in responses[:8]:
+            self.assertGreaterEqual(resp.exec_time, 10_000_000)
+            self.assertLess(resp.exec_time, 40_000_000)
+
+    async def test_route_telemetry(self):
+        route = '/test/server/telemetry'
+        await asyncio.gather(call_packet_handle(route.encode(), b'1', trace_id=101),
+                             call_packet_handle(route.encode(), b'50', trace_id=102))
+        exec_time = server_rpc_route_exec_time.get(route)
+        self.assertGreaterEqual(sum(exec_time.events), 2)
+        self.assertGreaterEqual(exec_time.vmax, 50_000_000)
+        self.assertGreaterEqual(sum(server_rpc_route_req_size.get(route).events), 2)
+        self.assertGreaterEqual(sum(server_rpc_route_resp_size.get(route).events), 2)
+
+        slowest = {entry['key']: entry for entry in server_rpc_slowest_calls.snapshot()}
+        self.assertIn(102, slowest[route]['trace_ids'])
+
+        snapshot = TELEMETRY_COLLECTOR_REGISTRY.snapshot()
+        self.assertEqual(snapshot['dnaco_rpc_route_exec_time']['type'], 'HISTOGRAM_MAP')
+        self.assertIn(route, snapshot['dnaco_rpc_route_queue_time']['data'])
+        self.assertIn('RPC Slowest Calls', TELEMETRY_COLLECTOR_REGISTRY.human_report())
@@ -0,0 +1,144 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import socket
+import struct
+import tempfile
+from multiprocessing.shared_memory import SharedMemory
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from dnaco.rpc.client import RpcClient
+from dnaco.rpc.packet import RpcResponse
+from dnaco.rpc.server import rpc_handler, start_rpc_unix_server
+from dnaco.rpc.shm import SHM_DATA, SHM_MAX_RING_SIZE, SHM_NAME_PREFIX, SHM_THRESHOLD, ShmChannel, ShmRing, _channel_size
+
+
+@rpc_handler('/test/shm/reverse')
+def _reverse_handler(packet):
+    return bytes(packet.body)[::-1]
+
+
+class TestShmRing(TestCase):
+    def test_wrap_and_full(self):
+        ring = ShmRing(memoryview(bytearray(64 + 100)))
+        self.assertEqual(ring.write(b'a' * 60), 0)
+        # no space left for 60 bytes until the consumer reads the first ones
+        self.assertIsNone(ring.write(b'b' * 60))
+        self.assertEqual(ring.read(0, 60), b'a' * 60)
+        # does not fit at the end of the ring, written at the start
+        pos = ring.write(b'b' * 60)
+        self.assertEqual(pos, 100)
+        self.assertEqual(ring.read(pos, 60), b'b' * 60)
+        self.assertIsNone(ring.write(b'c' * 101))
+
+    def test_invalid_descriptor(self):
+        ring = ShmRing(memoryview(bytearray(64 + 100)))
+        descriptor = ring.write_frame(b'a' * 60)
+        for pos, length in ((0, 101), (0, 1 << 30), (50, 60), (100, 60), (1 << 40, 10)):
+            with self.assertRaises(ValueError):
+                ring.read_frame(struct.pack('<BQI', SHM_DATA, pos, length))
+        with self.assertRaises(ValueError):
+            ring.read_frame(descriptor[:-1])
+        self.assertEqual(ring.read_frame(descriptor), b'a' * 60)
+        # already consumed
+        with self.assertRaises(ValueError):
+            ring.read_frame(descriptor)
+
+    def test_channel(self):
+        client = ShmChannel.create(1 << 10)
+        try:
+            server = ShmChannel.attach(client.shm.name, 1 << 10)
+            descriptor = client.tx.write_frame(b'request')
+            self.assertEqual(server.rx.read_frame(descriptor), b'request')
+            descriptor = server.tx.write_frame(b'response')
+            self.assertEqual(client.rx.read_frame(descriptor), b'response')
+            server.close()
+        finally:
+            client.close()
+
+    def test_attach_checks(self):
+        client = ShmChannel.create(1 << 10)
+        try:
+            self.assertTrue(client.shm.name.startswith(SHM_NAME_PREFIX))
+            # the size announced by the client must match the segment
+            for ring_size in (1 << 9, 1 << 20, 0, SHM_MAX_RING_SIZE + 1):
+                with self.assertRaises(ValueError):
+                    ShmChannel.attach(client.shm.name, ring_size)
+        finally:
+            client.close()
+
+        # segments not created by a dnaco client are never mapped
+        other = SharedMemory(create=True, size=_channel_size(1 << 10))
+        try:
+            for name in (other.name, SHM_NAME_PREFIX + '../' + other.name, SHM_NAME_PREFIX + 'x' * 16):
+                with self.assertRaises(ValueError):
+                    ShmChannel.attach(name, 1 << 10)
+        finally:
+            other.close()
+            other.unlink()
+
+
+class TestUnixTransport(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'rpc.sock')
+        self.server = await start_rpc_unix_server(self.path)
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.tmpdir.cleanup()
+
+    async def test_unix_socket(self):
+        async with RpcClient() as client:
+            resp = await client.call(self.path, None, '/test/shm/reverse', b'abc')
+            self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_SUCCEEDED)
+            self.assertEqual(resp.body, b'cba')
+
+    async def test_live_and_stale_socket(self):
+        # the socket of a live server is not replaced
+        with self.assertRaises(OSError):
+            await start_rpc_unix_server(self.path)
+        async with RpcClient() as client:
+            resp = await client.call(self.path, None, '/test/shm/reverse', b'abc')
+            self.assertEqual(resp.body, b'cba')
+
+        # the socket of a dead server is replaced
+        stale_path = os.path.join(self.tmpdir.name, 'stale.sock')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(stale_path)
+        sock.close()
+        server = await start_rpc_unix_server(stale_path)
+        try:
+            async with RpcClient() as client:
+                resp = await client.call(stale_path, None, '/test/shm/reverse', b'abc')
+                self.assertEqual(resp.body, b'cba')
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    async def test_shared_memory(self):
+        body = os.urandom(SHM_THRESHOLD * 4)
+        async with RpcClient(pool_size=1, shm_ring_size=4 << 20) as client:
+            responses = await asyncio.gather(*[client.call(self.path, None, '/test/shm/reverse', body) for _ in range(8)])
+            for resp in responses:
+                self.assertEqual(resp.body, body[::-1])
+            conn = client.pools[(self.path, None)][0]
+            # both the requests and the responses went through the rings
+            self.assertGreaterEqual(conn.shm.tx.head, len(body) * 8)
+            self.assertGreaterEqual(conn.shm.rx.tail(), len(body) * 8)
@@ -0,0 +1,167 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from dnaco.rpc.client import RpcClient
+from dnaco.rpc.packet import RpcEvent, RpcResponse
+from dnaco.rpc.server import RPC_MAX_INFLIGHT_PER_CONNECTION, rpc_connection, rpc_handle, rpc_handler, rpc_stream_handler
+from dnaco.rpc.stream import RPC_STREAM_CHUNK_SIZE, RPC_STREAM_WINDOW, RpcStream
+
+
+@rpc_stream_handler('/test/stream/upper')
+async def _upper_stream(packet, stream):
+    yield bytes(packet.body)
+    async for chunk in stream:
+        yield bytes(chunk).upper()
+
+
+@rpc_stream_handler('/test/stream/count')
+async def _count_stream(packet, stream):
+    # consume the input slowly, the client must wait for the window updates
+    total = 0
+    async for chunk in stream:
+        total += len(chunk)
+        await asyncio.sleep(0)
+    yield b'%d' % total
+
+
+_early_connections = []
+
+
+@rpc_stream_handler('/test/stream/early')
+async def _early_stream(packet, stream):
+    # returns without reading the whole input
+    _early_connections.append(rpc_connection.get())
+    chunk = await stream.read()
+    yield bytes(chunk)
+
+
+@rpc_handler('/test/stream/ping')
+def _ping_handler(packet):
+    return b'pong'
+
+
+@rpc_stream_handler('/test/stream/fail')
+async def _fail_stream(packet, stream):
+    yield b'first'
+    raise ValueError('stream failure')
+
+
+class TestRpcStream(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await asyncio.start_server(rpc_handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_echo_stream(self):
+        async with RpcClient() as client:
+            stream = await client.open_stream('127.0.0.1', self.port, '/test/stream/upper', b'head')
+            for chunk in (b'abc', b'def', b'ghi'):
+                await stream.write(chunk)
+            await stream.write_eof()
+            chunks = [bytes(chunk) async for chunk in stream]
+            self.assertEqual(chunks, [b'head', b'ABC', b'DEF', b'GHI'])
+            resp = await stream.response(timeout=1)
+            self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_SUCCEEDED)
+
+    async def test_flow_control(self):
+        # more chunks than the window, each one split in two frames
+        size = (RPC_STREAM_CHUNK_SIZE + 1) * (RPC_STREAM_WINDOW * 2)
+        async with RpcClient() as client:
+            stream = await client.open_stream('127.0.0.1', self.port, '/test/stream/count')
+            for _ in range(RPC_STREAM_WINDOW * 2):
+                await stream.write(b'x' * (RPC_STREAM_CHUNK_SIZE + 1))
+                self.assertGreaterEqual(stream.write_credits, 0)
+            await stream.write_eof()
+            chunks = [bytes(chunk) async for chunk in stream]
+            self.assertEqual(chunks, [b'%d' % size])
+            self.assertEqual(stream.write_seq, RPC_STREAM_WINDOW * 4)
+
+    async def test_failed_stream(self):
+        async with RpcClient() as client:
+            stream = await client.open_stream('127.0.0.1', self.port, '/test/stream/fail')
+            await stream.write_eof()
+            chunks = [bytes(chunk) async for chunk in stream]
+            self.assertEqual(chunks, [b'first'])
+            resp = await stream.response(timeout=1)
+            self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_FAILED)
+            self.assertEqual(bytes(resp.body), b'stream failure')
+
+    async def test_events_after_close(self):
+        _early_connections.clear()
+        async with RpcClient() as client:
+            stream = await client.open_stream('127.0.0.1', self.port, '/test/stream/early')
+            await stream.write(b'first')
+            chunks = [bytes(chunk) async for chunk in stream]
+            self.assertEqual(chunks, [b'first'])
+            resp = await stream.response(timeout=1)
+            self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_SUCCEEDED)
+
+            # the client was still writing when the handler returned
+            pkg_id = resp.pkg_id
+            for seq in range(1, 4):
+                stream.send_event(RpcEvent.EVENT_STREAM_DATA, seq, b'x' * 1024)
+            stream.send_event(RpcEvent.EVENT_STREAM_END, 4)
+            await stream.drain()
+            resp = await client.call('127.0.0.1', self.port, '/test/stream/ping', b'')
+            self.assertEqual(resp.body, b'pong')
+
+            connection, = _early_connections
+            self.assertNotIn(pkg_id, connection.streams)
+            self.assertIn(pkg_id, connection.closed_streams)
+
+    async def test_reorder_and_window(self):
+        events = []
+        stream = RpcStream(window=4)
+        stream.send_event = lambda event_type, value, data=b'': events.append((event_type, value))
+        stream.feed(1, b'b')
+        stream.feed(0, b'a')
+        stream.feed_eof(3)
+        stream.feed(2, b'c')
+        self.assertEqual([chunk async for chunk in stream], [b'a', b'b', b'c'])
+        self.assertEqual(events, [(RpcEvent.EVENT_STREAM_WINDOW, 2)])
+
+        stream = RpcStream(window=2)
+        stream.feed(0, b'a')
+        stream.feed(1, b'b')
+        stream.feed(2, b'c')
+        with self.assertRaises(Exception):
+            while await stream.read() is not None:
+                pass
+
+    async def test_streams_fill_inflight_slots(self):
+        # the open streams hold all the in-flight slots of the connection,
+        # their data events must still be delivered
+        async with RpcClient(pool_size=1) as client:
+            streams = []
+            for i in range(RPC_MAX_INFLIGHT_PER_CONNECTION):
+                streams.append(await client.open_stream('127.0.0.1', self.port, '/test/stream/upper', b'head-%d' % i))
+            for i, stream in enumerate(streams):
+                await stream.write(b'data-%d' % i)
+                await stream.write_eof()
+            for i, stream in enumerate(streams):
+                chunks = await asyncio.wait_for(self._read_all(stream), 2)
+                self.assertEqual(chunks, [b'head-%d' % i, b'DATA-%d' % i])
+                resp = await stream.response(timeout=1)
+                self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_SUCCEEDED)
+
+    async def _read_all(self, stream):
+        return [bytes(chunk) async for chunk in stream]
@@ -0,0 +1,129 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from dnaco.rpc.client import RpcClient
+from dnaco.rpc.packet import RpcResponse
+from dnaco.rpc.server import RPC_INVALID_TRACE_ID_BODY, rpc_handle, rpc_handler
+from dnaco.rpc.tracing import RPC_TRACES_FETCH_ID, RpcTracer, SpanRing, set_rpc_tracer
+
+_test_port = [0]
+
+
+@rpc_handler('/test/tracing/echo')
+def _echo_handler(packet):
+    return packet.body
+
+
+@rpc_handler('/test/tracing/proxy')
+async def _proxy_handler(packet):
+    # outbound call, in the context of the request being executed
+    async with RpcClient() as client:
+        resp = await client.call('127.0.0.1', _test_port[0], '/test/tracing/echo', packet.own_body(),
+                                 trace_id=packet.trace_id)
+    return resp.body
+
+
+class TestSpanRing(TestCase):
+    def test_overwrite_oldest(self):
+        ring = SpanRing(4)
+        for i in range(6):
+            ring.add(i % 2, i + 1, 0, 'span-%d' % i, i, i + 1)
+        spans = ring.spans()
+        self.assertEqual([span['name'] for span in spans], ['span-2', 'span-3', 'span-4', 'span-5'])
+        self.assertEqual([span['span_id'] for span in ring.spans(1)], [4, 6])
+
+    def test_sampling(self):
+        self.assertFalse(any(RpcTracer(0.0, 16).is_sampled(i) for i in range(1000)))
+        self.assertTrue(all(RpcTracer(1.0, 16).is_sampled(i) for i in range(1000)))
+        sampled = sum(1 for i in range(10000) if RpcTracer(0.25, 16).is_sampled(i))
+        self.assertGreater(sampled, 2000)
+        self.assertLess(sampled, 3000)
+
+
+class TestRpcTracing(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await asyncio.start_server(rpc_handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        _test_port[0] = self.port
+        self.old_tracer = set_rpc_tracer(None)
+
+    async def asyncTearDown(self):
+        set_rpc_tracer(self.old_tracer)
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_invalid_trace_id(self):
+        set_rpc_tracer(RpcTracer(1.0, 1024))
+        async with RpcClient() as client:
+            resp = await client.call('127.0.0.1', self.port, RPC_TRACES_FETCH_ID, b'not-a-trace-id')
+            self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_FAILED)
+            self.assertEqual(bytes(resp.body), RPC_INVALID_TRACE_ID_BODY)
+            # the connection is still usable
+            resp = await client.call('127.0.0.1', self.port, RPC_TRACES_FETCH_ID, b'')
+            self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_SUCCEEDED)
+
+    async def test_request_spans(self):
+        tracer = RpcTracer(1.0, 1024)
+        set_rpc_tracer(tracer)
+        async with RpcClient() as client:
+            resp = await client.call('127.0.0.1', self.port, '/test/tracing/proxy', b'hello', trace_id=1234)
+            self.assertEqual(resp.body, b'hello')
+            # the write span is recorded once the response is handed to the transport
+            await asyncio.sleep(0.01)
+            traces = await client.call('127.0.0.1', self.port, RPC_TRACES_FETCH_ID, b'1234', trace_id=1)
+
+        spans = json.loads(bytes(traces.body))
+        self.assertTrue(all(span['trace_id'] == 1234 for span in spans))
+        by_name = {}
+        for span in spans:
+            by_name.setdefault(span['name'], []).append(span)
+        self.assertEqual(len(by_name['rpc.server']), 2)
+        self.assertEqual(len(by_name['rpc.client']), 2)
+        for name in ('rpc.queue', 'rpc.exec', 'rpc.write'):
+            self.assertEqual(len(by_name[name]), 2)
+
+        # queue/exec/write are children of the server span
+        server_spans = {span['span_id']: span for span in by_name['rpc.server']}
+        for name in ('rpc.queue', 'rpc.exec', 'rpc.write'):
+            for span in by_name[name]:
+                self.assertIn(span['parent_id'], server_spans)
+                self.assertLessEqual(span['start_ns'], span['end_ns'])
+
+        # the outbound call of the proxy handler is a child of the proxy server span
+        proxy_span = next(span for span in by_name['rpc.server'] if span['tag'] == '/test/tracing/proxy')
+        client_spans = {span['parent_id']: span for span in by_name['rpc.client']}
+        self.assertEqual(client_spans[proxy_span['span_id']]['tag'], '127.0.0.1:%d/test/tracing/echo' % self.port)
+        self.assertEqual(client_spans[0]['tag'], '127.0.0.1:%d/test/tracing/proxy' % self.port)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'spans.jsonl')
+            tracer.dump(path, 1234)
+            with open(path) as fd:
+                self.assertEqual([json.loads(line) for line in fd], tracer.spans(1234))
+
+    async def test_not_sampled(self):
+        tracer = RpcTracer(0.0, 1024)
+        set_rpc_tracer(tracer)
+        async with RpcClient() as client:
+            resp = await client.call('127.0.0.1', self.port, '/test/tracing/proxy', b'hello')
+            self.assertEqual(resp.body, b'hello')
+        self.assertEqual(tracer.spans(), [])
@@ -0,0 +1,162 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase
+
+from dnaco.rpc.frame import FrameReader
+from dnaco.rpc.packet import RpcPacketBuilder, RpcRequest, RpcResponse, parse_rpc_batch, parse_rpc_packet
+from dnaco.rpc.server import packet_handle, rpc_handler, set_rpc_wal
+from dnaco.rpc.wal import WalWriter, replay_wal, wal_segments
+
+
+@rpc_handler('/test/wal')
+def _wal_handler(packet):
+    return bytes(packet.body)
+
+
+class TestWal(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.wal_dir = os.path.join(self.tmp_dir.name, 'wal')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    async def test_group_commit(self):
+        wal = WalWriter(self.wal_dir, group_commit_window=0.01)
+        syncs = []
+        write_sync = wal._write_sync
+        wal._write_sync = lambda buffers: syncs.append(len(buffers)) or write_sync(buffers)
+
+        records = [b'record-%d' % i for i in range(100)]
+        await asyncio.gather(*[wal.append(1, data) for data in records])
+        await wal.close()
+        self.assertEqual(syncs, [200])
+
+        replayed = [(rev, bytes(data)) for _, _, rev, data in replay_wal(self.wal_dir)]
+        self.assertEqual(replayed, [(1, data) for data in records])
+
+    async def test_group_commit_bytes_and_segments(self):
+        wal = WalWriter(self.wal_dir, max_segment_size=200, group_commit_window=10, group_commit_bytes=500)
+        records = [bytes([i]) * 100 for i in range(20)]
+        await asyncio.wait_for(asyncio.gather(*[wal.append(2, data) for data in records]), 5)
+        await wal.close()
+        self.assertGreater(len(wal_segments(self.wal_dir)), 1)
+
+        # a new writer never appends to the old segments
+        wal = WalWriter(self.wal_dir)
+        await wal.append(3, b'new-record')
+        await wal.close()
+
+        replayed = [(rev, bytes(data)) for _, _, rev, data in replay_wal(self.wal_dir)]
+        self.assertEqual(replayed, [(2, data) for data in records] + [(3, b'new-record')])
+
+    async def test_truncated_tail(self):
+        wal = WalWriter(self.wal_dir)
+        await asyncio.gather(wal.append(1, b'aaaa'), wal.append(1, b'bbbb'))
+        await wal.close()
+
+        _, path = wal_segments(self.wal_dir)[-1]
+        with open(path, 'ab') as fd:
+            fd.write(b'\x10\x00\x00\x10partial')
+
+        replayed = [bytes(data) for _, _, _, data in replay_wal(self.wal_dir)]
+        self.assertEqual(replayed, [b'aaaa', b'bbbb'])
+
+    async def test_closed(self):
+        wal = WalWriter(self.wal_dir, group_commit_window=10)
+        append = asyncio.ensure_future(wal.append(1, b'pending'))
+        await asyncio.sleep(0)
+        # the pending records are flushed by close, no flush is scheduled after it
+        await wal.close()
+        await append
+        self.assertIsNone(wal._flush_handle)
+        with self.assertRaises(ValueError):
+            await wal.append(1, b'after-close')
+        await wal.close()
+
+        replayed = [bytes(data) for _, _, _, data in replay_wal(self.wal_dir)]
+        self.assertEqual(replayed, [b'pending'])
+
+    async def test_short_write(self):
+        wal = WalWriter(self.wal_dir)
+        writev = os.writev
+        write = os.write
+        os.writev = lambda fd, buffers: writev(fd, [bytes(buffers[0])[:3]])
+        os.write = lambda fd, data: write(fd, bytes(data)[:5])
+        try:
+            await wal.append(1, b'short-write-record')
+        finally:
+            os.writev = writev
+            os.write = write
+        await wal.close()
+
+        replayed = [bytes(data) for _, _, _, data in replay_wal(self.wal_dir)]
+        self.assertEqual(replayed, [b'short-write-record'])
+
+    async def test_packet_handle(self):
+        wal = WalWriter(self.wal_dir)
+        old_wal = set_rpc_wal(wal)
+        try:
+            builder = RpcPacketBuilder(1)
+            req = builder.new_request(1, RpcRequest.OP_TYPE_WRITE, b'/test/wal', b'wal-body')
+            _, _, resp = await packet_handle(1, True, 0, req)
+            self.assertEqual(parse_rpc_packet(FrameReader(resp)).op_status, RpcResponse.OP_STATUS_SUCCEEDED)
+            # not flagged write_to_wal
+            await packet_handle(1, False, 0, builder.new_request(2, RpcRequest.OP_TYPE_READ, b'/test/wal', b'no-wal'))
+        finally:
+            set_rpc_wal(old_wal)
+            await wal.close()
+
+        # the replayed frame is the request
+        replayed = [(rev, bytes(data)) for _, _, rev, data in replay_wal(self.wal_dir)]
+        self.assertEqual(replayed, [(1, req)])
+        packet = parse_rpc_packet(FrameReader(replayed[0][1]))
+        self.assertEqual(packet.request_id, b'/test/wal')
+        self.assertEqual(bytes(packet.body), b'wal-body')
+
+    async def test_packet_handle_wal_failure(self):
+        wal = WalWriter(self.wal_dir)
+
+        def _write_sync(buffers):
+            raise OSError('disk full')
+
+        wal._write_sync = _write_sync
+        old_wal = set_rpc_wal(wal)
+        try:
+            builder = RpcPacketBuilder(1)
+            req = builder.new_request(1, RpcRequest.OP_TYPE_WRITE, b'/test/wal', b'wal-body')
+            _, _, resp = await packet_handle(1, True, 0, req)
+            resp = parse_rpc_packet(FrameReader(resp))
+            self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_FAILED)
+            self.assertIn(b'disk full', bytes(resp.body))
+
+            # every request of a batch fails
+            batch = builder.new_batch(2, [builder.new_request(2, RpcRequest.OP_TYPE_WRITE, b'/test/wal', b'x')
+                                          for _ in range(3)])
+            _, _, resp = await packet_handle(1, True, 0, batch)
+            responses = [parse_rpc_packet(FrameReader(data)) for data in parse_rpc_batch(parse_rpc_packet(FrameReader(resp)).body)]
+            self.assertEqual([resp.op_status for resp in responses], [RpcResponse.OP_STATUS_FAILED] * 3)
+
+            # the requests not flagged write_to_wal are executed
+            _, _, resp = await packet_handle(1, False, 0, builder.new_request(3, RpcRequest.OP_TYPE_READ, b'/test/wal', b'ok'))
+            self.assertEqual(bytes(parse_rpc_packet(FrameReader(resp)).body), b'ok')
+        finally:
+            set_rpc_wal(old_wal)
+            await wal.close()
@@ -0,0 +1,118 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import socket
+import time
+from unittest import TestCase, skipUnless
+
+from dnaco.rpc.client import RpcClient
+from dnaco.rpc.packet import RpcResponse
+from dnaco.rpc.server import RpcRoute, rpc_handler
+from dnaco.rpc.workers import RpcWorkerSupervisor
+
+
+@rpc_handler('/test/workers/pid')
+def _pid_handler(packet):
+    return b'%d' % os.getpid()
+
+
+@rpc_handler('/test/workers/process-ppid', execution=RpcRoute.EXEC_PROCESS_POOL)
+def _process_ppid_handler(packet):
+    return b'%d' % os.getppid()
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _call_workers(port, count):
+    async with RpcClient(pool_size=8, timeout=5) as client:
+        responses = await asyncio.gather(*[client.call('127.0.0.1', port, '/test/workers/pid', b'')
+                                           for _ in range(count)])
+    return {int(bytes(resp.body)) for resp in responses}
+
+
+def _is_listening(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        return sock.connect_ex(('127.0.0.1', port)) == 0
+
+
+def _wait_until(predicate, timeout=10, poll=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if poll is not None:
+            poll()
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@skipUnless(hasattr(socket, 'SO_REUSEPORT'), 'SO_REUSEPORT is not supported')
+class TestRpcWorkerSupervisor(TestCase):
+    def setUp(self):
+        self.port = _free_port()
+        self.supervisor = RpcWorkerSupervisor('127.0.0.1', self.port, num_workers=2, telemetry_interval=0.1)
+        self.supervisor.RESTART_DELAY_SEC = 0.1
+        self.supervisor.start()
+
+    def tearDown(self):
+        self.supervisor.stop()
+
+    def _route_events(self, snapshot):
+        route_data = snapshot.get('dnaco_rpc_route_exec_time', {}).get('data', {})
+        return route_data.get('/test/workers/pid', {}).get('nevents', 0)
+
+    def test_restart_and_merged_telemetry(self):
+        supervisor = self.supervisor
+        worker_pids = {process.pid for process in supervisor.workers}
+        self.assertTrue(_wait_until(lambda: supervisor.worker_snapshots.keys() == {0, 1},
+                                    poll=lambda: supervisor.collect_telemetry(0.05)))
+        pids = asyncio.run(_call_workers(self.port, 32))
+        self.assertTrue(pids <= worker_pids)
+
+        # the merged snapshot counts the requests served by every worker
+        self.assertTrue(_wait_until(lambda: self._route_events(supervisor.snapshot()) == 32,
+                                    poll=lambda: supervisor.collect_telemetry(0.05)))
+        per_worker = [self._route_events(snapshot) for snapshot in supervisor.worker_snapshots.values()]
+        self.assertEqual(sum(per_worker), 32)
+
+        # a dead worker is replaced, and the new one serves the port
+        dead = supervisor.workers[0]
+        dead.kill()
+        dead.join()
+        self.assertTrue(_wait_until(lambda: supervisor.restarts == 1, poll=supervisor.check_workers))
+        new_worker = supervisor.workers[0]
+        self.assertNotEqual(new_worker.pid, dead.pid)
+        self.assertTrue(new_worker.is_alive())
+        self.assertTrue(_wait_until(lambda: new_worker.pid in asyncio.run(_call_workers(self.port, 16))))
+
+    def test_process_pool_route(self):
+        # the pool processes are children of the workers
+        worker_pids = {process.pid for process in self.supervisor.workers}
+
+        async def _call():
+            async with RpcClient(timeout=10) as client:
+                return await client.call('127.0.0.1', self.port, '/test/workers/process-ppid', b'')
+
+        self.assertTrue(_wait_until(lambda: _is_listening(self.port)))
+        resp = asyncio.run(_call())
+        self.assertEqual(resp.op_status, RpcResponse.OP_STATUS_SUCCEEDED, bytes(resp.body))
+        self.assertIn(int(bytes(resp.body)), worker_pids)
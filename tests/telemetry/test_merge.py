@@ -0,0 +1,93 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+
+from dnaco.telemetry.counter_map import CounterMap
+from dnaco.telemetry.histogram import Histogram
+from dnaco.telemetry.histogram_map import HistogramMap
+from dnaco.telemetry.merge import merge_collector_data, merge_snapshots
+from dnaco.telemetry.time_range_counter import TimeRangeCounter
+from dnaco.telemetry.topk import TopK
+
+
+class TestTelemetryMerge(TestCase):
+    def test_time_range_counter(self):
+        now = 10 * 60
+        a = TimeRangeCounter(10 * 60, 60)
+        b = TimeRangeCounter(10 * 60, 60)
+        a.clear()
+        b.clear()
+        a.last_interval = b.last_interval = now - 120
+        a.add(1, now - 120)
+        a.add(2, now)
+        b.add(10, now - 60)
+        b.add(20, now)
+
+        merged = merge_collector_data(a.COLLECTOR_TYPE, [a.snapshot(), b.snapshot()])
+        self.assertEqual(merged['last_interval'], now)
+        self.assertEqual(merged['counters'], [1, 10, 22])
+
+    def test_histogram(self):
+        a = Histogram([10, 100])
+        b = Histogram([10, 100])
+        a.add(5)
+        a.add(50)
+        b.add(500)
+        merged = merge_collector_data(a.COLLECTOR_TYPE, [a.snapshot(), b.snapshot()])
+        self.assertEqual(merged['events'], [1, 1, 1])
+        self.assertEqual(merged['nevents'], 3)
+        self.assertEqual(merged['max_value'], 500)
+
+    def test_histogram_map(self):
+        a = HistogramMap([10, 100])
+        b = HistogramMap([10, 100])
+        a.add('/foo', 5)
+        a.add('/bar', 50)
+        b.add('/foo', 500)
+        merged = merge_collector_data(a.COLLECTOR_TYPE, [a.snapshot(), b.snapshot()])
+        self.assertEqual(merged['/foo']['events'], [1, 0, 1])
+        self.assertEqual(merged['/foo']['max_value'], 500)
+        self.assertEqual(merged['/bar']['events'], [0, 1, 0])
+
+    def test_counter_map_and_topk(self):
+        a = CounterMap()
+        b = CounterMap()
+        a.inc('x', 2)
+        b.inc('x', 3)
+        b.inc('y')
+        self.assertEqual(merge_collector_data(a.COLLECTOR_TYPE, [a.snapshot(), b.snapshot()]), {'x': 5, 'y': 1})
+
+        a = TopK(2)
+        b = TopK(2)
+        a.add('/foo', 10, 1)
+        a.add('/bar', 5, 2)
+        b.add('/foo', 30, 3)
+        b.add('/baz', 20, 4)
+        merged = merge_collector_data(a.COLLECTOR_TYPE, [a.snapshot(), b.snapshot()])
+        self.assertEqual([e['key'] for e in merged], ['/foo', '/baz'])
+        self.assertEqual(merged[0]['max'], 30)
+        self.assertEqual(merged[0]['min'], 10)
+        self.assertEqual(merged[0]['freq'], 2)
+        self.assertEqual(merged[0]['avg'], 20)
+        self.assertEqual(merged[0]['trace_ids'], [1, 3])
+
+    def test_merge_snapshots(self):
+        snapshot = {'hist': {'label': 'Hist', 'help': None, 'unit': 'count', 'type': 'HISTOGRAM',
+                             'data': {'bounds': [1], 'events': [1, 0], 'nevents': 1, 'max_value': 1}}}
+        merged = merge_snapshots([snapshot, snapshot])
+        self.assertEqual(merged['hist']['label'], 'Hist')
+        self.assertEqual(merged['hist']['data']['events'], [2, 0])
@@ -0,0 +1,54 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+
+from dnaco.util.lru_cache import SizedLruCache
+
+
+class TestSizedLruCache(TestCase):
+    def test_size_eviction(self):
+        cache = SizedLruCache(10)
+        self.assertEqual(cache.put('a', b'aaaa'), 0)
+        self.assertEqual(cache.put('b', b'bbbb'), 0)
+        self.assertEqual(cache.get('a'), b'aaaa')
+        # 'b' is the least recently used
+        self.assertEqual(cache.put('c', b'cccc'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'aaaa')
+        self.assertEqual(cache.size, 8)
+
+        # too large to be stored
+        self.assertEqual(cache.put('d', b'd' * 11), 0)
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(len(cache), 2)
+
+    def test_no_copy(self):
+        data = bytearray(b'x' * 100)
+        cache = SizedLruCache(1000)
+        cache.put('view', memoryview(data)[10:20])
+        self.assertIs(cache.get('view').obj, data)
+        self.assertEqual(cache.size, 10)
+
+    def test_ttl(self):
+        cache = SizedLruCache(100, default_ttl_ns=10)
+        cache.put('a', b'a', now=100)
+        cache.put('b', b'b', ttl_ns=100, now=100)
+        self.assertEqual(cache.get('a', now=105), b'a')
+        self.assertIsNone(cache.get('a', now=110))
+        self.assertEqual(cache.size, 1)
+        self.assertEqual(cache.remove_expired(now=200), 1)
+        self.assertEqual(len(cache), 0)